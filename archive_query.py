@@ -0,0 +1,364 @@
+import os
+import sys
+import csv
+import json
+import click
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+import metadata_index
+import extract_report_data
+from sample_record import SampleRecord, SAMPLE_FIELDS, NUMERIC_FIELDS, MARKER_BITS, marker_names
+
+
+"""
+Archive-wide queries over the sample records of every COWBAT run.
+
+The SampleRecords built by extract_report_data.load_run_samples() for every combinedMetadata.csv in the archive are
+kept in the SeqID index database, with secondary indexes on the columns queries filter on. Like the SeqID index, the
+sample table is refreshed incrementally: a run folder is only re-read when its combinedMetadata.csv or GDCS.csv has
+changed since it was last ingested.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+SAMPLE_ATTRIBUTES = tuple(attribute for attribute, column in SAMPLE_FIELDS)
+
+SAMPLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sample_files (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    gdcs_mtime REAL,
+    gdcs_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    path TEXT,
+    run_folder TEXT,
+    run_date TEXT,
+    mtime REAL,
+    markers INTEGER,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS samples_seq_id ON samples (seq_id);
+CREATE INDEX IF NOT EXISTS samples_path ON samples (path);
+CREATE INDEX IF NOT EXISTS samples_genus ON samples (genus);
+CREATE INDEX IF NOT EXISTS samples_mash ON samples (mash_reference_genome);
+CREATE INDEX IF NOT EXISTS samples_serovar ON samples (sistr_serovar);
+CREATE INDEX IF NOT EXISTS samples_mlst ON samples (mlst_result);
+CREATE INDEX IF NOT EXISTS samples_rmlst ON samples (rmlst_result);
+CREATE INDEX IF NOT EXISTS samples_markers ON samples (markers);
+CREATE INDEX IF NOT EXISTS samples_run_date ON samples (run_date);
+""".format(columns=',\n    '.join('{} {}'.format(attribute, 'NUMERIC' if attribute in NUMERIC_FIELDS else 'TEXT')
+                                 for attribute in SAMPLE_ATTRIBUTES))
+
+# Time a sample's run started, in seconds since the epoch, as computed by metadata_index.get_run_time()
+RUN_TIME_SQL = "COALESCE(CAST(strftime('%s', {table}.run_date) AS REAL), {table}.mtime)"
+
+# Columns written by write_csv(): the report columns each field was read from, then the run details
+OUTPUT_COLUMNS = tuple(column for attribute, column in SAMPLE_FIELDS) + ('RunFolder', 'RunDate', 'Markers')
+
+
+def connect_store(index_path=metadata_index.INDEX_PATH):
+    """
+    :param index_path: Path to the SeqID index database
+    :return: sqlite3 connection to the index database with the sample tables created
+    """
+    con = metadata_index.connect_index(index_path)
+    con.executescript(SAMPLE_SCHEMA)
+    return con
+
+
+def get_file_state(path):
+    """
+    :param path: Path to a report file
+    :return: Tuple of (mtime, size), or (None, None) if the file doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_mtime, stat.st_size
+
+
+def load_records(metadata_report, seq_list):
+    """
+    :param metadata_report: Path to the run's combinedMetadata.csv
+    :param seq_list: Seq IDs held in the file according to the SeqID index
+    :return: List of SampleRecord objects, or None if the file couldn't be read
+    """
+    if not seq_list:
+        return []
+    try:
+        return extract_report_data.load_run_samples(metadata_report=metadata_report, seq_list=seq_list,
+                                                    expected_ids=seq_list)
+    except Exception as e:
+        logger.warning('Could not read {}: {}'.format(metadata_report, e))
+        return None
+
+
+def store_records(metadata_report, records, state, con):
+    """
+    :param metadata_report: Path to the run's combinedMetadata.csv
+    :param records: List of SampleRecord objects read from the run, or None if it couldn't be read
+    :param state: get_run_state() of the run taken before its reports were read. If the reports change while they are
+                  being read, the stored state no longer matches and the run is read again on the next refresh.
+    :param con: Connection retrieved from connect_store()
+    :return: Number of sample records stored
+    """
+    # Leave the run to be retried on the next refresh
+    if records is None:
+        return 0
+
+    mtime, size, gdcs_mtime, gdcs_size = state
+    run_folder = metadata_index.get_run_folder(metadata_report)
+    run_date = metadata_index.get_run_date(run_folder)
+
+    con.execute('DELETE FROM samples WHERE path = ?', (metadata_report,))
+    con.executemany('INSERT INTO samples (path, run_folder, run_date, mtime, markers, {}) VALUES ({})'.format(
+                        ', '.join(SAMPLE_ATTRIBUTES), ', '.join('?' * (5 + len(SAMPLE_ATTRIBUTES)))),
+                    [(metadata_report, run_folder, run_date, mtime, record.markers) +
+                     tuple(getattr(record, attribute) for attribute in SAMPLE_ATTRIBUTES) for record in records])
+    con.execute('INSERT OR REPLACE INTO sample_files (path, mtime, size, gdcs_mtime, gdcs_size) '
+                'VALUES (?, ?, ?, ?, ?)', (metadata_report, mtime, size, gdcs_mtime, gdcs_size))
+    return len(records)
+
+
+def remove_report(metadata_report, con):
+    """
+    Drops the stored sample records and SeqID index entries of a run folder that is no longer in the archive
+    :param metadata_report: Path to the run's combinedMetadata.csv
+    :param con: Connection retrieved from connect_store()
+    """
+    con.execute('DELETE FROM samples WHERE path = ?', (metadata_report,))
+    con.execute('DELETE FROM sample_files WHERE path = ?', (metadata_report,))
+    metadata_index.remove_report(metadata_report, con)
+
+
+def get_run_state(metadata_report):
+    """
+    :param metadata_report: Path to a run's combinedMetadata.csv
+    :return: Tuple of (mtime, size) of the run's combinedMetadata.csv followed by (mtime, size) of its GDCS.csv
+    """
+    return get_file_state(metadata_report) + get_file_state(os.path.join(os.path.dirname(metadata_report), 'GDCS.csv'))
+
+
+def refresh_runs(con, report_list, ingested, store, workers=extract_report_data.SCAN_WORKERS, prune=True):
+    """
+    Brings the SeqID index up to date and re-reads every run whose combinedMetadata.csv or GDCS.csv has changed since it
+    was last ingested. Shared by update_samples() and columnar_store.update_store(), which differ only in where the
+    sample records are kept.
+    :param con: Connection to the SeqID index database
+    :param report_list: List of combinedMetadata.csv paths
+    :param ingested: Dictionary containing combinedMetadata.csv paths as keys and the get_run_state() they were last
+                     ingested with as values
+    :param store: Function called with the combinedMetadata.csv path, the list of SampleRecord objects read from the run
+                  and its get_run_state() taken before the run was read, for every run read. Always called on this
+                  thread.
+    :param workers: Number of run folders to read concurrently
+    :param prune: Passed on to metadata_index.update_index()
+    :return: List of the combinedMetadata.csv paths of the run folders that were (re)ingested. Runs that couldn't be
+             read are left out, to be retried on the next refresh.
+    """
+    metadata_index.update_index(report_list=report_list, id_column='SeqID', con=con, prune=prune,
+                                use_cache=extract_report_data.USE_NAS_CACHE)
+
+    stale_states = {}
+    for report in report_list:
+        state = get_run_state(report)
+        if state[0] is not None and ingested.get(report) != state:
+            stale_states[report] = state
+    stale_reports = list(stale_states)
+
+    seq_lists = {}
+    for report in stale_reports:
+        seq_lists[report] = [seqid for seqid, in con.execute('SELECT seqid FROM seqid_index WHERE path = ?',
+                                                             (report,))]
+
+    # Parse the changed runs concurrently; the records are stored from this thread
+    stored = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        loaded = executor.map(instrumentation.propagate(lambda report: load_records(report, seq_lists[report])),
+                              stale_reports)
+        for report, records in zip(stale_reports, loaded):
+            # Leave the run to be retried on the next refresh
+            if records is None:
+                continue
+            store(report, records, stale_states[report])
+            stored.append(report)
+    return stored
+
+
+def update_samples(con, report_list=None, workers=extract_report_data.SCAN_WORKERS, prune=True):
+    """
+    Brings the SeqID index and the sample table up to date with the archive. Run folders whose combinedMetadata.csv
+    and GDCS.csv haven't changed are skipped.
+    :param con: Connection retrieved from connect_store()
+    :param report_list: List of combinedMetadata.csv paths. Defaults to every run folder in the archive.
+    :param workers: Number of run folders to read concurrently
+    :param prune: report_list is every run folder in the archive, so stored runs missing from it are dropped. Pass
+                  False to refresh only a subset of the archive.
+    :return: List of the combinedMetadata.csv paths of the run folders that were (re)ingested
+    """
+    if report_list is None:
+        report_list = extract_report_data.list_reports('combinedMetadata.csv')
+
+    ingested = {path: (mtime, size, gdcs_mtime, gdcs_size) for path, mtime, size, gdcs_mtime, gdcs_size in
+                con.execute('SELECT path, mtime, size, gdcs_mtime, gdcs_size FROM sample_files')}
+    updated = refresh_runs(con, report_list=report_list, ingested=ingested,
+                           store=lambda report, records, state: store_records(report, records, state, con),
+                           workers=workers, prune=prune)
+
+    if prune:
+        for report in set(ingested) - set(report_list):
+            remove_report(report, con)
+
+    con.commit()
+    return updated
+
+
+def query_samples(con, genus=None, mash=None, serovar=None, mlst=None, rmlst=None, markers=(), since=None,
+                  until=None, all_runs=False):
+    """
+    Finds the stored samples matching every filter provided
+    :param con: Connection retrieved from connect_store()
+    :param genus: Genus, i.e. 'Salmonella'
+    :param mash: MASH reference genome, i.e. 'Salmonella enterica'
+    :param serovar: SISTR serovar, i.e. 'Enteritidis'
+    :param mlst: MLST result, i.e. '11'
+    :param rmlst: rMLST result
+    :param markers: Marker names from sample_record.MARKER_BITS that must all have been detected
+    :param since: Earliest run date to include, as an ISO date string
+    :param until: Latest run date to include, as an ISO date string
+    :param all_runs: Return a row for every run a Seq ID was sequenced in. By default only the record from the most
+                     recent run is considered, as with a ROGA.
+    :return: Generator of dictionaries holding the SampleRecord fields, run_folder, run_date and the markers bitset
+    """
+    conditions = []
+    parameters = []
+    for column, value in (('genus', genus), ('mash_reference_genome', mash), ('sistr_serovar', serovar),
+                          ('mlst_result', mlst), ('rmlst_result', rmlst)):
+        if value is not None:
+            conditions.append('samples.{} = ?'.format(column))
+            parameters.append(value)
+
+    if markers:
+        mask = 0
+        for marker in markers:
+            mask |= MARKER_BITS[marker]
+        conditions.append('samples.markers & ? = ?')
+        parameters += [mask, mask]
+
+    if since is not None:
+        conditions.append('samples.run_date >= ?')
+        parameters.append(since)
+    if until is not None:
+        conditions.append('samples.run_date <= ?')
+        parameters.append(until)
+
+    # Same precedence as metadata_index.get_run_order_key(): latest run date wins (the file's mtime if the run folder
+    # isn't named after a date), then the newest file, then ties are broken on path
+    if not all_runs:
+        conditions.append('NOT EXISTS (SELECT 1 FROM samples AS newer WHERE newer.seq_id = samples.seq_id AND '
+                          '({newer} > {current} OR ({newer} = {current} AND (newer.mtime > samples.mtime OR '
+                          '(newer.mtime = samples.mtime AND newer.path < samples.path)))))'.format(
+                              newer=RUN_TIME_SQL.format(table='newer'), current=RUN_TIME_SQL.format(table='samples')))
+
+    query = 'SELECT run_folder, run_date, markers, {} FROM samples'.format(', '.join(SAMPLE_ATTRIBUTES))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY run_date, seq_id'
+
+    for row in con.execute(query, parameters):
+        record = SampleRecord(run_folder=row[0], **dict(zip(SAMPLE_ATTRIBUTES, row[3:])))
+        sample = record.to_dict()
+        sample['run_date'] = row[1]
+        sample['markers'] = row[2]
+        yield sample
+
+
+def write_csv(samples, output):
+    """
+    :param samples: Generator retrieved from query_samples()
+    :param output: File object to write to
+    :return: Number of samples written
+    """
+    writer = csv.writer(output)
+    writer.writerow(OUTPUT_COLUMNS)
+    count = 0
+    for sample in samples:
+        writer.writerow([sample[attribute] if sample[attribute] is not None else ''
+                         for attribute in SAMPLE_ATTRIBUTES] +
+                        [sample['run_folder'], sample['run_date'] or '', ';'.join(marker_names(sample['markers']))])
+        count += 1
+    return count
+
+
+def write_json(samples, output):
+    """
+    Writes a JSON array one sample at a time, so results are streamed rather than built up in memory
+    :param samples: Generator retrieved from query_samples()
+    :param output: File object to write to
+    :return: Number of samples written
+    """
+    count = 0
+    output.write('[')
+    for sample in samples:
+        sample = dict(sample, markers=marker_names(sample['markers']))
+        output.write((',\n' if count else '\n') + json.dumps(sample))
+        count += 1
+    output.write('\n]\n')
+    return count
+
+
+@click.command()
+@click.option('--genus', help='i.e. Salmonella')
+@click.option('--mash', help='MASH reference genome, i.e. "Salmonella enterica"')
+@click.option('--serovar', help='SISTR serovar, i.e. Enteritidis')
+@click.option('--mlst', help='MLST result')
+@click.option('--rmlst', help='rMLST result')
+@click.option('--marker', 'markers', multiple=True, type=click.Choice(sorted(MARKER_BITS)),
+              help='Marker that must be detected. Can be given more than once.')
+@click.option('--since', help='Earliest run date, YYYY-MM-DD')
+@click.option('--until', help='Latest run date, YYYY-MM-DD')
+@click.option('--all-runs', is_flag=True, help='Return every run a Seq ID was sequenced in, not only the newest')
+@click.option('--format', 'output_format', default='csv', show_default=True, type=click.Choice(['csv', 'json']))
+@click.option('--output', default='-', show_default=True, help="File to write results to, or '-' for stdout")
+@click.option('--refresh', is_flag=True,
+              help='Check the archive for new or changed runs before answering. Not needed while archive_watcher is '
+                   'keeping the sample store up to date.')
+@click.option('--index', 'index_path', default=metadata_index.INDEX_PATH, show_default=True,
+              help='Path to the SeqID index database')
+def query(genus, mash, serovar, mlst, rmlst, markers, since, until, all_runs, output_format, output, refresh,
+          index_path):
+    """
+    Searches the sample records of every run in the archive.
+
+    Answers from the sample store as it is, without globbing the archive, unless --refresh is given or the store has
+    never been filled.
+    """
+    instrumentation.configure_logging()
+    con = connect_store(index_path)
+    try:
+        # An empty store hasn't been filled by archive_watcher or an earlier --refresh yet
+        if refresh or con.execute('SELECT 1 FROM sample_files LIMIT 1').fetchone() is None:
+            updated = update_samples(con)
+            if updated:
+                logger.info('Ingested {} run folders'.format(len(updated)))
+
+        samples = query_samples(con, genus=genus, mash=mash, serovar=serovar, mlst=mlst, rmlst=rmlst,
+                                markers=markers, since=since, until=until, all_runs=all_runs)
+        writer = write_json if output_format == 'json' else write_csv
+        if output == '-':
+            count = writer(samples, sys.stdout)
+        else:
+            with open(output, 'w', newline='') as f:
+                count = writer(samples, f)
+        logger.info('{} samples found'.format(count))
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    query()
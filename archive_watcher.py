@@ -0,0 +1,271 @@
+import os
+import time
+import click
+
+import instrumentation
+import metadata_index
+import archive_query
+import extract_report_data
+
+
+"""
+Watches the COWBAT archive and ingests new or changed run folders as they appear.
+
+Each run folder's reports/combinedMetadata.csv and reports/GDCS.csv are tracked by mtime and size. A run is ingested
+into the SeqID index and the archive_query sample store once both files have stopped changing for SETTLE_SECONDS, so
+reports that are still being written are never read half-finished. Ingesting a run also copies its reports into the
+nas_cache. Lookups made with extract_report_data.REFRESH_INDEX off (i.e. roga_service --watched) trust the index
+instead of globbing and statting the whole archive, so the first ROGA for a new run neither rescans nor rereads the
+NAS. Such lookups still refresh the index when it doesn't know a requested Seq ID, i.e. one from a run that hasn't
+settled yet.
+
+inotify (through the optional inotify_simple package) is used to pick up changes as soon as they happen. The archive
+is still rescanned every INOTIFY_RESCAN_SECONDS, since inotify doesn't see changes made by other NFS clients. Without
+inotify_simple, or with --poll, the archive is rescanned every POLL_SECONDS instead.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Seconds a run's reports must be unchanged before they are ingested
+SETTLE_SECONDS = 30
+
+# Seconds between rescans of the archive when polling
+POLL_SECONDS = 60
+
+# Seconds between rescans of the archive when inotify is available
+INOTIFY_RESCAN_SECONDS = 900
+
+
+class RunWatcher(object):
+    """
+    Tracks the state of every run's reports and ingests runs once their reports have settled
+    """
+
+    def __init__(self, con, settle_seconds=SETTLE_SECONDS):
+        """
+        :param con: Connection retrieved from archive_query.connect_store()
+        :param settle_seconds: Seconds a run's reports must be unchanged before they are ingested
+        """
+        self.con = con
+        self.settle_seconds = settle_seconds
+        # Runs as they were last ingested, from the sample store
+        self.ingested = {path: (mtime, size, gdcs_mtime, gdcs_size) for path, mtime, size, gdcs_mtime, gdcs_size in
+                         con.execute('SELECT path, mtime, size, gdcs_mtime, gdcs_size FROM sample_files')}
+        # Runs waiting to settle: {path: (state, time the state was first seen)}
+        self.pending = {}
+
+    def check(self, report_list, complete=False):
+        """
+        Queues any run whose reports differ from what was last ingested
+        :param report_list: List of combinedMetadata.csv paths to check
+        :param complete: report_list is every run in the archive, so stored runs missing from it are dropped
+        """
+        now = time.time()
+        for report in report_list:
+            state = archive_query.get_run_state(report)
+            if state[0] is None:
+                continue
+            if state == self.ingested.get(report):
+                self.pending.pop(report, None)
+            elif report not in self.pending or self.pending[report][0] != state:
+                # Restart the settle timer whenever the reports are still changing
+                self.pending[report] = (state, now)
+
+        if complete:
+            for report in set(self.ingested) - set(report_list):
+                logger.info('Run folder {} was removed'.format(metadata_index.get_run_folder(report)))
+                archive_query.remove_report(report, self.con)
+                del self.ingested[report]
+                self.pending.pop(report, None)
+            self.con.commit()
+
+    def ingest_settled(self):
+        """
+        Ingests every queued run whose reports haven't changed for settle_seconds. Runs that couldn't be read stay
+        queued and are retried once another settle_seconds have passed.
+        :return: Number of runs ingested
+        """
+        now = time.time()
+        settled = []
+        for report, (state, since) in list(self.pending.items()):
+            current = archive_query.get_run_state(report)
+            if current[0] is None or current == self.ingested.get(report):
+                # Removed, or changed back to what was last ingested
+                del self.pending[report]
+            elif current != state:
+                self.pending[report] = (current, now)
+            elif now - since >= self.settle_seconds:
+                settled.append(report)
+
+        if not settled:
+            return 0
+
+        stored = set(archive_query.update_samples(self.con, report_list=settled, prune=False))
+        for report in settled:
+            state, since = self.pending.pop(report)
+            if report in stored:
+                self.ingested[report] = state
+                logger.info('Ingested run folder {}'.format(metadata_index.get_run_folder(report)))
+            else:
+                self.pending[report] = (state, now)
+                logger.warning('Could not ingest run folder {}, retrying in {} seconds'.format(
+                    metadata_index.get_run_folder(report), self.settle_seconds))
+        return len(stored)
+
+    def next_deadline(self):
+        """
+        :return: Time the next queued run could settle, or None if nothing is queued
+        """
+        if not self.pending:
+            return None
+        return min(since for state, since in self.pending.values()) + self.settle_seconds
+
+
+class InotifyNotifier(object):
+    """
+    Watches the archive root, every run folder and every reports folder, and reports which run folders changed
+    """
+
+    def __init__(self, root):
+        """
+        :param root: Root of the COWBAT archive
+        """
+        # Optional dependency, only needed for inotify support
+        from inotify_simple import INotify, flags
+
+        self.flags = flags
+        self.root = root
+        self.inotify = INotify()
+        self.watches = {}
+        self.watch(root)
+        for run_dir in os.listdir(root):
+            self.watch_run(os.path.join(root, run_dir))
+
+    def watch(self, directory):
+        """
+        :param directory: Directory to watch for created, written, moved and deleted files
+        """
+        mask = (self.flags.CREATE | self.flags.CLOSE_WRITE | self.flags.MOVED_TO | self.flags.MOVED_FROM |
+                self.flags.DELETE | self.flags.DELETE_SELF)
+        try:
+            self.watches[self.inotify.add_watch(directory, mask)] = directory
+        except OSError as e:
+            # Out of watches or the directory went away; the periodic rescan still covers it
+            logger.warning('Could not watch {}: {}'.format(directory, e))
+
+    def watch_run(self, run_dir):
+        """
+        :param run_dir: Run folder to watch, along with its reports folder if it exists yet
+        """
+        if os.path.isdir(run_dir):
+            self.watch(run_dir)
+            if os.path.isdir(os.path.join(run_dir, 'reports')):
+                self.watch(os.path.join(run_dir, 'reports'))
+
+    def read(self, timeout):
+        """
+        :param timeout: Seconds to wait for events
+        :return: Set of run folders that had changes
+        """
+        changed = set()
+        for event in self.inotify.read(timeout=max(0, int(timeout * 1000))):
+            directory = self.watches.get(event.wd)
+            if directory is None:
+                continue
+            if event.mask & self.flags.IGNORED:
+                del self.watches[event.wd]
+                continue
+
+            if directory == self.root:
+                run_dir = os.path.join(self.root, event.name)
+                if event.mask & (self.flags.CREATE | self.flags.MOVED_TO):
+                    self.watch_run(run_dir)
+            elif os.path.basename(directory) == 'reports':
+                run_dir = os.path.dirname(directory)
+            else:
+                run_dir = directory
+                if event.name == 'reports' and event.mask & (self.flags.CREATE | self.flags.MOVED_TO):
+                    self.watch(os.path.join(run_dir, 'reports'))
+            changed.add(run_dir)
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+
+def open_notifier(root):
+    """
+    :param root: Root of the COWBAT archive
+    :return: InotifyNotifier, or None if inotify isn't available
+    """
+    try:
+        return InotifyNotifier(root)
+    except ImportError:
+        logger.warning('inotify_simple is not installed, polling the archive every {} seconds'.format(POLL_SECONDS))
+    except OSError as e:
+        logger.warning('Could not start inotify ({}), polling the archive every {} seconds'.format(e, POLL_SECONDS))
+    return None
+
+
+def watch_archive(index_path=metadata_index.INDEX_PATH, use_inotify=True, poll_seconds=POLL_SECONDS,
+                  settle_seconds=SETTLE_SECONDS):
+    """
+    Ingests new and changed run folders until interrupted
+    :param index_path: Path to the SeqID index database
+    :param use_inotify: Use inotify when available rather than only polling
+    :param poll_seconds: Seconds between rescans of the archive when polling
+    :param settle_seconds: Seconds a run's reports must be unchanged before they are ingested
+    """
+    con = archive_query.connect_store(index_path)
+    watcher = RunWatcher(con, settle_seconds=settle_seconds)
+    notifier = open_notifier(extract_report_data.WGSSPADES_DIR) if use_inotify else None
+    rescan_seconds = INOTIFY_RESCAN_SECONDS if notifier is not None else poll_seconds
+
+    next_rescan = 0
+    try:
+        while True:
+            now = time.time()
+            if now >= next_rescan:
+                watcher.check(extract_report_data.list_reports('combinedMetadata.csv'), complete=True)
+                next_rescan = now + rescan_seconds
+            watcher.ingest_settled()
+
+            # Sleep until the next rescan, or until the next queued run could have settled
+            wake = next_rescan
+            deadline = watcher.next_deadline()
+            if deadline is not None:
+                wake = min(wake, deadline)
+            timeout = max(0, wake - time.time())
+
+            if notifier is None:
+                time.sleep(timeout)
+            else:
+                for run_dir in notifier.read(timeout):
+                    watcher.check([os.path.join(run_dir, 'reports', 'combinedMetadata.csv')])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if notifier is not None:
+            notifier.close()
+        con.close()
+
+
+@click.command()
+@click.option('--poll', is_flag=True, help='Only poll the archive, i.e. when inotify events are not delivered (NFS)')
+@click.option('--poll-seconds', default=POLL_SECONDS, show_default=True, help='Seconds between archive rescans')
+@click.option('--settle-seconds', default=SETTLE_SECONDS, show_default=True,
+              help='Seconds reports must be unchanged before they are ingested')
+@click.option('--index', 'index_path', default=metadata_index.INDEX_PATH, show_default=True,
+              help='Path to the SeqID index database')
+def watch(poll, poll_seconds, settle_seconds, index_path):
+    """
+    Keeps the SeqID index and sample store up to date as COWBAT runs finish
+    """
+    instrumentation.configure_logging()
+    watch_archive(index_path=index_path, use_inotify=not poll, poll_seconds=poll_seconds,
+                  settle_seconds=settle_seconds)
+
+
+if __name__ == '__main__':
+    watch()
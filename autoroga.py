@@ -0,0 +1,177 @@
+import time
+
+# Taken before anything else is imported so the startup time --timings reports includes importing click
+START_TIME = time.perf_counter()
+
+import sys
+import builtins
+import threading
+import click
+
+
+"""
+Command line entry point for AutoROGA.
+
+    python autoroga.py validate --genus Escherichia 2017-SEQ-0773 2017-SEQ-0772
+    python autoroga.py preview --genus Listeria --lab GTA-CFIA --source flour 2017-SEQ-1222
+    python autoroga.py generate --genus Listeria --lab GTA-CFIA --source flour 2017-SEQ-1222
+    python autoroga.py batch manifest.csv
+
+Only this module and click are imported to parse the command line. The module a subcommand lives in is imported once
+that subcommand is picked, and pylatex, SQLAlchemy and ReportLab are only imported once the subcommand needs them, so
+quick calls such as validate and preview don't pay for the PDF and database stack. Reports are read and validated
+without pandas, so neither command imports it. --timings prints how long
+the imports took, and how long the command itself ran, to stderr.
+"""
+
+
+# Subcommands that live in other modules: {name: (module, attribute, short help)}. The short help is repeated here so
+# that --help doesn't have to import every module to list the subcommands.
+lazy_commands = {
+    'preview': ('report_preview', 'preview', 'Previews a ROGA without allocating a report ID or compiling a PDF'),
+    'generate': ('generate_roga', 'generate', 'Generates a ROGA'),
+    'batch': ('batch_roga', 'batch', 'Generates a ROGA for every report spec in a manifest'),
+    'query': ('archive_query', 'query', 'Queries samples across the whole archive'),
+    'watch': ('archive_watcher', 'watch', 'Keeps the SeqID index and sample store up to date as COWBAT runs finish'),
+    'service': ('roga_service', 'service', 'Runs the resident ROGA service'),
+    'store': ('columnar_store', 'store', 'Writes new or changed runs to the columnar sample store'),
+}
+
+# Imports timed by the --timings import hook: [depth, module, seconds], in the order they started
+import_times = []
+_import_state = threading.local()
+
+
+def install_import_timer():
+    """
+    Wraps the import statement so the first import of every top-level module is timed. Only imports made after this
+    is called are recorded.
+    """
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        module = name.partition('.')[0]
+        if level or module in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+
+        depth = getattr(_import_state, 'depth', 0)
+        entry = [depth, module, None]
+        import_times.append(entry)
+        _import_state.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            _import_state.depth = depth
+            entry[2] = time.perf_counter() - start
+
+    builtins.__import__ = timed_import
+
+
+def print_timings(command_start, max_depth=1, min_seconds=0.001):
+    """
+    :param command_start: time.perf_counter() value when the subcommand started running
+    :param max_depth: Deepest nested import listed
+    :param min_seconds: Quicker imports aren't listed
+    """
+    end = time.perf_counter()
+    lines = ['Import time (ms, including nested imports):']
+    lines += ['    {:<28} {:>8.1f}'.format('  ' * depth + module, seconds * 1000)
+              for depth, module, seconds in import_times
+              if depth <= max_depth and seconds is not None and seconds >= min_seconds]
+    lines += ['Startup (ms):  {:>8.1f}'.format((command_start - START_TIME) * 1000),
+              'Command (ms):  {:>8.1f}'.format((end - command_start) * 1000),
+              'Total (ms):    {:>8.1f}'.format((end - START_TIME) * 1000)]
+    click.echo('\n'.join(lines), err=True)
+
+
+class LazyGroup(click.Group):
+    """
+    Click group that imports the module holding a subcommand only when that subcommand is run
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(super(LazyGroup, self).list_commands(ctx)) | set(lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in lazy_commands:
+            module_name, attribute, short_help = lazy_commands[cmd_name]
+            __import__(module_name)
+            return getattr(sys.modules[module_name], attribute)
+        return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        rows = [(name, lazy_commands[name][2] if name in lazy_commands else self.commands[name].get_short_help_str())
+                for name in self.list_commands(ctx)]
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
+@click.option('--timings', is_flag=True, help='Print import and run times to stderr once the command finishes')
+@click.pass_context
+def cli(ctx, timings):
+    """
+    Generates OLC reports of genomic analysis (ROGA) from COWBAT output
+    """
+    if timings:
+        command_start = time.perf_counter()
+        ctx.call_on_close(lambda: print_timings(command_start))
+
+
+@cli.command()
+@click.argument('seq_ids', nargs=-1, required=True)
+@click.option('--genus', required=True, help='Expected genus, i.e. Escherichia, Listeria or Salmonella')
+def validate(seq_ids, genus):
+    """
+    Checks samples before a ROGA is generated.
+
+    SEQ_IDS are checked against the expected genus and the genus' marker and MASH checks, without building a report.
+    Prints one line per Seq ID and exits with 1 if any sample would be left out of the ROGA.
+    """
+    import extract_report_data
+    import instrumentation
+    from genus_specs import genus_specs, describe_failed_check
+
+    instrumentation.configure_logging()
+    # Each sample is reported once, in the order given
+    seq_list = list(dict.fromkeys(seq_ids))
+    metadata_reports = extract_report_data.load_sample_data(seq_list)
+    flags = extract_report_data.validate_samples(seq_list=seq_list, genus=genus, metadata_reports=metadata_reports)
+    spec = genus_specs.get(genus)
+
+    excluded = 0
+    for seqid in seq_list:
+        if seqid not in metadata_reports:
+            status, notes = 'excluded', ['Not found in the archive']
+        elif not flags['genus'][seqid]:
+            status, notes = 'excluded', ['Observed genus {} does not match the expected genus of {}'.format(
+                metadata_reports[seqid].genus, genus)]
+        else:
+            notes = []
+            for check in spec['checks'] if spec is not None else ():
+                if flags[check][seqid]:
+                    continue
+                if check == 'mash':
+                    notes.append('MASH reference genome {} does not match {}'.format(
+                        metadata_reports[seqid].mash_reference_genome, spec['species']))
+                else:
+                    notes.append(describe_failed_check(check, spec))
+            status = 'warning' if notes else 'ok'
+        if status == 'excluded':
+            excluded += 1
+        click.echo('\t'.join([seqid, status, '; '.join(notes)]))
+
+    if excluded:
+        sys.exit(1)
+
+
+def main():
+    # The subcommand's module is imported while the arguments are parsed, so the hook has to go in beforehand
+    if '--timings' in sys.argv[1:]:
+        install_import_timer()
+    cli()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import instrumentation
+import metadata_index
+import extract_report_data
+
+
+"""
+Plans the archive reads for a batch of ROGAs.
+
+Reports in a batch often pull samples from the same sequencing runs. Rather than each report reading its own run
+folders, the planner looks every requested Seq ID up in the SeqID index, assigns each one to the newest run folder
+holding it (the run the ROGA would use anyway), and reads each of those run folders' combinedMetadata.csv and GDCS.csv
+once. Each report is then handed its own slice of the sample records, so the cost of a batch grows with the number of
+distinct run folders rather than with the number of reports.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+
+def assign_runs(report_rows):
+    """
+    :param report_rows: Dictionary retrieved from extract_report_data.find_report_rows()
+    :return: Dictionary containing combinedMetadata.csv paths as keys and the list of Seq IDs to read from each as
+             values. Every Seq ID is assigned to the newest report holding it, and reports with nothing assigned are
+             left out.
+    """
+    assigned = {}
+    runs = {}
+    for report in extract_report_data.order_newest_first(report_rows):
+        for seqid in report_rows[report]:
+            if seqid not in assigned:
+                assigned[seqid] = report
+                runs.setdefault(report, []).append(seqid)
+    return runs
+
+
+def plan_batch(seq_lists, index_path=metadata_index.INDEX_PATH, refresh=None):
+    """
+    :param seq_lists: List of Seq ID lists, one for each report in the batch
+    :param index_path: Path to the SeqID index database
+    :param refresh: Refresh the SeqID index before the lookup. Defaults to extract_report_data.REFRESH_INDEX.
+    :return: Plan dictionary:
+             seq_list - every requested Seq ID, once, in the order first requested
+             runs - dictionary of combinedMetadata.csv paths to the Seq IDs read from each
+             missing - Seq IDs the index doesn't know about
+             reports - the seq_lists the plan was made for
+    """
+    union_list = []
+    seen = set()
+    for seq_list in seq_lists:
+        for seqid in seq_list:
+            if seqid not in seen:
+                seen.add(seqid)
+                union_list.append(seqid)
+
+    report_rows = extract_report_data.find_report_rows(report_name='combinedMetadata.csv', seq_list=union_list,
+                                                       id_column='SeqID', index_path=index_path,
+                                                       refresh=refresh) if union_list else {}
+    runs = assign_runs(report_rows)
+    planned = {seqid for seqids in runs.values() for seqid in seqids}
+    return {'seq_list': union_list,
+            'runs': runs,
+            'missing': [seqid for seqid in union_list if seqid not in planned],
+            'reports': [list(seq_list) for seq_list in seq_lists]}
+
+
+def load_planned_samples(plan, workers=extract_report_data.SCAN_WORKERS):
+    """
+    Reads every run folder in the plan once
+    :param plan: Dictionary retrieved from plan_batch()
+    :param workers: Number of run folders to read concurrently
+    :return: Dictionary containing Seq IDs as keys and SampleRecord objects as values
+    """
+    logger.info('Reading {} run folders for {} samples across {} reports'.format(len(plan['runs']),
+                                                                              len(plan['seq_list']),
+                                                                              len(plan['reports'])))
+    if not plan['runs']:
+        return {}
+    with instrumentation.stage('scan'):
+        return extract_report_data.scan_archive(seq_list=plan['seq_list'], report_rows=plan['runs'], workers=workers)
+
+
+def slice_samples(plan, metadata_reports):
+    """
+    :param plan: Dictionary retrieved from plan_batch()
+    :param metadata_reports: Dictionary retrieved from load_planned_samples()
+    :return: List with a dictionary of Seq IDs to SampleRecord objects for each report, in the order of plan['reports']
+    """
+    return [{seqid: metadata_reports[seqid] for seqid in seq_list if seqid in metadata_reports}
+            for seq_list in plan['reports']]
@@ -0,0 +1,483 @@
+import os
+import io
+import re
+import csv
+import sys
+import json
+import time
+import click
+import asyncio
+import functools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_planner
+import database
+import extract_report_data
+import instrumentation
+import latex_compile
+import latex_format
+import pdf_cache
+import pdf_render
+import report_model
+from generate_roga import lab_info, supported_genera, template_version, render_backends, render_latex_document, \
+    get_report_filepath
+
+
+"""
+Batch ROGA generation.
+
+Takes many report specs (seq list, genus, lab, source) from a CSV or JSON manifest, reads each run folder holding a
+requested Seq ID once (see batch_planner), reserves all report IDs in a single transaction and then compiles the PDFs on
+a bounded worker pool. run_batch_async() (--async-pipeline) overlaps connecting to the database with reading the run
+folders, and building each report with compiling the ones before it.
+
+CSV manifests need the columns seq_list, genus, lab and source, with Seq IDs in seq_list separated by ';', ',' or
+whitespace. JSON manifests are a list of objects with the same keys; seq_list may be a list or a string.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Default number of reports compiled at once
+COMPILE_WORKERS = 4
+
+MANIFEST_FIELDS = ('seq_list', 'genus', 'lab', 'source')
+
+
+def parse_seq_list(value):
+    """
+    :param value: List of Seq IDs, or a string of Seq IDs separated by ';', ',' or whitespace
+    :return: List of OLC Seq IDs
+    """
+    if isinstance(value, (list, tuple)):
+        return [str(seqid).strip() for seqid in value if str(seqid).strip()]
+    return [seqid for seqid in re.split(r'[;,\s]+', value or '') if seqid]
+
+
+def read_manifest(manifest):
+    """
+    :param manifest: Path to a CSV or JSON manifest, or '-' to read it from stdin
+    :return: List of report spec dictionaries with seq_list, genus, lab and source keys
+    """
+    if manifest == '-':
+        text = sys.stdin.read()
+    else:
+        with open(manifest) as f:
+            text = f.read()
+
+    if text.lstrip().startswith(('[', '{')):
+        entries = json.loads(text)
+        # Allow {"reports": [...]} as well as a bare list
+        if isinstance(entries, dict):
+            entries = entries.get('reports', [])
+    else:
+        entries = list(csv.DictReader(io.StringIO(text)))
+
+    specs = []
+    for entry in entries:
+        spec = {field: (entry.get(field) or '') for field in MANIFEST_FIELDS}
+        spec['seq_list'] = parse_seq_list(spec['seq_list'])
+        spec['genus'] = str(spec['genus']).strip()
+        spec['lab'] = str(spec['lab']).strip()
+        spec['source'] = str(spec['source']).strip()
+        specs.append(spec)
+    return specs
+
+
+def check_spec(spec):
+    """
+    :param spec: Report spec dictionary
+    :return: Description of the problem with the spec, or None if it is valid
+    """
+    if not spec['seq_list']:
+        return 'No Seq IDs provided'
+    if spec['lab'] not in lab_info:
+        return 'Unknown laboratory "{}"'.format(spec['lab'])
+    if spec['genus'] not in supported_genera:
+        return 'Unsupported genus "{}"'.format(spec['genus'])
+    return None
+
+
+def compile_report(filepath, use_format=False):
+    """
+    Compiles a report written by run_batch() and times it
+    :param filepath: Path to the report without the file extension
+    :param use_format: Compile against a cached precompiled format of the shared preamble
+    :return: Tuple of (seconds taken, number of LaTeX passes)
+    """
+    start = time.time()
+    if use_format:
+        passes = latex_format.compile_with_format(filepath)
+    else:
+        passes = latex_compile.compile_tex(filepath)
+    return time.time() - start, passes
+
+
+def render_report_pdf(model, filepath):
+    """
+    Renders a report model with the ReportLab backend and times it
+    :param model: Dictionary retrieved from report_model.build_report_model()
+    :param filepath: Path to the report without the file extension
+    :return: Tuple of (seconds taken, number of LaTeX passes, which is always 0)
+    """
+    start = time.time()
+    pdf_render.render_pdf(model, filepath + '.pdf')
+    return time.time() - start, 0
+
+
+def new_results(specs):
+    """
+    :param specs: List of report spec dictionaries retrieved from read_manifest()
+    :return: List of per-report result dictionaries. Specs that fail check_spec() are already marked as failed.
+    """
+    results = []
+    for spec in specs:
+        results.append({'spec': spec, 'report_id': None, 'pdf': None, 'status': 'pending', 'error': None,
+                        'cached': False, 'build_time': 0.0, 'compile_time': 0.0, 'latex_passes': 0})
+        error = check_spec(spec)
+        if error:
+            results[-1].update(status='failed', error=error)
+    return results
+
+
+def load_batch_samples(pending):
+    """
+    Reads each run folder any of the reports needs once, then hands every report its own samples as result['samples']
+    :param pending: List of result dictionaries retrieved from new_results() that haven't failed
+    :return: Number of run folders read
+    """
+    plan = batch_planner.plan_batch([result['spec']['seq_list'] for result in pending])
+    metadata_reports = batch_planner.load_planned_samples(plan)
+    for result, samples in zip(pending, batch_planner.slice_samples(plan, metadata_reports)):
+        result['samples'] = samples
+    return len(plan['runs'])
+
+
+def check_report(result, output_dir, use_cache, backend):
+    """
+    Genus validation for a report, and reuse of an identical report that was already issued. The result is marked as
+    failed or cached if no new report has to be generated.
+    :param result: Result dictionary with the samples loaded by load_batch_samples()
+    :param output_dir: Directory the reports are written to
+    :param use_cache: Reuse previously issued PDFs for reports with identical content
+    :param backend: Rendering backend, one of generate_roga.render_backends
+    """
+    spec = result['spec']
+    metadata_reports = result['samples']
+    found_list = []
+    for seqid in spec['seq_list']:
+        if seqid in metadata_reports:
+            found_list.append(seqid)
+        else:
+            logger.warning('Seq ID {} was not found in the archive and was ignored.'.format(seqid))
+    result['validated_list'] = extract_report_data.generate_validated_list(seq_list=found_list,
+                                                                           genus=spec['genus'],
+                                                                           metadata_reports=metadata_reports)
+    if not result['validated_list']:
+        result.update(status='failed', error='No samples provided matched the expected genus')
+        return
+
+    # Reuse an identical report that was already issued
+    result['report_key'] = pdf_cache.get_report_key(metadata_reports={seqid: metadata_reports[seqid]
+                                                                      for seqid in result['validated_list']},
+                                                    genus=spec['genus'],
+                                                    lab=spec['lab'],
+                                                    source=spec['source'],
+                                                    template_version=template_version,
+                                                    backend=backend)
+    cached_report = pdf_cache.restore(result['report_key'], output_dir=output_dir) if use_cache else None
+    if cached_report is not None:
+        pdf_path, cached_metadata = cached_report
+        result.update(status='ok', cached=True, pdf=pdf_path, report_id=cached_metadata['report_id'])
+
+
+def get_id_requests(pending):
+    """
+    :param pending: List of result dictionaries that need a report ID
+    :return: List of (genus, lab, source) tuples for database.reserve_report_ids()
+    """
+    return [(result['spec']['genus'], result['spec']['lab'], result['spec']['source']) for result in pending]
+
+
+def build_report(result, date, output_dir, backend):
+    """
+    Builds a report's model, and writes its .tex file for the LaTeX backend. The result is marked as failed if the
+    document can't be built.
+    :param result: Result dictionary with a report ID
+    :param date: Date string the report is issued
+    :param output_dir: Directory the reports are written to
+    :param backend: Rendering backend, one of generate_roga.render_backends
+    """
+    spec = result['spec']
+    build_start = time.time()
+    try:
+        result['model'] = report_model.build_report_model(metadata_reports={seqid: result['samples'][seqid]
+                                                                            for seqid in result['validated_list']},
+                                                          genus=spec['genus'],
+                                                          lab=spec['lab'],
+                                                          source=spec['source'],
+                                                          report_id=result['report_id'],
+                                                          date=date)
+        filepath = os.path.abspath(get_report_filepath(report_id=result['report_id'],
+                                                       genus=spec['genus'],
+                                                       date=date,
+                                                       output_dir=output_dir))
+        if backend == 'latex':
+            render_latex_document(result['model']).generate_tex(filepath)
+        result['filepath'] = filepath
+    except Exception as e:
+        result.update(status='failed', error='Could not build document: {}'.format(e))
+    result['build_time'] = time.time() - build_start
+
+
+def produce_pdf(result, use_format, backend):
+    """
+    Compiles or renders the PDF of a report written by build_report()
+    :param result: Result dictionary
+    :param use_format: Compile against a cached precompiled format of the shared preamble
+    :param backend: Rendering backend, one of generate_roga.render_backends
+    :return: Tuple of (seconds taken, number of LaTeX passes)
+    """
+    if backend == 'reportlab':
+        return render_report_pdf(result['model'], result['filepath'])
+    return compile_report(result['filepath'], use_format)
+
+
+def finish_report(result, future, use_cache, date):
+    """
+    Records the outcome of produce_pdf() for a report, and caches the finished PDF
+    :param result: Result dictionary
+    :param future: Finished concurrent.futures.Future that ran produce_pdf()
+    :param use_cache: Store the PDF so identical reports can reuse it
+    :param date: Date string the report is issued
+    """
+    try:
+        result['compile_time'], result['latex_passes'] = future.result()
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+        return
+    result.update(status='ok', pdf=result['filepath'] + '.pdf')
+
+    # The report has been issued by now, so failing to cache it mustn't fail the report
+    if use_cache:
+        try:
+            pdf_cache.store(result['report_key'], result['pdf'], report_id=result['report_id'], date=date)
+        except Exception as e:
+            logger.warning('Could not cache {}: {}'.format(result['pdf'], e))
+
+
+def record_timings(run, results, timings):
+    """
+    :param run: Dictionary yielded by instrumentation.run()
+    :param results: List of per-report result dictionaries
+    :param timings: Dictionary of per-stage timings in seconds
+    """
+    # Stage times are measured per batch, so concurrent batches don't skew each other's summaries
+    for stage, seconds in timings.items():
+        if stage != 'total':
+            instrumentation.add_stage_time(stage, seconds)
+    run['generated'] = sum(1 for result in results if result['status'] == 'ok')
+
+
+def run_batch(specs, workers=COMPILE_WORKERS, output_dir='.', use_format=False, use_cache=True, backend='latex'):
+    """
+    Generates a ROGA for every spec
+    :param specs: List of report spec dictionaries retrieved from read_manifest()
+    :param workers: Number of reports compiled at once
+    :param output_dir: Directory the reports are written to
+    :param use_format: Compile against a cached precompiled format of the shared preamble
+    :param use_cache: Reuse previously issued PDFs for reports with identical content
+    :param backend: Rendering backend, one of generate_roga.render_backends
+    :return: Tuple of (list of per-report result dictionaries, dictionary of per-stage timings in seconds)
+    """
+    with instrumentation.run('batch_roga', reports=len(specs), backend=backend) as run:
+        timings = {}
+        batch_start = time.time()
+        date = datetime.today().strftime('%Y-%m-%d')
+        year = datetime.today().strftime('%Y')
+        os.makedirs(output_dir, exist_ok=True)
+
+        results = new_results(specs)
+        pending = [result for result in results if result['status'] == 'pending']
+
+        # DATA STAGE: read each run folder any report needs once
+        stage_start = time.time()
+        run['run_folders'] = load_batch_samples(pending)
+        timings['data'] = time.time() - stage_start
+
+        # Genus validation for each report
+        stage_start = time.time()
+        for result in pending:
+            check_report(result, output_dir=output_dir, use_cache=use_cache, backend=backend)
+        pending = [result for result in pending if result['status'] == 'pending']
+        timings['validation'] = time.time() - stage_start
+
+        # DATABASE HANDLING: reserve every report ID in one transaction
+        stage_start = time.time()
+        if pending:
+            report_ids = database.reserve_report_ids(reports=get_id_requests(pending), date=date, year=year)
+            for result, report_id in zip(pending, report_ids):
+                result['report_id'] = report_id
+        timings['database'] = time.time() - stage_start
+
+        # Build each report model, and write its .tex file for the LaTeX backend
+        stage_start = time.time()
+        for result in pending:
+            build_report(result, date=date, output_dir=output_dir, backend=backend)
+        pending = [result for result in pending if result['status'] == 'pending']
+        timings['build'] = time.time() - stage_start
+
+        # Compile or render the PDFs on a bounded worker pool
+        stage_start = time.time()
+        produce = instrumentation.propagate(produce_pdf)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [(result, executor.submit(produce, result, use_format, backend)) for result in pending]
+            for result, future in futures:
+                finish_report(result, future, use_cache=use_cache, date=date)
+        timings['compile'] = time.time() - stage_start
+
+        timings['total'] = time.time() - batch_start
+        record_timings(run, results, timings)
+    return results, timings
+
+
+async def run_batch_async(specs, workers=COMPILE_WORKERS, output_dir='.', use_format=False, use_cache=True,
+                          backend='latex'):
+    """
+    Generates a ROGA for every spec like run_batch(), but overlaps stages that wait on different resources. A database
+    connection is checked out while the run folders are read, and each report is built while the reports before it
+    compile. The reports, and their IDs, are the same as run_batch() would produce: IDs are still only allocated once
+    validation and the PDF cache have shown which reports need one, so no ID is spent on a report that isn't issued.
+    Run it with asyncio.run().
+    :param specs: List of report spec dictionaries retrieved from read_manifest()
+    :param workers: Number of reports compiled at once
+    :param output_dir: Directory the reports are written to
+    :param use_format: Compile against a cached precompiled format of the shared preamble
+    :param use_cache: Reuse previously issued PDFs for reports with identical content
+    :param backend: Rendering backend, one of generate_roga.render_backends
+    :return: Tuple of (list of per-report result dictionaries, dictionary of per-stage timings in seconds). Since the
+             stages overlap, data and database are the time spent waiting on them, build is the total time spent
+             building reports and compile is the time spent waiting on compiles once every report was built.
+    """
+    loop = asyncio.get_running_loop()
+    with instrumentation.run('batch_roga', reports=len(specs), backend=backend, pipeline='async') as run:
+        timings = {}
+        batch_start = time.time()
+        date = datetime.today().strftime('%Y-%m-%d')
+        year = datetime.today().strftime('%Y')
+        os.makedirs(output_dir, exist_ok=True)
+
+        results = new_results(specs)
+        pending = [result for result in results if result['status'] == 'pending']
+
+        # Connecting to the database (and creating the engine on first use) overlaps reading the run folders
+        connect = instrumentation.propagate(lambda: database.get_engine().connect())
+        connecting = loop.run_in_executor(None, connect) if pending else None
+        try:
+            stage_start = time.time()
+            run['run_folders'] = await loop.run_in_executor(None, instrumentation.propagate(load_batch_samples),
+                                                            pending)
+            timings['data'] = time.time() - stage_start
+
+            stage_start = time.time()
+            for result in pending:
+                check_report(result, output_dir=output_dir, use_cache=use_cache, backend=backend)
+            pending = [result for result in pending if result['status'] == 'pending']
+            timings['validation'] = time.time() - stage_start
+
+            stage_start = time.time()
+            if pending:
+                con = await connecting
+                reserve = functools.partial(database.reserve_report_ids, reports=get_id_requests(pending), date=date,
+                                            year=year, con=con)
+                report_ids = await loop.run_in_executor(None, instrumentation.propagate(reserve))
+                for result, report_id in zip(pending, report_ids):
+                    result['report_id'] = report_id
+            timings['database'] = time.time() - stage_start
+        finally:
+            if connecting is not None:
+                await asyncio.wait([connecting])
+                if not connecting.cancelled() and connecting.exception() is None:
+                    connecting.result().close()
+
+        # Build each report while the ones before it compile
+        stage_start = time.time()
+        compiles = []
+        build, produce = instrumentation.propagate(build_report), instrumentation.propagate(produce_pdf)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for result in pending:
+                await loop.run_in_executor(None, build, result, date, output_dir, backend)
+                if result['status'] == 'pending':
+                    compiles.append((result, executor.submit(produce, result, use_format, backend)))
+            timings['build'] = sum(result['build_time'] for result in pending)
+
+            compile_start = time.time()
+            if compiles:
+                await asyncio.wait([asyncio.wrap_future(future) for result, future in compiles])
+            for result, future in compiles:
+                finish_report(result, future, use_cache=use_cache, date=date)
+        timings['compile'] = time.time() - compile_start
+
+        timings['total'] = time.time() - batch_start
+        record_timings(run, results, timings)
+    return results, timings
+
+
+def print_summary(results, timings):
+    """
+    :param results: List of per-report result dictionaries retrieved from run_batch()
+    :param timings: Dictionary of per-stage timings retrieved from run_batch()
+    """
+    succeeded = [result for result in results if result['status'] == 'ok']
+    failed = [result for result in results if result['status'] != 'ok']
+
+    print('\nBatch summary: {} of {} reports generated in {:.1f}s'.format(len(succeeded), len(results),
+                                                                          timings.get('total', 0.0)))
+    for stage in ('data', 'validation', 'database', 'build', 'compile'):
+        print('\t{:<12}{:>8.2f}s'.format(stage, timings.get(stage, 0.0)))
+
+    for result in succeeded:
+        if result['cached']:
+            print('\tCACHED  {} (previously issued as {})'.format(result['pdf'], result['report_id']))
+            continue
+        print('\tOK      {} ({:.1f}s build, {:.1f}s compile)'.format(result['pdf'], result['build_time'],
+                                                                      result['compile_time']))
+    for result in failed:
+        spec = result['spec']
+        print('\tFAILED  {} {} {}: {}'.format(spec['genus'], spec['lab'], ';'.join(spec['seq_list']),
+                                              result['error']))
+
+
+@click.command()
+@click.argument('manifest', default='-')
+@click.option('--workers', default=COMPILE_WORKERS, show_default=True, help='Number of reports compiled at once')
+@click.option('--output-dir', default='.', show_default=True, type=click.Path(file_okay=False),
+              help='Directory the reports are written to')
+@click.option('--precompiled-preamble', is_flag=True,
+              help='Compile against a cached pdflatex format of the shared preamble')
+@click.option('--no-cache', is_flag=True, help='Regenerate reports even if an identical report was already issued')
+@click.option('--backend', default='latex', show_default=True, type=click.Choice(render_backends),
+              help='Render with PyLaTeX + pdflatex or directly with ReportLab')
+@click.option('--async-pipeline', is_flag=True,
+              help='Overlap the database connection with data loading, and building reports with compiling them')
+def batch(manifest, workers, output_dir, precompiled_preamble, no_cache, backend, async_pipeline):
+    """
+    Generates a ROGA for every report spec in MANIFEST (a CSV or JSON file, or '-' for stdin)
+    """
+    instrumentation.configure_logging()
+    specs = read_manifest(manifest)
+    if async_pipeline:
+        results, timings = asyncio.run(run_batch_async(specs=specs, workers=workers, output_dir=output_dir,
+                                                       use_format=precompiled_preamble, use_cache=not no_cache,
+                                                       backend=backend))
+    else:
+        results, timings = run_batch(specs=specs, workers=workers, output_dir=output_dir,
+                                     use_format=precompiled_preamble, use_cache=not no_cache, backend=backend)
+    print_summary(results, timings)
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    batch()
@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import click
+import shutil
+import logging
+import platform
+import tempfile
+import statistics
+
+import extract_report_data
+import instrumentation
+import metadata_index
+import report_model
+import synthetic_archive
+from generate_roga import render_latex_document
+
+
+"""
+Benchmarks the ROGA stages against synthetic COWBAT archives.
+
+For each scale (run folders x samples per run) a synthetic archive is generated with synthetic_archive and the
+following are timed, each repeated a number of times:
+
+    lookup_legacy     - create_report_dictionary() over every combinedMetadata.csv, as the original ROGA did
+    lookup_full_scan  - load_sample_data() without the SeqID index
+    lookup_cold       - load_sample_data() building the SeqID index from scratch
+    lookup_warm       - load_sample_data() with an up to date SeqID index
+    lookup_columnar   - columnar_store.load_samples() with an up to date store (if pyarrow is installed)
+    validate          - validate_samples() for every genus
+    build_model       - report_model.build_report_model() for every genus
+    render_tex        - writing the LaTeX source for every genus
+    render_reportlab  - rendering every genus' PDF with ReportLab (if reportlab is installed)
+    compile_latex     - compiling every genus' LaTeX source (if pdflatex is installed)
+
+The results can be written to a JSON file and used as the baseline for a later run, which then fails if any benchmark's
+median got slower than the baseline's by more than the threshold.
+"""
+
+
+# Scales benchmarked by default, as <run folders>x<samples per run>
+SCALES = '10x48,100x48'
+
+# Samples of each genus included in the benchmarked reports
+SAMPLES_PER_GENUS = 8
+
+# A benchmark is a regression if its median exceeds the baseline's by this factor...
+THRESHOLD = 1.25
+# ...and by at least this many seconds, so that noise in very quick benchmarks isn't flagged
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def parse_scales(value):
+    """
+    :param value: Comma separated scales, i.e. '10x48,100x48'
+    :return: List of (run folders, samples per run) tuples
+    """
+    scales = []
+    for scale in value.split(','):
+        runs, samples = scale.strip().lower().split('x')
+        scales.append((int(runs), int(samples)))
+    return scales
+
+
+def pick_seq_lists(sample_genus, count=SAMPLES_PER_GENUS):
+    """
+    :param sample_genus: Dictionary retrieved from synthetic_archive.generate_archive()
+    :param count: Number of Seq IDs picked for each genus
+    :return: Dictionary containing each genus as keys and a list of Seq IDs spread across the archive as values
+    """
+    seq_lists = {}
+    for genus in sorted(synthetic_archive.genus_profiles):
+        seqids = sorted(seqid for seqid, sample_genus in sample_genus.items() if sample_genus == genus)
+        step = max(1, len(seqids) // count)
+        seq_lists[genus] = seqids[::step][:count]
+    return seq_lists
+
+
+def time_call(function, repeats, setup=None):
+    """
+    :param function: Callable to time
+    :param repeats: Number of times to call it
+    :param setup: Callable run before each call, outside of the timing
+    :return: List of seconds taken by each call
+    """
+    timings = []
+    for repeat in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_scale(runs, samples, repeats, seed, work_dir):
+    """
+    Generates an archive and times every benchmark against it
+    :param runs: Number of run folders
+    :param samples: Number of samples in each run
+    :param repeats: Number of times each benchmark is repeated
+    :param seed: Random seed for the archive
+    :param work_dir: Empty directory to write the archive, index and reports to
+    :return: Dictionary containing benchmark names as keys and lists of seconds as values
+    """
+    archive_dir = os.path.join(work_dir, 'WGSspades')
+    index_path = os.path.join(work_dir, 'seqid_index.sqlite')
+    output_dir = os.path.join(work_dir, 'reports')
+    os.makedirs(output_dir)
+
+    sample_genus = synthetic_archive.generate_archive(archive_dir, runs=runs, samples_per_run=samples, seed=seed)
+    seq_lists = pick_seq_lists(sample_genus)
+    seq_list = [seqid for genus in sorted(seq_lists) for seqid in seq_lists[genus]]
+
+    extract_report_data.WGSSPADES_DIR = archive_dir
+    extract_report_data.USE_NAS_CACHE = False
+
+    def remove_index():
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+    timings = {}
+    timings['lookup_legacy'] = time_call(
+        lambda: extract_report_data.create_report_dictionary(
+            report_list=extract_report_data.list_reports('combinedMetadata.csv'), seq_list=seq_list,
+            id_column='SeqID'),
+        repeats)
+    timings['lookup_full_scan'] = time_call(
+        lambda: extract_report_data.load_sample_data(seq_list, use_index=False), repeats)
+    timings['lookup_cold'] = time_call(
+        lambda: extract_report_data.load_sample_data(seq_list, index_path=index_path), repeats, setup=remove_index)
+    timings['lookup_warm'] = time_call(
+        lambda: extract_report_data.load_sample_data(seq_list, index_path=index_path), repeats)
+
+    try:
+        import columnar_store
+        import pyarrow
+    except ImportError:
+        pass
+    else:
+        store_dir = os.path.join(work_dir, 'columnar_store')
+        con = metadata_index.connect_index(index_path)
+        try:
+            columnar_store.update_store(con, store_dir=store_dir)
+        finally:
+            con.close()
+        timings['lookup_columnar'] = time_call(
+            lambda: columnar_store.load_samples(seq_list, index_path=index_path, store_dir=store_dir), repeats)
+
+    metadata_reports = extract_report_data.load_sample_data(seq_list, index_path=index_path)
+    genus_reports = {genus: {seqid: metadata_reports[seqid] for seqid in seq_lists[genus]} for genus in seq_lists}
+
+    timings['validate'] = time_call(
+        lambda: [extract_report_data.validate_samples(seq_list=seq_lists[genus], genus=genus,
+                                                      metadata_reports=metadata_reports) for genus in seq_lists],
+        repeats)
+
+    def build_models():
+        return {genus: report_model.build_report_model(metadata_reports=genus_reports[genus], genus=genus,
+                                                       lab='GTA-CFIA', source='ground beef', report_id='BENCHMARK',
+                                                       date='2017-01-01')
+                for genus in genus_reports}
+    timings['build_model'] = time_call(build_models, repeats)
+    models = build_models()
+
+    def get_filepath(genus):
+        return os.path.join(output_dir, genus)
+
+    timings['render_tex'] = time_call(
+        lambda: [render_latex_document(models[genus]).generate_tex(get_filepath(genus)) for genus in models], repeats)
+
+    try:
+        import pdf_render
+        import reportlab
+    except ImportError:
+        pass
+    else:
+        timings['render_reportlab'] = time_call(
+            lambda: [pdf_render.render_pdf(models[genus], get_filepath(genus) + '_reportlab.pdf') for genus in models],
+            repeats)
+
+    if shutil.which('pdflatex'):
+        import latex_compile
+        timings['compile_latex'] = time_call(
+            lambda: [latex_compile.compile_tex(get_filepath(genus)) for genus in models], repeats)
+
+    return timings
+
+
+def run_benchmarks(scales, repeats=3, seed=0):
+    """
+    :param scales: List of (run folders, samples per run) tuples
+    :param repeats: Number of times each benchmark is repeated
+    :param seed: Random seed for the archives
+    :return: Results dictionary, suitable for writing out as a baseline
+    """
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'repeats': repeats,
+               'seed': seed,
+               'scales': {}}
+    for runs, samples in scales:
+        work_dir = tempfile.mkdtemp(prefix='autoroga_benchmark_')
+        try:
+            timings = benchmark_scale(runs=runs, samples=samples, repeats=repeats, seed=seed, work_dir=work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results['scales']['{}x{}'.format(runs, samples)] = {
+            name: {'median': statistics.median(seconds), 'best': min(seconds), 'seconds': seconds}
+            for name, seconds in timings.items()}
+    return results
+
+
+def compare_results(results, baseline, threshold=THRESHOLD):
+    """
+    :param results: Dictionary retrieved from run_benchmarks()
+    :param baseline: Dictionary retrieved from an earlier run_benchmarks()
+    :param threshold: Factor a median may exceed the baseline's by before it counts as a regression
+    :return: List of (scale, benchmark, baseline median, median) tuples for every regression
+    """
+    regressions = []
+    for scale, benchmarks in results['scales'].items():
+        for name, result in benchmarks.items():
+            baseline_result = baseline.get('scales', {}).get(scale, {}).get(name)
+            if baseline_result is None:
+                continue
+            if result['median'] > baseline_result['median'] * threshold and \
+                    result['median'] - baseline_result['median'] >= MIN_REGRESSION_SECONDS:
+                regressions.append((scale, name, baseline_result['median'], result['median']))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """
+    :param results: Dictionary retrieved from run_benchmarks()
+    :param baseline: Dictionary retrieved from an earlier run_benchmarks(), or None
+    """
+    print('{:<10} {:<18} {:>10} {:>10} {:>10} {:>7}'.format('scale', 'benchmark', 'median', 'best', 'baseline',
+                                                            'ratio'))
+    for scale, benchmarks in results['scales'].items():
+        for name, result in benchmarks.items():
+            baseline_result = (baseline or {}).get('scales', {}).get(scale, {}).get(name)
+            if baseline_result is None:
+                baseline_column, ratio_column = '-', '-'
+            else:
+                baseline_column = '{:.4f}'.format(baseline_result['median'])
+                ratio_column = '{:.2f}'.format(result['median'] / baseline_result['median']) \
+                    if baseline_result['median'] else '-'
+            print('{:<10} {:<18} {:>10.4f} {:>10.4f} {:>10} {:>7}'.format(scale, name, result['median'], result['best'],
+                                                                       baseline_column, ratio_column))
+
+
+@click.command()
+@click.option('--scales', default=SCALES, show_default=True,
+              help='Comma separated archive sizes to benchmark, as <run folders>x<samples per run>')
+@click.option('--repeats', default=3, show_default=True, help='Number of times each benchmark is repeated')
+@click.option('--seed', default=0, show_default=True, help='Random seed for the synthetic archives')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Compare against results previously written with --output')
+@click.option('--threshold', default=THRESHOLD, show_default=True,
+              help='Fail if a median is slower than the baseline by more than this factor')
+def benchmark(scales, repeats, seed, output, baseline, threshold):
+    """
+    Times lookup, validation, model building and rendering against synthetic COWBAT archives
+    """
+    # Keep the validation warnings about the synthetic samples out of the results
+    instrumentation.configure_logging(level=logging.ERROR)
+    results = run_benchmarks(parse_scales(scales), repeats=repeats, seed=seed)
+
+    baseline_results = None
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+    print_results(results, baseline_results)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline_results is not None:
+        regressions = compare_results(results, baseline_results, threshold=threshold)
+        for scale, name, baseline_median, median in regressions:
+            print('REGRESSION: {} at {} took {:.4f}s, baseline {:.4f}s'.format(name, scale, median, baseline_median))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,328 @@
+import os
+import json
+import click
+import tempfile
+
+import instrumentation
+import metadata_index
+import archive_query
+import extract_report_data
+from sample_record import SampleRecord, SAMPLE_FIELDS
+
+
+"""
+Columnar copy of the sample records of every COWBAT run, stored as Parquet.
+
+Each run folder's combinedMetadata.csv and GDCS.csv are read once with extract_report_data.load_run_samples() and
+written to a single Parquet file per run in STORE_DIR, holding one row per SampleRecord sorted on seq_id. Columns with
+few distinct values (genus, MASH reference genome, MLST, serovar, serogroup, PipelineVersion and the GDCS result) are
+dictionary encoded, total_length is an int64 column and average_coverage_depth a float64 one, so the whole archive is
+far smaller on disk and in memory than the CSVs or their pandas object columns.
+
+A lookup only opens the files of the runs the SeqID index says hold the requested Seq IDs, and filters them on seq_id
+inside pyarrow, where the row group statistics of the sorted column let whole row groups be skipped. Like the SeqID
+index, the store is refreshed incrementally: a run is only rewritten when its combinedMetadata.csv or GDCS.csv has
+changed since it was last written, as recorded in the store's manifest.
+
+The store needs the optional pyarrow package. extract_report_data reads from it instead of the CSVs when
+USE_COLUMNAR_STORE is set.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Default location of the store
+STORE_DIR = os.path.join(os.path.expanduser('~'), '.autoroga', 'columnar_store')
+
+# File recording the state of the reports each run's Parquet file was written from
+MANIFEST_NAME = 'manifest.json'
+
+# Rows per Parquet row group. Row groups are the unit seq_id filters skip.
+ROW_GROUP_SIZE = 1024
+
+SAMPLE_ATTRIBUTES = tuple(attribute for attribute, column in SAMPLE_FIELDS)
+
+# Attributes with few distinct values across the archive, stored dictionary encoded
+DICTIONARY_FIELDS = ('genus', 'mash_reference_genome', 'mlst_result', 'sistr_serovar', 'sistr_serogroup',
+                     'pipeline_version', 'gdcs_pass')
+
+
+def get_schema():
+    """
+    :return: pyarrow schema of a run's Parquet file
+    """
+    # Optional dependency, only needed for the columnar store
+    import pyarrow as pa
+
+    fields = []
+    for attribute in SAMPLE_ATTRIBUTES:
+        if attribute == 'total_length':
+            data_type = pa.int64()
+        elif attribute == 'average_coverage_depth':
+            data_type = pa.float64()
+        elif attribute in DICTIONARY_FIELDS:
+            data_type = pa.dictionary(pa.int32(), pa.string())
+        else:
+            data_type = pa.string()
+        fields.append(pa.field(attribute, data_type))
+    fields += [pa.field('run_folder', pa.dictionary(pa.int32(), pa.string())),
+               pa.field('markers', pa.int64())]
+    return pa.schema(fields)
+
+
+def get_partition_path(run_folder, store_dir=STORE_DIR):
+    """
+    :param run_folder: Name of a run folder, i.e. 180101_M02466_0001_000000000-ABCDE
+    :param store_dir: Directory holding the store
+    :return: Path to the run's Parquet file
+    """
+    return os.path.join(store_dir, run_folder + '.parquet')
+
+
+def read_manifest(store_dir=STORE_DIR):
+    """
+    :param store_dir: Directory holding the store
+    :return: Dictionary containing combinedMetadata.csv paths as keys and the [mtime, size, gdcs_mtime, gdcs_size] of
+             the reports the run's Parquet file was written from as values
+    """
+    try:
+        with open(os.path.join(store_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def replace_file(path, write, store_dir=STORE_DIR):
+    """
+    Writes to a temporary file first so concurrent readers never see a partially written file
+    :param path: Path to the file to replace
+    :param write: Function taking the temporary path and writing the new file to it
+    :param store_dir: Directory holding the store
+    """
+    handle, temp_path = tempfile.mkstemp(dir=store_dir, prefix='.partial-')
+    os.close(handle)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_manifest(updated, removed=(), store_dir=STORE_DIR):
+    """
+    :param updated: Dictionary of manifest entries to add or replace, as in read_manifest()
+    :param removed: combinedMetadata.csv paths to drop from the manifest
+    :param store_dir: Directory holding the store
+    """
+    # Re-read just before writing, so entries written meanwhile by another lookup are kept
+    manifest = read_manifest(store_dir)
+    manifest.update(updated)
+    for report in removed:
+        manifest.pop(report, None)
+
+    def write(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+    replace_file(os.path.join(store_dir, MANIFEST_NAME), write, store_dir)
+
+
+def write_partition(metadata_report, records, store_dir=STORE_DIR):
+    """
+    :param metadata_report: Path to the run's combinedMetadata.csv
+    :param records: List of SampleRecord objects read from the run
+    :param store_dir: Directory holding the store
+    :return: Path to the Parquet file written
+    """
+    # Optional dependency, only needed for the columnar store
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    run_folder = metadata_index.get_run_folder(metadata_report)
+    # Sorted so that each row group covers a narrow range of Seq IDs
+    records = sorted(records, key=lambda record: record.seq_id)
+    columns = {attribute: [getattr(record, attribute) for record in records] for attribute in SAMPLE_ATTRIBUTES}
+    columns['run_folder'] = [run_folder] * len(records)
+    columns['markers'] = [record.markers for record in records]
+    table = pa.Table.from_pydict(columns, schema=get_schema())
+
+    partition_path = get_partition_path(run_folder, store_dir)
+    replace_file(partition_path, lambda temp_path: pq.write_table(table, temp_path, row_group_size=ROW_GROUP_SIZE),
+                 store_dir)
+    return partition_path
+
+
+def update_store(con, report_list=None, workers=extract_report_data.SCAN_WORKERS, prune=True, store_dir=STORE_DIR):
+    """
+    Brings the SeqID index and the store up to date with the archive. Runs whose combinedMetadata.csv and GDCS.csv
+    haven't changed since their Parquet file was written are skipped.
+    :param con: Connection retrieved from metadata_index.connect_index()
+    :param report_list: List of combinedMetadata.csv paths. Defaults to every run folder in the archive.
+    :param workers: Number of run folders to read concurrently
+    :param prune: report_list is every run folder in the archive, so stored runs missing from it are dropped. Pass
+                  False to refresh only a subset of the archive.
+    :param store_dir: Directory holding the store
+    :return: Number of run folders that were (re)written
+    """
+    # Optional dependency, imported before any run is parsed so a missing pyarrow fails straight away
+    import pyarrow
+
+    if report_list is None:
+        report_list = extract_report_data.list_reports('combinedMetadata.csv')
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = read_manifest(store_dir)
+
+    updated = {}
+
+    def store_run(report, records, state):
+        write_partition(report, records, store_dir)
+        updated[report] = list(state)
+    archive_query.refresh_runs(con, report_list=report_list,
+                               ingested={report: tuple(state) for report, state in manifest.items()},
+                               store=store_run, workers=workers, prune=prune)
+
+    removed = set(manifest) - set(report_list) if prune else set()
+    for report in removed:
+        remove_partition(report, store_dir)
+
+    if updated or removed:
+        write_manifest(updated, removed, store_dir)
+    return len(updated)
+
+
+def remove_partition(metadata_report, store_dir=STORE_DIR):
+    """
+    :param metadata_report: Path to the combinedMetadata.csv of a run that is no longer in the archive
+    :param store_dir: Directory holding the store
+    """
+    try:
+        os.remove(get_partition_path(metadata_index.get_run_folder(metadata_report), store_dir))
+    except FileNotFoundError:
+        pass
+
+
+def read_samples(seq_list, report_rows, store_dir=STORE_DIR):
+    """
+    :param seq_list: List of OLC Seq IDs
+    :param report_rows: Dictionary containing combinedMetadata.csv paths of the runs to read as keys and the Seq IDs
+                        known to be in each as values, i.e. from extract_report_data.find_report_rows()
+    :param store_dir: Directory holding the store
+    :return: Dictionary containing Seq IDs as keys and SampleRecord objects as values. When a Seq ID was resequenced,
+             the record from the most recent run is kept, as with extract_report_data.scan_archive(). Runs missing
+             from the store (i.e. ones that couldn't be written) are read from their CSVs instead.
+    """
+    # Optional dependency, only needed for the columnar store
+    import pyarrow.dataset as ds
+
+    if not seq_list:
+        return {}
+    manifest = read_manifest(store_dir)
+    ordered_reports = extract_report_data.order_newest_first(report_rows)
+    run_rank = {metadata_index.get_run_folder(report): rank for rank, report in enumerate(ordered_reports)}
+    stored_runs = [metadata_index.get_run_folder(report) for report in ordered_reports if report in manifest]
+
+    records = []
+    if stored_runs:
+        dataset = ds.dataset([get_partition_path(run_folder, store_dir) for run_folder in stored_runs],
+                             format='parquet', schema=get_schema())
+        table = dataset.to_table(columns=list(SAMPLE_ATTRIBUTES) + ['run_folder'],
+                                 filter=ds.field('seq_id').isin(list(set(seq_list))))
+        instrumentation.count('files_scanned', len(stored_runs))
+        instrumentation.count('rows_parsed', table.num_rows)
+        for row in table.to_pylist():
+            records.append(SampleRecord(run_folder=row.pop('run_folder'), **row))
+
+    for report in ordered_reports:
+        if report in manifest:
+            continue
+        logger.info('{} is not in the columnar store, reading its CSVs'.format(report))
+        try:
+            records += extract_report_data.scan_run(report, seq_list, report_rows[report])
+        except Exception as e:
+            logger.warning('Could not read {}: {}'.format(report, e))
+
+    newest = {}
+    for record in records:
+        current = newest.get(record.seq_id)
+        if current is None or run_rank[record.run_folder] < run_rank[current.run_folder]:
+            newest[record.seq_id] = record
+
+    # Keep the order the Seq IDs were requested in
+    return {seqid: newest[seqid] for seqid in seq_list if seqid in newest}
+
+
+def load_samples(seq_list, workers=extract_report_data.SCAN_WORKERS, index_path=metadata_index.INDEX_PATH,
+                 store_dir=STORE_DIR, refresh=None):
+    """
+    Looks the requested Seq IDs up in the SeqID index, rewrites any of their runs that changed since they were stored
+    and reads the samples from the store. Used by extract_report_data.load_sample_data() when USE_COLUMNAR_STORE is set.
+    :param seq_list: List of OLC Seq IDs
+    :param workers: Number of run folders to read concurrently when runs have to be (re)written
+    :param index_path: Path to the SeqID index database
+    :param store_dir: Directory holding the store
+    :param refresh: Refresh the SeqID index before the lookup. Defaults to extract_report_data.REFRESH_INDEX.
+    :return: Dictionary containing Seq IDs as keys and SampleRecord objects as values
+    """
+    # Optional dependency, imported before the archive is touched so a missing pyarrow falls back to the CSVs
+    import pyarrow
+
+    report_rows = extract_report_data.find_report_rows(report_name='combinedMetadata.csv', seq_list=seq_list,
+                                                       id_column='SeqID', index_path=index_path, refresh=refresh)
+    with instrumentation.stage('store'):
+        con = metadata_index.connect_index(index_path)
+        try:
+            updated = update_store(con, report_list=list(report_rows), workers=workers, prune=False,
+                                   store_dir=store_dir)
+        finally:
+            con.close()
+    if updated:
+        logger.info('Wrote {} run folders to the columnar store'.format(updated))
+
+    with instrumentation.stage('scan'):
+        return read_samples(seq_list=seq_list, report_rows=report_rows, store_dir=store_dir)
+
+
+def scan_store(expression=None, columns=None, store_dir=STORE_DIR):
+    """
+    Reads samples from every run in the store, i.e. for archive-wide queries
+        scan_store(pyarrow.dataset.field('genus') == 'Salmonella', columns=['seq_id', 'sistr_serovar'])
+    :param expression: pyarrow.dataset filter expression, or None to read every sample
+    :param columns: Columns to read. Defaults to every column.
+    :param store_dir: Directory holding the store
+    :return: pyarrow Table holding a row for every sample in every run it was sequenced in. Dictionary encoded columns
+             stay dictionary encoded, and become categoricals with to_pandas().
+    """
+    # Optional dependency, only needed for the columnar store
+    import pyarrow.dataset as ds
+
+    partition_paths = [get_partition_path(metadata_index.get_run_folder(report), store_dir)
+                       for report in sorted(read_manifest(store_dir))]
+    if not partition_paths:
+        table = get_schema().empty_table()
+        return table.select(columns) if columns is not None else table
+    dataset = ds.dataset(partition_paths, format='parquet', schema=get_schema())
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+@click.command()
+@click.option('--workers', default=extract_report_data.SCAN_WORKERS, show_default=True,
+              help='Number of run folders to read concurrently')
+@click.option('--index', 'index_path', default=metadata_index.INDEX_PATH, show_default=True,
+              help='Path to the SeqID index database')
+@click.option('--store-dir', default=STORE_DIR, show_default=True, help='Directory holding the columnar store')
+def store(workers, index_path, store_dir):
+    """
+    Writes every new or changed run in the archive to the columnar sample store
+    """
+    instrumentation.configure_logging()
+    con = metadata_index.connect_index(index_path)
+    try:
+        updated = update_store(con, workers=workers, store_dir=store_dir)
+    finally:
+        con.close()
+    logger.info('Wrote {} run folders to {}'.format(updated, store_dir))
+
+
+if __name__ == '__main__':
+    store()
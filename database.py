@@ -1,48 +1,109 @@
+import os
+import threading
 import sqlalchemy as sa
-from settings import POSTGRES_PASSWORD, POSTGRES_USERNAME
+import instrumentation
+from datetime import datetime
+
+
+# Overrides the Postgres connection, i.e. sqlite:///autoroga.sqlite for a local stand-in database
+DATABASE_URL_ENV = 'AUTOROGA_DATABASE_URL'
+
+# Shared by every call in the process; created on first use by get_engine()
+_engine = None
+_engine_lock = threading.Lock()
+
+ROGA_ID_SEQ = sa.Sequence('roga_id_seq')
+
+meta = sa.MetaData()
+
+autoroga_project_table = sa.Table('autoroga_project_table', meta,
+                                  sa.Column('roga_id', sa.INTEGER, ROGA_ID_SEQ, primary_key=True),
+                                  sa.Column('genus', sa.String(64)),
+                                  sa.Column('lab', sa.String(16)),
+                                  sa.Column('source', sa.String(64)),
+                                  sa.Column('date', sa.Date))
 
 
 def connect(user, password, db, host='localhost', port=5432):
     url = 'postgresql://{}:{}@{}:{}/{}'
     url = url.format(user, password, host, port, db)
 
-    # The return value of create_engine() is our connection object
-    con = sa.create_engine(url, client_encoding='utf8')
-
-    # We then bind the connection to MetaData()
-    meta = sa.MetaData(bind=con, reflect=True)
+    # The return value of create_engine() is our connection object. Connections are pooled and checked before use.
+    con = sa.create_engine(url, client_encoding='utf8', pool_size=5, max_overflow=10, pool_pre_ping=True)
 
     return con, meta
 
-def update_db(date, year, genus, lab, source):
-    con, meta = connect(user=POSTGRES_USERNAME, password=POSTGRES_PASSWORD, db='autoroga')
-
-    ROGA_ID_SEQ = sa.Sequence('roga_id_seq')
-
-    try:
-        autoroga_project_table = sa.Table('autoroga_project_table', meta,
-                                          sa.Column('roga_id', sa.INTEGER, ROGA_ID_SEQ, primary_key=True, server_default=ROGA_ID_SEQ.next_value()),
-                                          sa.Column('genus', sa.String(64)),
-                                          sa.Column('lab', sa.String(16)),
-                                          sa.Column('source', sa.String(64)),
-                                          sa.Column('date', sa.Date))
-        meta.create_all()
-        print('Successfully created autoroga_project_table')
-    except:
-        autoroga_project_table = sa.Table('autoroga_project_table', meta, autoload=True, autoload_with=sa.engine)
-        print('Successfully retrieved autoroga_project_table')
-
-
-    # Grab what the next key value will be
-    select_next_value = sa.select([autoroga_project_table.c.roga_id])
-    keys = con.execute(select_next_value)
-    next_val = max(keys)[0] + 1
-
-    # Insert new row into table
+
+def get_engine():
+    """
+    :return: Pooled engine shared by the whole process. The ROGA table and its sequence are created on first use if
+             they don't exist yet.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            url = os.environ.get(DATABASE_URL_ENV)
+            if url:
+                engine = sa.create_engine(url)
+            else:
+                # Only needed for the Postgres connection, so the settings file isn't required to import this module
+                from settings import POSTGRES_PASSWORD, POSTGRES_USERNAME
+                engine, _ = connect(user=POSTGRES_USERNAME, password=POSTGRES_PASSWORD, db='autoroga')
+            meta.create_all(engine, checkfirst=True)
+            _engine = engine
+    return _engine
+
+
+def format_report_id(year, roga_id):
+    """
+    :param year: String of the year the report is issued in
+    :param roga_id: Integer ID allocated for the report
+    :return: Report ID, i.e. 2017-ROGA-0001
+    """
+    return year + '-ROGA-' + '{:04d}'.format(roga_id)
+
+
+def insert_report(con, date, genus, lab, source):
+    """
+    Inserts a row for a report and returns the ID the sequence allocated to it in the same statement
+    :param con: Open connection
+    :return: Integer ID of the new row
+    """
+    # Dates are passed around as '%Y-%m-%d' strings
+    if isinstance(date, str):
+        date = datetime.strptime(date, '%Y-%m-%d').date()
     ins = autoroga_project_table.insert().values(genus=genus, date=date, lab=lab, source=source)
-    con.execute(ins)
+    instrumentation.count('db_round_trips')
+    return con.execute(ins.returning(autoroga_project_table.c.roga_id)).scalar()
+
+
+def update_db(date, year, genus, lab, source):
+    with get_engine().begin() as con:
+        roga_id = insert_report(con, date=date, genus=genus, lab=lab, source=source)
 
     # Create report ID
-    report_id = year + '-ROGA-' + '{:04d}'.format(next_val)
+    report_id = format_report_id(year, roga_id)
+
+    return report_id
+
+
+def reserve_report_ids(reports, date, year, con=None):
+    """
+    Allocates report IDs for a batch of reports in a single transaction. Either every report gets an ID or none do.
+    :param reports: List of (genus, lab, source) tuples
+    :param date: Date the reports are issued
+    :param year: String of the year the reports are issued in
+    :param con: Connection retrieved from get_engine().connect() ahead of time, i.e. while the sample data was still
+                loading. The caller closes it. A connection is checked out of the pool if None.
+    :return: List of report IDs in the same order as reports
+    """
+    if con is None:
+        with get_engine().connect() as con:
+            return reserve_report_ids(reports, date=date, year=year, con=con)
 
-    return report_id
\ No newline at end of file
+    report_ids = []
+    with con.begin():
+        for genus, lab, source in reports:
+            roga_id = insert_report(con, date=date, genus=genus, lab=lab, source=source)
+            report_ids.append(format_report_id(year, roga_id))
+    return report_ids
@@ -1,5 +1,46 @@
+import os
+import re
+import csv
 import glob
-import pandas as pd
+import mmap
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+import instrumentation
+import metadata_index
+import nas_cache
+from sample_record import SampleRecord, SAMPLE_FIELDS, GENESEEKR_BITS, MARKER_BITS
+from genus_specs import genus_specs, get_check_marker
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Root of the COWBAT output archive on the NAS
+WGSSPADES_DIR = '/mnt/nas/WGSspades'
+
+# Columns of GDCS.csv used by a ROGA
+GDCS_COLUMNS = ('Strain', 'Matches', 'Pass/Fail')
+
+# Columns of combinedMetadata.csv used by a ROGA
+METADATA_COLUMNS = tuple(column for attribute, column in SAMPLE_FIELDS if column not in GDCS_COLUMNS)
+
+# Values treated as missing when reading a report, as pandas.read_csv() does by default
+MISSING_VALUES = frozenset(('', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                            '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'))
+
+# Number of run folders read concurrently by scan_archive()
+SCAN_WORKERS = 8
+
+# Parse report files from a local copy kept by nas_cache rather than directly from the NAS
+USE_NAS_CACHE = True
+
+# Refresh the SeqID index from the archive before every lookup. archive_watcher keeps the index up to date as runs
+# finish, so while it is running lookups can skip the glob and stat of every report in the archive.
+REFRESH_INDEX = True
+
+# Read samples from the Parquet copy of the archive kept by columnar_store rather than parsing the CSVs. Needs pyarrow.
+USE_COLUMNAR_STORE = False
+
+# Species the MASH reference genome is expected to match for each genus
+mash_species = {genus: spec['species'] for genus, spec in genus_specs.items() if 'mash' in spec['checks']}
 
 
 def create_report_dictionary(report_list, seq_list, id_column):
@@ -9,6 +50,8 @@ def create_report_dictionary(report_list, seq_list, id_column):
     :param id_column: Column used to specify primary key
     :return: Dictionary containing Seq IDs as keys and dataframes as values
     """
+    import pandas as pd
+
     # Create empty dict to store reports of interest
     report_dict = {}
 
@@ -25,53 +68,365 @@ def create_report_dictionary(report_list, seq_list, id_column):
     return report_dict
 
 
- # TODO: Fix this for production to retrieve full list of combinedMetadata.csv reports
+def read_report(report, id_column, seq_list, columns, expected_ids=None):
+    """
+    Streams a report file with the csv module, keeping only the projected columns of the rows for the requested Seq IDs.
+    Reading stops early once every ID the file is known to hold has been found. pandas isn't used, so quick commands
+    such as validate and preview never have to import it.
+    :param report: Path to report file
+    :param id_column: Column used to specify primary key
+    :param seq_list: List of OLC Seq IDs
+    :param columns: Columns to keep. Columns missing from the file are left out.
+    :param expected_ids: Seq IDs known to be in the file (i.e. from the SeqID index). The whole file is read if None.
+    :return: List of dictionaries of column name to value, with None for missing values (see MISSING_VALUES), for the
+             first row of each requested Seq ID found in the file
+    """
+    wanted = set(seq_list)
+    expected = set(expected_ids) & wanted if expected_ids is not None else None
+
+    # Serve the file from the local read-through cache when enabled
+    if USE_NAS_CACHE:
+        report = nas_cache.cached_path(report)
+    instrumentation.count('files_scanned')
+    instrumentation.count('bytes_read', os.path.getsize(report))
+
+    found_rows = {}
+    rows_parsed = 0
+    with open(report, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if id_column in header:
+            id_index = header.index(id_column)
+            projection = [(index, column) for index, column in enumerate(header) if column in columns]
+            for line in reader:
+                rows_parsed += 1
+                seqid = line[id_index] if len(line) > id_index else None
+                if seqid not in wanted or seqid in found_rows:
+                    continue
+                found_rows[seqid] = {column: line[index] if index < len(line) and line[index] not in MISSING_VALUES
+                                     else None for index, column in projection}
+
+                # Everything this file holds has been found
+                if expected is not None and expected <= found_rows.keys():
+                    break
+    instrumentation.count('rows_parsed', rows_parsed)
+    return list(found_rows.values())
+
+
+def list_reports(report_name):
+    """
+    :param report_name: Name of the report file within each run's reports folder, i.e. combinedMetadata.csv
+    :return: List of paths to every report file of that name in the archive
+    """
+    with instrumentation.stage('glob'):
+        report_list = glob.glob(os.path.join(WGSSPADES_DIR, '*', 'reports', report_name))
+    instrumentation.count('files_listed', len(report_list))
+    return report_list
+
+
+def order_newest_first(report_list):
+    """
+    :param report_list: List of paths to report files
+    :return: List of report paths sorted from the most to the least recent run, as ordered by
+             metadata_index.get_run_order_key()
+    """
+    def sort_key(report):
+        try:
+            mtime = os.path.getmtime(report)
+        except OSError:
+            mtime = 0
+        return metadata_index.get_run_order_key(report, mtime)
+    return sorted(report_list, key=sort_key)
+
+
+def find_report_rows(report_name, seq_list, id_column, index_path=metadata_index.INDEX_PATH, refresh=None):
+    """
+    Uses the SeqID index to find the report files in the archive that hold any of the requested Seq IDs. The index is
+    refreshed first so that new or modified reports are picked up, unless refresh is off. Without a refresh, the index
+    is only brought up to date when it doesn't know about one of the requested Seq IDs.
+    :param report_name: Name of the report file within each run's reports folder, i.e. combinedMetadata.csv
+    :param seq_list: List of OLC Seq IDs
+    :param id_column: Column used to specify primary key
+    :param index_path: Path to the SeqID index database
+    :param refresh: Refresh the index before the lookup. Defaults to REFRESH_INDEX.
+    :return: Dictionary containing report paths as keys and a dictionary of {Seq ID: row} as values
+    """
+    if refresh is None:
+        refresh = REFRESH_INDEX
+    with instrumentation.stage('index'):
+        con = metadata_index.connect_index(index_path)
+        try:
+            if not refresh:
+                report_rows = metadata_index.lookup_reports(seq_list=seq_list, id_column=id_column, con=con)
+                found = {seqid for rows in report_rows.values() for seqid in rows}
+                if found >= set(seq_list):
+                    return report_rows
+                logger.info('{} Seq IDs are not in the SeqID index yet, refreshing it'.format(
+                    len(set(seq_list) - found)))
+            metadata_index.update_index(report_list=list_reports(report_name), id_column=id_column, con=con,
+                                        use_cache=USE_NAS_CACHE)
+            report_rows = metadata_index.lookup_reports(seq_list=seq_list, id_column=id_column, con=con)
+        finally:
+            con.close()
+    return report_rows
+
+
+def find_reports(report_name, seq_list, id_column, index_path=metadata_index.INDEX_PATH):
+    """
+    :param report_name: Name of the report file within each run's reports folder, i.e. combinedMetadata.csv
+    :param seq_list: List of OLC Seq IDs
+    :param id_column: Column used to specify primary key
+    :param index_path: Path to the SeqID index database
+    :return: List of paths to report files containing at least one of the requested Seq IDs
+    """
+    return sorted(find_report_rows(report_name=report_name, seq_list=seq_list, id_column=id_column,
+                                   index_path=index_path))
+
+
 def get_combined_metadata(seq_list):
     """
     :param seq_list: List of OLC Seq IDs
     :return: Dictionary containing Seq IDs as keys and combinedMetadata dataframes as values
     """
-    # Grab every single combinedMetadata file we have
-    # all_reports = glob.glob('/mnt/nas/WGSspades/*/reports/combinedMetadata.csv')
-    metadata_reports = glob.glob('/home/dussaultf/Documents/COWBAT_TEST_V2/reports/combinedMetadata.csv')
+    # Only open the combinedMetadata files that hold the requested Seq IDs
+    metadata_reports = find_reports(report_name='combinedMetadata.csv', seq_list=seq_list, id_column='SeqID')
     metadata_report_dict = create_report_dictionary(report_list=metadata_reports, seq_list=seq_list, id_column='SeqID')
     return metadata_report_dict
 
 
-# TODO: Fix this for production to retrieve full list of GDCS reports
 def get_gdcs(seq_list):
     """
     :param seq_list: List of OLC Seq IDs
     :return: Dictionary containing Seq IDs as keys and GDCS dataframes as values
     """
-    # Grab every single combinedMetadata file we have
-    # all_reports = glob.glob('/mnt/nas/WGSspades/*/reports/combinedMetadata.csv')
-    gdcs_reports = glob.glob('/home/dussaultf/Documents/COWBAT_TEST_V2/reports/GDCS.csv')
+    # Only open the GDCS files that hold the requested Seq IDs
+    gdcs_reports = find_reports(report_name='GDCS.csv', seq_list=seq_list, id_column='Strain')
     gdcs_report_dict = create_report_dictionary(report_list=gdcs_reports, seq_list=seq_list, id_column='Strain')
     return gdcs_report_dict
 
 
-def validate_genus(seq_list, genus):
+def load_sample_data(seq_list, use_index=True, workers=SCAN_WORKERS, use_processes=False,
+                     index_path=metadata_index.INDEX_PATH, refresh=None):
     """
-    Validates whether or not the expected genus matches the observed genus parsed from combinedMetadata.
+    Reads each run folder's reports directory once, joining combinedMetadata.csv with GDCS.csv on SeqID/Strain. The
+    returned dictionary can be shared by validation, the report tables and generate_gdcs_dict() so the archive is only
+    read once per ROGA. With USE_COLUMNAR_STORE set, the samples are read from the columnar store instead.
+    :param seq_list: List of OLC Seq IDs
+    :param use_index: Only read the run folders the SeqID index says hold the requested Seq IDs. If False, the whole
+                      archive is scanned.
+    :param workers: Number of run folders to read concurrently
+    :param use_processes: Read run folders in a process pool rather than a thread pool
+    :param index_path: Path to the SeqID index database
+    :param refresh: Refresh the SeqID index before the lookup. Defaults to REFRESH_INDEX.
+    :return: Dictionary containing Seq IDs as keys and SampleRecord objects as values
+    """
+    if use_index and USE_COLUMNAR_STORE:
+        try:
+            # columnar_store builds on this module, so it is only imported once it's used
+            import columnar_store
+            return columnar_store.load_samples(seq_list, workers=workers, index_path=index_path, refresh=refresh)
+        except ImportError as e:
+            logger.warning('Could not use the columnar store ({}), reading the CSVs instead'.format(e))
+
+    if use_index:
+        report_rows = find_report_rows(report_name='combinedMetadata.csv', seq_list=seq_list, id_column='SeqID',
+                                       index_path=index_path, refresh=refresh)
+    else:
+        report_rows = {report: None for report in list_reports('combinedMetadata.csv')}
+
+    with instrumentation.stage('scan'):
+        return scan_archive(seq_list=seq_list, report_rows=report_rows, workers=workers,
+                            use_processes=use_processes)
+
+
+def scan_archive(seq_list, report_rows, workers=SCAN_WORKERS, use_processes=False):
+    """
+    Reads run folders concurrently and merges the resulting sample records. Run folders are merged from newest to
+    oldest, so when a Seq ID was resequenced the record from the most recent run is kept no matter which read finishes
+    first. No further run folders are read once every requested Seq ID has been resolved.
+    :param seq_list: List of OLC Seq IDs
+    :param report_rows: Dictionary containing combinedMetadata.csv paths as keys and the Seq IDs known to be in each
+                        file as values (None if unknown)
+    :param workers: Number of run folders to read concurrently
+    :param use_processes: Read run folders in a process pool rather than a thread pool
+    :return: Dictionary containing Seq IDs as keys and SampleRecord objects as values
+    """
+    ordered_reports = order_newest_first(report_rows)
+    unresolved = set(seq_list)
+    sample_dict = {}
+
+    # Completed reads waiting on a newer run folder to finish before they can be merged
+    completed = {}
+    next_to_merge = 0
+    next_to_submit = 0
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    # Counters from worker processes can't be recorded against the run; threads are recorded through propagate()
+    read_run = scan_run if use_processes else instrumentation.propagate(scan_run)
+    with executor_class(max_workers=max(1, workers)) as executor:
+        running = {}
+        while unresolved and (running or next_to_submit < len(ordered_reports)):
+            # Keep a bounded window of reads in flight so an early stop doesn't leave the whole archive queued
+            while next_to_submit < len(ordered_reports) and len(running) < max(1, workers) * 2:
+                report = ordered_reports[next_to_submit]
+                future = executor.submit(read_run, report, list(unresolved), report_rows[report])
+                running[future] = next_to_submit
+                next_to_submit += 1
+
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = running.pop(future)
+                try:
+                    completed[position] = future.result()
+                except Exception as e:
+                    logger.warning('Could not read {}: {}'.format(ordered_reports[position], e))
+                    completed[position] = []
+
+            # Merge in newest-first order. The first record seen for a Seq ID wins.
+            while next_to_merge in completed:
+                for record in completed.pop(next_to_merge):
+                    if record.seq_id not in sample_dict:
+                        sample_dict[record.seq_id] = record
+                        unresolved.discard(record.seq_id)
+                next_to_merge += 1
+
+        # Everything has been resolved; don't wait on reads of older run folders
+        for future in running:
+            future.cancel()
+
+    # Keep the order the Seq IDs were requested in
+    return {seqid: sample_dict[seqid] for seqid in seq_list if seqid in sample_dict}
+
+
+def scan_run(metadata_report, seq_list, expected_ids=None):
+    """
+    Reads a single run folder for scan_archive(). When the Seq IDs held by the file aren't already known from the
+    index, the raw bytes are searched first and the file is only handed to the CSV parser if it holds a requested ID.
+    :param metadata_report: Path to the run's combinedMetadata.csv
+    :param seq_list: List of OLC Seq IDs
+    :param expected_ids: Seq IDs known to be in the combinedMetadata file, or None if unknown
+    :return: List of SampleRecord objects
+    """
+    if expected_ids is None:
+        expected_ids = prefilter_report(report=metadata_report, seq_list=seq_list)
+        if not expected_ids:
+            return []
+    return load_run_samples(metadata_report=metadata_report, seq_list=seq_list, expected_ids=expected_ids)
+
+
+def compile_id_pattern(seq_list):
+    """
+    :param seq_list: List of OLC Seq IDs
+    :return: Compiled bytes regex matching any of the Seq IDs as a whole token, i.e. 2017-SEQ-072 will not match
+             within 2017-SEQ-0725
+    """
+    # Longest IDs first so the alternation never settles on a shorter ID that prefixes a longer one
+    ids = sorted({seqid.encode() for seqid in seq_list}, key=len, reverse=True)
+    return re.compile(rb'(?<![\w-])(' + b'|'.join(re.escape(seqid) for seqid in ids) + rb')(?![\w-])')
+
+
+def prefilter_report(report, seq_list):
+    """
+    Memory-maps a report file and searches it for all of the requested Seq IDs in a single pass, without parsing it
+    as a CSV
+    :param report: Path to report file
+    :param seq_list: List of OLC Seq IDs
+    :return: Set of the requested Seq IDs that appear in the file
+    """
+    if not seq_list:
+        return set()
+    pattern = compile_id_pattern(seq_list)
+
+    # Serve the file from the local read-through cache when enabled
+    if USE_NAS_CACHE:
+        report = nas_cache.cached_path(report)
+    with open(report, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        instrumentation.count('files_scanned')
+        instrumentation.count('bytes_read', size)
+        # Empty files can't be memory-mapped
+        if size == 0:
+            return set()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return {match.group(1).decode() for match in pattern.finditer(data)}
+
+
+def load_run_samples(metadata_report, seq_list, expected_ids=None):
+    """
+    Reads the combinedMetadata.csv and GDCS.csv of a single run folder and builds a SampleRecord for each requested
+    Seq ID found in it
+    :param metadata_report: Path to the run's combinedMetadata.csv
+    :param seq_list: List of OLC Seq IDs
+    :param expected_ids: Seq IDs known to be in the combinedMetadata file. The whole file is read if None.
+    :return: List of SampleRecord objects
+    """
+    rows = read_report(report=metadata_report, id_column='SeqID', seq_list=seq_list,
+                       columns=METADATA_COLUMNS, expected_ids=expected_ids)
+    if not rows:
+        return []
+
+    # Pull the GDCS results from the same reports folder
+    gdcs_report = os.path.join(os.path.dirname(metadata_report), 'GDCS.csv')
+    if os.path.isfile(gdcs_report):
+        found_ids = [row['SeqID'] for row in rows]
+        gdcs_rows = {row['Strain']: row for row in read_report(report=gdcs_report, id_column='Strain',
+                                                               seq_list=found_ids, columns=GDCS_COLUMNS,
+                                                               expected_ids=found_ids)}
+        for row in rows:
+            row.update(gdcs_rows.get(row['SeqID'], {}))
+
+    # Build one compact record per sample
+    run_folder = metadata_index.get_run_folder(metadata_report)
+    return [SampleRecord.from_row(row, run_folder=run_folder) for row in rows]
+
+
+def validate_samples(seq_list, genus, metadata_reports, species=None):
+    """
+    Runs every validation check over all of the requested samples at once, straight from their SampleRecords
     :param seq_list: List of OLC Seq IDs
     :param genus: String of expected genus (Salmonella, Listeria, Escherichia)
-    :return: Dictionary containing Seq IDs as keys and a 'valid status' as the value
+    :param metadata_reports: Dictionary retrieved from load_sample_data()
+    :param species: Expected MASH reference genome. Defaults to the species in mash_species for the genus.
+    :return: Dictionary of check names to dictionaries of {Seq ID: passed}, holding every requested sample found in
+             metadata_reports in the order requested. The checks are:
+             genus - observed genus matches the expected genus
+             mash - MASH reference genome matches the expected species (always False if there is no expected species)
+             uida - uidA marker detected by GeneSeekr
+             vt - vt marker detected by Vtyper
+             marker:<name> - marker detected, for every marker check in the genus spec's checks
     """
-    metadata_reports = get_combined_metadata(seq_list)
+    if species is None:
+        species = mash_species.get(genus)
+    records = [(seqid, metadata_reports[seqid]) for seqid in seq_list if seqid in metadata_reports]
 
-    valid_status = {}
+    marker_checks = {'uida': MARKER_BITS['uidA'], 'vt': MARKER_BITS['vt']}
+    for check in genus_specs.get(genus, {}).get('checks', ()):
+        marker = get_check_marker(check)
+        if marker is not None and check not in marker_checks:
+            marker_checks[check] = MARKER_BITS[marker]
+
+    flags = {'genus': {seqid: record.genus == genus for seqid, record in records},
+             'mash': {seqid: record.mash_reference_genome == species for seqid, record in records}}
+    for check, bit in marker_checks.items():
+        flags[check] = {seqid: record.markers & bit != 0 for seqid, record in records}
+    return flags
 
-    for seqid in seq_list:
-        print('Validating {} genus'.format(seqid))
-        df = metadata_reports[seqid]
-        observed_genus = df.loc[df['SeqID'] == seqid]['Genus'].values[0]
-        if observed_genus == genus:
-            valid_status[seqid] = True  # Valid genus
-        else:
-            valid_status[seqid] = False  # Invalid genus
 
-    return valid_status
+def validate_genus(seq_list, genus, metadata_reports=None):
+    """
+    Validates whether or not the expected genus matches the observed genus parsed from combinedMetadata.
+    :param seq_list: List of OLC Seq IDs
+    :param genus: String of expected genus (Salmonella, Listeria, Escherichia)
+    :param metadata_reports: Dictionary retrieved from load_sample_data(). Loaded from the archive if not provided.
+    :return: Dictionary containing Seq IDs as keys and a 'valid status' as the value. Seq IDs that weren't found in the
+             archive are invalid.
+    """
+    if metadata_reports is None:
+        metadata_reports = load_sample_data(seq_list)
+
+    logger.info('Validating genus for {} samples'.format(len(seq_list)))
+    flags = validate_samples(seq_list=seq_list, genus=genus, metadata_reports=metadata_reports)
+    return {seqid: flags['genus'].get(seqid, False) for seqid in seq_list}
 
 
 def validate_ecoli(seq_list, metadata_reports):
@@ -79,27 +434,15 @@ def validate_ecoli(seq_list, metadata_reports):
     Checks if the uidA marker and vt markers are present in the combinedMetadata sheets and stores True/False for
     each SeqID. Values are stored as tuples: (uida_present, verotoxigenic)
     :param seq_list: List of OLC Seq IDs
-    :param metadata_reports: Dictionary retrieved from get_combined_metadata()
+    :param metadata_reports: Dictionary retrieved from load_sample_data()
     :return: Dictionary containing Seq IDs as keys and (uidA, vt) presence or absence for values.
              Present = True, Absent = False
     """
-    ecoli_seq_status = {}
+    logger.info('Validating uidA and vt marker detection for {} samples'.format(len(seq_list)))
+    flags = validate_samples(seq_list=seq_list, genus='Escherichia', metadata_reports=metadata_reports)
 
-    for seqid in seq_list:
-        print('Validating {} uidA and vt marker detection'.format(seqid))
-        df = metadata_reports[seqid]
-        observed_genus = df.loc[df['SeqID'] == seqid]['Genus'].values[0]
-        uida_present = False
-        verotoxigenic = False
-
-        if observed_genus == 'Escherichia':
-            if 'uidA' in df.loc[df['SeqID'] == seqid]['GeneSeekr_Profile'].values[0]:
-                uida_present = True
-            if 'vt' in df.loc[df['SeqID'] == seqid]['Vtyper_Profile'].values[0]:
-                verotoxigenic = True
-            ecoli_seq_status[seqid] = (uida_present, verotoxigenic)
-
-    return ecoli_seq_status
+    # Only samples observed to be Escherichia are checked
+    return {seqid: (flags['uida'][seqid], flags['vt'][seqid]) for seqid, is_genus in flags['genus'].items() if is_genus}
 
 
 def validate_mash(seq_list, metadata_reports, expected_species):
@@ -107,40 +450,38 @@ def validate_mash(seq_list, metadata_reports, expected_species):
     Takes a species name as a string (i.e. 'Salmonella enterica') and creates a dictionary with keys for each Seq ID
     and boolean values if the value pulled from MASH_ReferenceGenome matches the string or not
     :param seq_list: List of OLC Seq IDs
-    :param metadata_reports: Dictionary retrieved from get_combined_metadata()
+    :param metadata_reports: Dictionary retrieved from load_sample_data()
     :param expected_species: String containing expected species
     :return: Dictionary with Seq IDs as keys and True/False as values
     """
-    seq_status = {}
-
-    for seqid in seq_list:
-        print('Validating MASH reference genome for {} '.format(seqid))
-        df = metadata_reports[seqid]
-        observed_species = df.loc[df['SeqID'] == seqid]['MASH_ReferenceGenome'].values[0]
+    logger.info('Validating MASH reference genome for {} samples'.format(len(seq_list)))
+    flags = validate_samples(seq_list=seq_list, genus=None, metadata_reports=metadata_reports,
+                             species=expected_species)
+    return flags['mash']
 
-        if observed_species == expected_species:
-            seq_status[seqid] = True
-        else:
-            seq_status[seqid] = False
-
-    return seq_status
 
-def generate_validated_list(seq_list, genus):
+def generate_validated_list(seq_list, genus, metadata_reports=None):
     """
     :param seq_list: List of OLC Seq IDs
     :param genus: String of expected genus (Salmonella, Listeria, Escherichia)
+    :param metadata_reports: Dictionary retrieved from load_sample_data(). Loaded from the archive if not provided.
     :return: List containing each valid Seq ID
     """
+    if metadata_reports is None:
+        metadata_reports = load_sample_data(seq_list)
+
     # VALIDATION
     validated_list = []
-    validated_dict = validate_genus(seq_list=seq_list, genus=genus)
+    validated_dict = validate_genus(seq_list=seq_list, genus=genus, metadata_reports=metadata_reports)
 
     for seqid, valid_status in validated_dict.items():
         if validated_dict[seqid]:
             validated_list.append(seqid)
+        elif seqid not in metadata_reports:
+            logger.warning('Seq ID {} was not found in the archive and was ignored.'.format(seqid))
         else:
-            print('WARNING: '
-                  'Seq ID {} does not match the expected genus of {} and was ignored.'.format(seqid, genus.upper()))
+            logger.warning('Seq ID {} does not match the expected genus of {} and was ignored.'.format(seqid,
+                                                                                                      genus.upper()))
     return validated_list
 
 
@@ -152,24 +493,20 @@ def parse_geneseekr_profile(value):
     :return: List of markers parsed from value
     """
     detected_markers = []
-    marker_list = ['invA', 'stn', 'IGS', 'hlyA', 'inlJ', 'VT1', 'VT2', 'VT2f', 'uidA', 'eae']
     markers = value.split(';')
     for marker in markers:
-        if marker in marker_list:
+        if marker in GENESEEKR_BITS:
             detected_markers.append(marker)
     return detected_markers
 
 
 def generate_gdcs_dict(gdcs_reports):
     """
-    :param gdcs_reports: Dictionary derived from get_gdcs() function
+    :param gdcs_reports: Dictionary derived from load_sample_data()
     :return: Dictionary containing parsed GDCS values
     """
     gdcs_dict = {}
-    for sample_id, df in gdcs_reports.items():
-        # Grab values
-        matches = df.loc[df['Strain'] == sample_id]['Matches'].values[0]
-        passfail = df.loc[df['Strain'] == sample_id]['Pass/Fail'].values[0]
-        gdcs_dict[sample_id] = (matches, passfail)
+    for sample_id, record in gdcs_reports.items():
+        gdcs_dict[sample_id] = (record.gdcs_matches, record.gdcs_pass)
     return gdcs_dict
 
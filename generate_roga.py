@@ -4,12 +4,27 @@ from pylatex.utils import italic, bold
 from datetime import datetime
 from database import update_db
 import extract_report_data
+import instrumentation
+import latex_compile
+import latex_format
+import pdf_cache
+import pdf_render
+import report_model
+from report_model import lab_info, supported_genera, template_version
 import pylatex as pl
 import click
+import sys
 import os
-import re
 
 
+logger = instrumentation.get_logger(__name__)
+
+# Ways a report can be rendered to PDF: PyLaTeX + pdflatex, or ReportLab without TeX
+render_backends = ['latex', 'reportlab']
+
+# LaTeX macro holding the issue date shown in the header
+REPORT_DATE_MACRO = r'\reportdate'
+
 # TODO: GDCS + GenomeQAML combined metric. Everything must pass in order to be listed as 'PASS'
 # TODO: Port for Redmine usage
 
@@ -23,36 +38,112 @@ combinedMetadata.csv
 """
 
 
-# TODO: Finish populating this dictionary
-lab_info = {
-    'GTA-CFIA': ('2301 Midland Ave., Scarborough, ON, M1P 4R7', '(416) 973-0798'),
-    'BUR-CFIA': ('3155 Willington Green, Burnaby, BC, V5G 4P2', '(604) 292-6028'),
-    'DAR-CFIA': ('1992 Agency Dr., Dartmouth, NS, B2Y 3Z7', '(902) 536-1046'),
-    'OLC-CFIA': ('960 Carling Ave, Ottawa, ON, K1A 0Y9', '(613) 759-1220'),
-    'OLF-CFIA': ('3851 Fallowfield Rd., Ottawa, ON, K2H 8P9', '(343) 212-0416')
-}
-
-
-def generate_roga(seq_list, genus, lab, source):
+def generate_roga(seq_list, genus, lab, source, metadata_reports=None, use_format=False, use_cache=True,
+                  backend='latex'):
     """
     Generates PDF ROGA
     :param seq_list: List of OLC Seq IDs
     :param genus: Expected Genus for samples (Salmonella, Listeria, or Escherichia)
     :param lab: ID for lab report is being generated for
     :param source: string input for source that strains were derived from, i.e. 'ground beef'
+    :param metadata_reports: Dictionary retrieved from extract_report_data.load_sample_data(). Loaded from the archive
+                             if not provided.
+    :param use_format: Compile against a cached precompiled format of the shared preamble (see latex_format)
+    :param use_cache: Return the previously issued PDF if a report with identical content was already generated
+    :param backend: Rendering backend, one of render_backends
+    :return: Path to the generated PDF
+    """
+
+    with instrumentation.run('generate_roga', genus=genus, lab=lab, samples=len(seq_list), backend=backend) as run:
+        # Grab the sample records for each requested Seq ID
+        with instrumentation.stage('data'):
+            if metadata_reports is None:
+                metadata_reports = extract_report_data.load_sample_data(seq_list)
+            metadata_reports = {seqid: metadata_reports[seqid] for seqid in seq_list if seqid in metadata_reports}
+
+        # Reuse an identical report that was already issued
+        with instrumentation.stage('cache'):
+            report_key = pdf_cache.get_report_key(metadata_reports=metadata_reports, genus=genus, lab=lab,
+                                                  source=source, template_version=template_version, backend=backend)
+            cached_report = pdf_cache.restore(report_key) if use_cache else None
+        if cached_report is not None:
+            pdf_path, cached_metadata = cached_report
+            logger.info('An identical report was already issued as {} on {}. Reusing {}'.format(
+                cached_metadata['report_id'], cached_metadata['date'], pdf_path))
+            run.update(report_id=cached_metadata['report_id'], cached=True)
+            return pdf_path
+
+        # Date setup
+        date = datetime.today().strftime('%Y-%m-%d')
+        year = datetime.today().strftime('%Y')
+
+        # DATABASE HANDLING
+        with instrumentation.stage('database'):
+            report_id = update_db(date=date, year=year, genus=genus, lab=lab, source=source)
+        run.update(report_id=report_id, cached=False)
+
+        with instrumentation.stage('build'):
+            model = report_model.build_report_model(metadata_reports=metadata_reports,
+                                                    genus=genus,
+                                                    lab=lab,
+                                                    source=source,
+                                                    report_id=report_id,
+                                                    date=date)
+
+        filepath = get_report_filepath(report_id=report_id, genus=genus, date=date)
+        with instrumentation.stage('render'):
+            render_report(model=model, filepath=filepath, backend=backend, use_format=use_format)
+
+        # The report has been issued by now, so failing to cache it mustn't fail the report
+        if use_cache:
+            with instrumentation.stage('cache'):
+                try:
+                    pdf_cache.store(report_key, filepath + '.pdf', report_id=report_id, date=date)
+                except Exception as e:
+                    logger.warning('Could not cache {}: {}'.format(filepath + '.pdf', e))
+        return filepath + '.pdf'
+
+
+def render_report(model, filepath, backend='latex', use_format=False):
+    """
+    Renders a report model to filepath + '.pdf'
+    :param model: Dictionary retrieved from report_model.build_report_model()
+    :param filepath: Path to the report without the file extension
+    :param backend: Rendering backend, one of render_backends
+    :param use_format: Compile against a cached precompiled format of the shared preamble (LaTeX backend only)
     """
+    if backend == 'reportlab':
+        pdf_render.render_pdf(model, filepath + '.pdf')
+    elif backend == 'latex':
+        render_latex_document(model).generate_tex(filepath)
+        if use_format:
+            latex_format.compile_with_format(filepath)
+        else:
+            latex_compile.compile_tex(filepath)
+    else:
+        raise ValueError('Unknown rendering backend "{}". Expected one of {}'.format(backend, render_backends))
 
-    # Grab combinedMetadata dataframes for each requested Seq ID
-    metadata_reports = extract_report_data.get_combined_metadata(seq_list)
 
-    # Date setup
-    date = datetime.today().strftime('%Y-%m-%d')
-    year = datetime.today().strftime('%Y')
+def get_report_filepath(report_id, genus, date, output_dir=None):
+    """
+    :param report_id: Report ID retrieved from update_db()
+    :param genus: Expected Genus for samples (Salmonella, Listeria, or Escherichia)
+    :param date: Date string the report was issued
+    :param output_dir: Directory to write the report to. Defaults to the current directory.
+    :return: Path to the report without the file extension
+    """
+    filename = '{}_{}_{}'.format(report_id, genus, date)
+    if output_dir is not None:
+        return os.path.join(output_dir, filename)
+    return filename
 
-    # Grab GDCS data for each requested Seq ID
-    gdcs_reports = extract_report_data.get_gdcs(seq_list)
-    gdcs_dict = extract_report_data.generate_gdcs_dict(gdcs_reports)
 
+def render_latex_document(model):
+    """
+    Lays out a report model as a LaTeX document
+    :param model: Dictionary retrieved from report_model.build_report_model()
+    :return: PyLaTeX Document
+    """
     # Page setup
     geometry_options = {"tmargin": "2cm",
                         "lmargin": "1.8cm",
@@ -67,67 +158,17 @@ def generate_roga(seq_list, genus, lab, source):
     doc.preamble.append(header)
     doc.change_document_style("header")
 
-    # DATABASE HANDLING
-    report_id = update_db(date=date, year=year, genus=genus, lab=lab, source=source)
-
-    # SECOND VALIDATION SCREEN
-    if genus == 'Escherichia':
-        validated_ecoli_dict = extract_report_data.validate_ecoli(seq_list, metadata_reports)
-        vt_list = []
-        uida_list = []
-
-        for key, value in validated_ecoli_dict.items():
-            ecoli_uida_present = validated_ecoli_dict[key][0]
-            ecoli_vt_present = validated_ecoli_dict[key][1]
-
-            uida_list.append(ecoli_uida_present)
-            vt_list.append(ecoli_vt_present)
-
-            if not ecoli_uida_present:
-                print('WARNING: uidA not present for {}. Cannot confirm E. coli.'.format(key))
-            if not ecoli_vt_present:
-                print('WARNING: vt marker not detected for {}. Cannot confirm strain is verotoxigenic.'.format(key))
-
-        all_uida = False
-        if False not in uida_list:
-            all_uida = True
-
-        all_vt = False
-        if False not in vt_list:
-            all_vt = True
-
-    elif genus == 'Listeria':
-        validated_listeria_dict = extract_report_data.validate_mash(seq_list,
-                                                                    metadata_reports,
-                                                                    'Listeria monocytogenes')
-        mono_list = []
-        for key, value in validated_listeria_dict.items():
-            mono_list.append(value)
-
-        if False not in mono_list:
-            all_mono = True
-        else:
-            all_mono = False
-
-    elif genus == 'Salmonella':
-        validated_salmonella_dict = extract_report_data.validate_mash(seq_list,
-                                                                      metadata_reports,
-                                                                      'Salmonella enterica')
-        enterica_list = []
-        for key, value in validated_salmonella_dict.items():
-            enterica_list.append(value)
-
-        if False not in enterica_list:
-            all_enterica = True
-        else:
-            all_enterica = False
+    # Defined after \begin{document}, so the preamble and its precompiled format are the same whatever the issue date
+    doc.append(pl.Command('newcommand', arguments=[pl.NoEscape(REPORT_DATE_MACRO), model['date']]))
+
+    lab = model['lab']
 
     # DOCUMENT BODY/CREATION
-    with doc.create(pl.Section('Report of Genomic Analysis: ' + genus, numbering=False)):
+    with doc.create(pl.Section('Report of Genomic Analysis: ' + model['genus'], numbering=False)):
 
         # REPORT ID
         doc.append(bold('Report ID: '))
-        doc.append(report_id)
+        doc.append(model['report_id'])
 
         # REPORTING LAB
         doc.append(bold('\nReporting laboratory: '))
@@ -139,275 +180,17 @@ def generate_roga(seq_list, genus, lab, source):
             table.add_row(bold('Laboratory'),
                           bold('Address'),
                           bold('Tel #'))
-            table.add_row(lab, lab_info[lab][0], lab_info[lab][1])
+            table.add_row(lab, model['lab_address'], model['lab_phone'])
 
         # TEXT SUMMARY
         with doc.create(pl.Subsection('Identification Summary', numbering=False)) as summary:
+            for text, is_italic in model['summary']:
+                summary.append(italic(text) if is_italic else text)
 
-            summary.append('Whole-genome sequencing analysis was conducted on {} presumptive '.format(len(metadata_reports)))
-            summary.append(italic('{} '.format(genus)))
-
-            if len(metadata_reports) == 1:
-                summary.append('strain isolated from {}. '.format(source))
-            else:
-                summary.append('strains isolated from {}. '.format(source))
-
-            if genus == 'Escherichia':
-                if all_uida:
-                    summary.append('All of the following strains are confirmed as ')
-                    summary.append(italic('Escherichia coli '))
-                    summary.append('based on 16S sequence and the presence of marker gene ')
-                    summary.append(italic('uidA. '))
-                elif not all_uida:
-                    summary.append('Some of the following strains could not be confirmed to be ')
-                    summary.append(italic('Escherichia coli '))
-                    summary.append('as the ')
-                    summary.append(italic('uidA '))
-                    summary.append('marker gene was not detected. ')
-
-                if all_vt:
-                    summary.append('All strains are confirmed to be verotoxigenic based on presence of the ')
-                    summary.append(italic('vt '))
-                    summary.append('marker.')
-
-            elif genus == 'Listeria':
-                if all_mono:
-                    summary.append('All of the following strains are confirmed to be ')
-                    summary.append(italic('Listeria monocytogenes '))
-                    summary.append('based on GeneSeekr analysis. ')
-                else:
-                    summary.append('Some of the following strains could not be confirmed to be ')
-                    summary.append(italic('Listeria monocytogenes.'))
-
-            elif genus == 'Salmonella':
-                if all_enterica:
-                    summary.append('All of the following strains are confirmed to be ')
-                    summary.append(italic('Salmonella enterica '))
-                    summary.append('based on GeneSeekr analysis. ')
-                else:
-                    summary.append('Some of the following strains could not be confirmed to be ')
-                    summary.append(italic('Salmonella enterica.'))
-
-        # ESCHERICHIA TABLE
-        if genus == 'Escherichia':
-            genesippr_table_columns = (bold('LSTS ID'),
-                                       bold(pl.NoEscape(r'uidA{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'Serotype')),
-                                       bold(pl.NoEscape(r'Verotoxin Profile')),
-                                       bold(pl.NoEscape(r'eae{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'MLST')),
-                                       bold(pl.NoEscape(r'rMLST')),
-                                       )
-
-            with doc.create(pl.Subsection('GeneSeekr Analysis', numbering=False)) as genesippr_section:
-                with doc.create(pl.Tabular('|c|c|c|c|c|c|c|')) as table:
-                    # Header
-                    table.add_hline()
-                    table.add_row(genesippr_table_columns)
-
-                    # Rows
-                    for sample_id, df in metadata_reports.items():
-                        table.add_hline()
-
-                        # ID
-                        lsts_id = df.loc[df['SeqID'] == sample_id]['SampleName'].values[0]
-
-                        # Genus (pulled from 16S)
-                        genus = df.loc[df['SeqID'] == sample_id]['Genus'].values[0]
-
-                        # Serotype
-                        serotype = df.loc[df['SeqID'] == sample_id]['E_coli_Serotype'].values[0]
-
-                        # Remove % identity
-                        fixed_serotype = remove_bracketed_values(serotype)
-
-                        # Verotoxin
-                        verotoxin = df.loc[df['SeqID'] == sample_id]['Vtyper_Profile'].values[0]
-
-                        # MLST/rMLST
-                        mlst = df.loc[df['SeqID'] == sample_id]['MLST_Result'].values[0]
-                        rmlst = df.loc[df['SeqID'] == sample_id]['rMLST_Result'].values[0].replace('-', 'New')
-
-                        marker_list = df.loc[df['SeqID'] == sample_id]['GeneSeekr_Profile'].values[0]
-
-                        (uida, eae) = '-', '-'
-                        if 'uidA' in marker_list:
-                            uida = '+'
-                        if 'eae' in marker_list:
-                            eae = '+'
-
-                        table.add_row((lsts_id, uida, fixed_serotype, verotoxin, eae, mlst, rmlst))
-                    table.add_hline()
-
-                create_caption(genesippr_section, 'a', "+ indicates marker presence : "
-                                                       "- indicates marker was not detected")
-
-        # LISTERIA TABLE
-        if genus == 'Listeria':
-            genesippr_table_columns = (bold('LSTS ID'),
-                                       bold(pl.NoEscape(r'IGS{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'hlyA{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'inlJ{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'MLST')),
-                                       bold(pl.NoEscape(r'rMLST')),
-                                       )
-
-            with doc.create(pl.Subsection('GeneSeekr Analysis', numbering=False)) as genesippr_section:
-                with doc.create(pl.Tabular('|c|c|c|c|c|c|')) as table:
-                    # Header
-                    table.add_hline()
-                    table.add_row(genesippr_table_columns)
-
-                    # Rows
-                    for sample_id, df in metadata_reports.items():
-                        table.add_hline()
-
-                        # ID
-                        lsts_id = df.loc[df['SeqID'] == sample_id]['SampleName'].values[0]
-
-                        # Genus
-                        genus = df.loc[df['SeqID'] == sample_id]['Genus'].values[0]
-
-                        # MLST/rMLST
-                        mlst = df.loc[df['SeqID'] == sample_id]['MLST_Result'].values[0]
-                        rmlst = df.loc[df['SeqID'] == sample_id]['rMLST_Result'].values[0].replace('-', 'New')
-
-                        # Markers
-                        marker_list = df.loc[df['SeqID'] == sample_id]['GeneSeekr_Profile'].values[0]
-                        (igs, hlya, inlj) = '-', '-', '-'
-                        if 'IGS' in marker_list:
-                            igs = '+'
-                        if 'hlyA' in marker_list:
-                            hlya = '+'
-                        if 'inlJ' in marker_list:
-                            inlj = '+'
-
-                        table.add_row((lsts_id, igs, hlya, inlj, mlst, rmlst))
-                    table.add_hline()
-                create_caption(genesippr_section, 'a', "+ indicates marker presence : "
-                                                       "- indicates marker was not detected")
-
-        # SALMONELLA TABLE
-        if genus == 'Salmonella':
-            genesippr_table_columns = (bold('LSTS ID'),
-                                       bold(pl.NoEscape(r'Serovar')),
-                                       bold(pl.NoEscape(r'Serogroup{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'H1')),
-                                       bold(pl.NoEscape(r'H2')),
-                                       bold(pl.NoEscape(r'invA{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'stn{\footnotesize \textsuperscript {a}}')),
-                                       bold(pl.NoEscape(r'MLST')),
-                                       bold(pl.NoEscape(r'rMLST')),
-                                       )
-
-            with doc.create(pl.Subsection('GeneSeekr Analysis', numbering=False)) as genesippr_section:
-                with doc.create(pl.Tabular('|c|c|c|c|c|c|c|c|c|')) as table:
-                    # Header
-                    table.add_hline()
-                    table.add_row(genesippr_table_columns)
-
-                    # Rows
-                    for sample_id, df in metadata_reports.items():
-                        table.add_hline()
-
-                        # ID
-                        lsts_id = df.loc[df['SeqID'] == sample_id]['SampleName'].values[0]
-
-                        # MLST/rMLST
-                        mlst = df.loc[df['SeqID'] == sample_id]['MLST_Result'].values[0]
-                        rmlst = df.loc[df['SeqID'] == sample_id]['rMLST_Result'].values[0].replace('-', 'New')
-
-                        # Serovar
-                        serovar = df.loc[df['SeqID'] == sample_id]['SISTR_serovar'].values[0]
-
-                        # SISTR Serogroup, H1, H2
-                        sistr_serogroup = df.loc[df['SeqID'] == sample_id]['SISTR_serogroup'].values[0]
-                        sistr_h1 = df.loc[df['SeqID'] == sample_id]['SISTR_h1'].values[0].strip(';')
-                        sistr_h2 = df.loc[df['SeqID'] == sample_id]['SISTR_h2'].values[0].strip(';')
-
-                        # Markers
-                        marker_list = df.loc[df['SeqID'] == sample_id]['GeneSeekr_Profile'].values[0]
-                        (inva, stn) = '-', '-'
-                        if 'invA' in marker_list:
-                            inva = '+'
-                        if 'stn' in marker_list:
-                            stn = '+'
-
-                        table.add_row((lsts_id, serovar, sistr_serogroup, sistr_h1, sistr_h2, inva, stn, mlst, rmlst))
-                    table.add_hline()
-
-                create_caption(genesippr_section, 'a', "+ indicates marker presence : "
-                                                       "- indicates marker was not detected")
-
-        # SEQUENCE QUALITY METRICS
-        sequence_quality_columns = (bold('LSTS ID'),
-                                    bold(pl.NoEscape(r'Total Length')),
-                                    bold(pl.NoEscape(r'Coverage')),
-                                    bold(pl.NoEscape(r'GDCS')),
-                                    bold(pl.NoEscape(r'Pass/Fail')),
-                                    )
-
-        # Create the sequence table
-        with doc.create(pl.Subsection('Sequence Quality Metrics', numbering=False)):
-            with doc.create(pl.Tabular('|c|c|c|c|c|')) as table:
-                # Header
-                table.add_hline()
-                table.add_row(sequence_quality_columns)
-
-                # Rows
-                for sample_id, df in metadata_reports.items():
-                    table.add_hline()
-
-                    # Grab values
-                    lsts_id = df.loc[df['SeqID'] == sample_id]['SampleName'].values[0]
-                    total_length = df.loc[df['SeqID'] == sample_id]['TotalLength'].values[0]
-                    average_coverage_depth = df.loc[df['SeqID'] == sample_id]['AverageCoverageDepth'].values[0]
-
-                    # Fix coverage
-                    average_coverage_depth = format(float(average_coverage_depth.replace('X', '')), '.0f')
-                    average_coverage_depth = str(average_coverage_depth) + 'X'
-
-                    # Matches
-                    matches = gdcs_dict[sample_id][0]
-
-                    passfail = gdcs_dict[sample_id][1]
-                    if passfail == '+':
-                        passfail = 'Pass'
-                    elif passfail == '-':
-                        passfail = 'Fail'
-
-                    # Add row
-                    table.add_row((lsts_id, total_length, average_coverage_depth, matches, passfail))
-                table.add_hline()
-
-        # Pipeline metadata table
-        pipeline_metadata_columns = (bold('LSTS ID'),
-                                     bold('Seq ID'),
-                                     bold('Pipeline Version'),
-                                     bold('Database Version'))
-
-        with doc.create(pl.Subsection('Pipeline Metadata', numbering=False)):
-            with doc.create(pl.Tabular('|c|c|c|c|')) as table:
-                # Header
-                table.add_hline()
-                table.add_row(pipeline_metadata_columns)
-
-                # Rows
-                for sample_id, df in metadata_reports.items():
-                    table.add_hline()
-
-                    # LSTS ID
-                    lsts_id = df.loc[df['SeqID'] == sample_id]['SampleName'].values[0]
-
-                    # Pipeline version
-                    pipeline_version = df.loc[df['SeqID'] == sample_id]['PipelineVersion'].values[0]
-                    database_version = pipeline_version  # These have been harmonized
-                    # database_version = df.loc[df['SeqID'] == sample_id]['DatabaseVersion'].values[0]
-
-                    # Add row
-                    table.add_row((lsts_id, sample_id, pipeline_version, database_version))
-
-                table.add_hline()
+        # GENESEEKR, SEQUENCE QUALITY AND PIPELINE METADATA TABLES
+        for table_model in (model['genesippr_table'], model['quality_table'], model['pipeline_table']):
+            if table_model is not None:
+                add_table(doc, table_model)
 
         # VERIFIED BY
         with doc.create(pl.Subsubsection('Verified by:', numbering=False)):
@@ -421,12 +204,41 @@ def generate_roga(seq_list, genus, lab, source):
                                                "height=0.3in"],
                                       arguments=''))
 
-    doc.generate_pdf('{}_{}_{}'.format(report_id, genus, date), clean_tex=False)
+    return doc
+
+
+def add_table(doc, table_model):
+    """
+    Adds a titled, fully ruled table from the report model to the document
+    :param doc: PyLaTeX Document
+    :param table_model: Table dictionary from the report model
+    """
+    columns = []
+    for name, superscript in table_model['columns']:
+        if superscript:
+            name += r'{\footnotesize \textsuperscript {' + superscript + '}}'
+        columns.append(bold(pl.NoEscape(name)))
+
+    with doc.create(pl.Subsection(table_model['title'], numbering=False)) as section:
+        with doc.create(pl.Tabular('|' + 'c|' * len(columns))) as table:
+            # Header
+            table.add_hline()
+            table.add_row(columns)
+
+            # Rows
+            for row in table_model['rows']:
+                table.add_hline()
+                table.add_row(row)
+            table.add_hline()
+
+        if table_model['caption'] is not None:
+            create_caption(section, *table_model['caption'])
 
 
 def produce_header_footer():
     """
     Adds a generic header/footer to the report. Includes the date and CFIA logo in the header, and legend in the footer.
+    The date is taken from REPORT_DATE_MACRO, which render_latex_document() defines in the document body.
     """
     header = pl.PageStyle("header", header_thickness=0.1)
 
@@ -436,7 +248,7 @@ def produce_header_footer():
 
     # Date
     with header.create(pl.Head("R")):
-        header.append("Date Report Issued: " + datetime.today().strftime('%Y-%m-%d'))
+        header.append(pl.NoEscape('Date Report Issued: ' + REPORT_DATE_MACRO + '{}'))
 
     # Footer
     with header.create(pl.Foot("C")):
@@ -462,12 +274,6 @@ def create_caption(section, superscript, text):
     section.append(italic(pl.NoEscape(r'{\footnotesize {' + text + '}}')))
 
 
-def remove_bracketed_values(string):
-    p = re.compile('\(.*?\)')  # Regex to remove bracketed terms
-    new_string = re.sub(p, '', string).replace(' ', '')  # Remove bracketed terms and spaces
-    return new_string
-
-
 def get_image():
     """
     :return: full path to image file
@@ -503,34 +309,76 @@ def redmine_roga():
     lab = 'GTA-CFIA'
     source = 'flour'
 
-    # Validate user input
-    if lab not in lab_info:
-        print('Input value "{}" not found in laboratory directory. '
-              'Please specify a lab name from the following list:'.format(lab))
-        for key, value in lab_info.items():
-            print('\t' + key)
-        quit()
-
-    if genus not in ['Escherichia', 'Salmonella', 'Listeria']:
-        print('Input genus {} does not match any of the acceptable values which include: '
-              '"Escherichia", "Salmonella", "Listeria"'.format(genus))
-        quit()
-
-    # Validate Seq IDS
-    validated_list = extract_report_data.generate_validated_list(seq_list=dummy_list,
-                                                                 genus=genus)
-
+    with instrumentation.run('redmine_roga', genus=genus, lab=lab, samples=len(dummy_list)):
+        # Validate user input
+        if lab not in lab_info:
+            logger.error('Input value "{}" not found in laboratory directory. '
+                         'Please specify a lab name from the following list:\n\t{}'.format(lab, '\n\t'.join(lab_info)))
+            quit()
+
+        if genus not in supported_genera:
+            logger.error('Input genus {} does not match any of the acceptable values which include: '
+                         '{}'.format(genus, ', '.join('"{}"'.format(value) for value in supported_genera)))
+            quit()
+
+        # Load combinedMetadata and GDCS once for validation and report generation
+        with instrumentation.stage('data'):
+            metadata_reports = extract_report_data.load_sample_data(dummy_list)
+
+        # Validate Seq IDS
+        with instrumentation.stage('validation'):
+            validated_list = extract_report_data.generate_validated_list(seq_list=dummy_list,
+                                                                         genus=genus,
+                                                                         metadata_reports=metadata_reports)
+
+        if len(validated_list) == 0:
+            logger.error('No samples provided matched the expected genus. Quitting.')
+            quit()
+
+        # GENERATE REPORT
+        generate_roga(seq_list=validated_list,
+                      genus=genus,
+                      lab=lab,
+                      source=source,
+                      metadata_reports=metadata_reports)
+        logger.info('Generated ROGA successfully.')
+
+
+@click.command()
+@click.argument('seq_ids', nargs=-1, required=True)
+@click.option('--genus', required=True, type=click.Choice(supported_genera))
+@click.option('--lab', required=True, type=click.Choice(sorted(lab_info)))
+@click.option('--source', required=True, help="Source the strains were isolated from, i.e. 'ground beef'")
+@click.option('--precompiled-preamble', is_flag=True,
+              help='Compile against a cached pdflatex format of the shared preamble')
+@click.option('--no-cache', is_flag=True, help='Generate a new report even if an identical report was already issued')
+@click.option('--backend', default='latex', show_default=True, type=click.Choice(render_backends),
+              help='Render with PyLaTeX + pdflatex or directly with ReportLab')
+def generate(seq_ids, genus, lab, source, precompiled_preamble, no_cache, backend):
+    """
+    Generates the ROGA for SEQ_IDS, leaving out samples that don't match the expected genus
+    """
+    instrumentation.configure_logging()
+    seq_list = list(seq_ids)
+    metadata_reports = extract_report_data.load_sample_data(seq_list)
+    validated_list = extract_report_data.generate_validated_list(seq_list=seq_list,
+                                                                 genus=genus,
+                                                                 metadata_reports=metadata_reports)
     if len(validated_list) == 0:
-        print('ERROR: No samples provided matched the expected genus. Quitting.'.format(genus.upper()))
-        quit()
+        logger.error('No samples provided matched the expected genus. Quitting.')
+        sys.exit(1)
 
-    # GENERATE REPORT
-    generate_roga(seq_list=validated_list,
-                  genus=genus,
-                  lab=lab,
-                  source=source)
-    print('Generated ROGA successfully.')
+    pdf_path = generate_roga(seq_list=validated_list,
+                             genus=genus,
+                             lab=lab,
+                             source=source,
+                             metadata_reports=metadata_reports,
+                             use_format=precompiled_preamble,
+                             use_cache=not no_cache,
+                             backend=backend)
+    print(pdf_path)
 
 
 if __name__ == '__main__':
+    instrumentation.configure_logging()
     redmine_roga()
@@ -0,0 +1,189 @@
+import re
+from operator import attrgetter
+
+from sample_record import MARKER_BITS
+
+
+"""
+Declarative description of what a ROGA shows for each genus.
+
+Each genus spec lists:
+    species      - species the MASH reference genome is expected to match, or None
+    checks       - validation flags from extract_report_data.validate_samples() the report summarises. 'mash'
+                   compares the MASH reference genome against species, and 'marker:<name>' checks that a marker from
+                   sample_record.MARKER_BITS was detected. 'uida' and 'vt' are kept as names for 'marker:uidA' and
+                   'marker:vt'.
+    checked_samples
+                 - 'all' to check every sample, or 'observed_genus' to only check samples observed to be the genus
+    warnings     - {check: message} logged for each sample failing a check, formatted with the Seq ID
+    summary      - (check, segments when every sample passed, segments otherwise) rules appended to the summary. Each
+                   segment is a (text, italic) tuple, and text is formatted with the species.
+    table        - GeneSeekr table columns as (name, footnote superscript or None, source, transforms). The source is
+                   a SampleRecord attribute, or 'marker:<name>' for '+'/'-' from the marker bitset. transforms are names
+                   from table_transforms, applied in order.
+
+Supporting another genus only needs an entry here (and its markers in sample_record.GENESEEKR_MARKERS). Each spec's
+table is compiled once into an extractor that builds every row of the table column by column.
+"""
+
+
+# Bracketed terms, i.e. the % identities in 'O157(99.8):H7(100)'
+BRACKETED_VALUE = re.compile(r'\(.*?\)')
+
+
+def remove_bracketed_values(string):
+    """
+    :param string: i.e. 'O157(99.8):H7(100)'
+    :return: string with bracketed terms and spaces removed, i.e. 'O157:H7'
+    """
+    return BRACKETED_VALUE.sub('', string).replace(' ', '')
+
+
+# Markers checked by the checks that predate 'marker:<name>' checks
+check_markers = {'uida': 'uidA', 'vt': 'vt'}
+
+
+def get_check_marker(check):
+    """
+    :param check: Check name from a genus spec's 'checks', i.e. 'mash', 'uida' or 'marker:hlyA'
+    :return: Name of the marker the check looks for, i.e. 'hlyA', or None if it isn't a marker check
+    """
+    if check.startswith('marker:'):
+        return check.split(':', 1)[1]
+    return check_markers.get(check)
+
+
+def describe_failed_check(check, spec):
+    """
+    :param check: Check name from the spec's 'checks'
+    :param spec: Genus spec
+    :return: Short note for a sample failing the check, i.e. 'uidA not detected'
+    """
+    if check == 'mash':
+        return 'MASH reference genome does not match {}'.format(spec['species'])
+    return '{} not detected'.format(get_check_marker(check))
+
+
+# Transforms table columns can apply to their values
+table_transforms = {
+    # Serotype with % identity removed
+    'remove_bracketed_values': remove_bracketed_values,
+    # A '-' from rMLST means the sequence type is new
+    'dash_to_new': lambda value: value.replace('-', 'New'),
+    'strip_semicolons': lambda value: value.strip(';'),
+}
+
+genus_specs = {
+    'Escherichia': {
+        'species': None,
+        'checks': ('uida', 'vt'),
+        'checked_samples': 'observed_genus',
+        'warnings': {'uida': 'uidA not present for {}. Cannot confirm E. coli.',
+                     'vt': 'vt marker not detected for {}. Cannot confirm strain is verotoxigenic.'},
+        'summary': (('uida',
+                     (('All of the following strains are confirmed as ', False),
+                      ('Escherichia coli ', True),
+                      ('based on 16S sequence and the presence of marker gene ', False),
+                      ('uidA. ', True)),
+                     (('Some of the following strains could not be confirmed to be ', False),
+                      ('Escherichia coli ', True),
+                      ('as the ', False),
+                      ('uidA ', True),
+                      ('marker gene was not detected. ', False))),
+                    ('vt',
+                     (('All strains are confirmed to be verotoxigenic based on presence of the ', False),
+                      ('vt ', True),
+                      ('marker.', False)),
+                     ())),
+        'table': (('LSTS ID', None, 'sample_name', ()),
+                  ('uidA', 'a', 'marker:uidA', ()),
+                  ('Serotype', None, 'e_coli_serotype', ('remove_bracketed_values',)),
+                  ('Verotoxin Profile', None, 'vtyper_profile', ()),
+                  ('eae', 'a', 'marker:eae', ()),
+                  ('MLST', None, 'mlst_result', ()),
+                  ('rMLST', None, 'rmlst_result', ('dash_to_new',))),
+    },
+    'Salmonella': {
+        'species': 'Salmonella enterica',
+        'checks': ('mash',),
+        'checked_samples': 'all',
+        'warnings': {},
+        'summary': (('mash',
+                     (('All of the following strains are confirmed to be ', False),
+                      ('{species} ', True),
+                      ('based on GeneSeekr analysis. ', False)),
+                     (('Some of the following strains could not be confirmed to be ', False),
+                      ('{species}.', True))),),
+        'table': (('LSTS ID', None, 'sample_name', ()),
+                  ('Serovar', None, 'sistr_serovar', ()),
+                  ('Serogroup', 'a', 'sistr_serogroup', ()),
+                  ('H1', None, 'sistr_h1', ('strip_semicolons',)),
+                  ('H2', None, 'sistr_h2', ('strip_semicolons',)),
+                  ('invA', 'a', 'marker:invA', ()),
+                  ('stn', 'a', 'marker:stn', ()),
+                  ('MLST', None, 'mlst_result', ()),
+                  ('rMLST', None, 'rmlst_result', ('dash_to_new',))),
+    },
+    'Listeria': {
+        'species': 'Listeria monocytogenes',
+        'checks': ('mash',),
+        'checked_samples': 'all',
+        'warnings': {},
+        'summary': (('mash',
+                     (('All of the following strains are confirmed to be ', False),
+                      ('{species} ', True),
+                      ('based on GeneSeekr analysis. ', False)),
+                     (('Some of the following strains could not be confirmed to be ', False),
+                      ('{species}.', True))),),
+        'table': (('LSTS ID', None, 'sample_name', ()),
+                  ('IGS', 'a', 'marker:IGS', ()),
+                  ('hlyA', 'a', 'marker:hlyA', ()),
+                  ('inlJ', 'a', 'marker:inlJ', ()),
+                  ('MLST', None, 'mlst_result', ()),
+                  ('rMLST', None, 'rmlst_result', ('dash_to_new',))),
+    },
+}
+
+
+def compile_column(source, transforms):
+    """
+    :param source: SampleRecord attribute, or 'marker:<name>'
+    :param transforms: Names from table_transforms
+    :return: Function taking a list of SampleRecord objects and returning the column's value for each of them
+    """
+    functions = [table_transforms[transform] for transform in transforms]
+
+    if source.startswith('marker:'):
+        bit = MARKER_BITS[source.split(':', 1)[1]]
+
+        def read_values(records):
+            return ['+' if record.markers & bit else '-' for record in records]
+    else:
+        getter = attrgetter(source)
+
+        def read_values(records):
+            return [getter(record) for record in records]
+
+    def extract(records):
+        values = read_values(records)
+        for function in functions:
+            values = [function(value) for value in values]
+        return values
+    return extract
+
+
+def compile_table(table):
+    """
+    :param table: Column specs from a genus spec's 'table'
+    :return: Function taking a list of SampleRecord objects and returning a list with a row of strings for each
+    """
+    extractors = [compile_column(source, transforms) for name, superscript, source, transforms in table]
+
+    def extract_rows(records):
+        columns = [extract(records) for extract in extractors]
+        return [list(row) for row in zip(*columns)]
+    return extract_rows
+
+
+# Compiled GeneSeekr table extractor for each genus
+table_extractors = {genus: compile_table(spec['table']) for genus, spec in genus_specs.items()}
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+"""
+Stage timings, counters and logging for ROGA generation.
+
+Code being measured wraps each stage in stage('name') and bumps counters with count('name', amount). Both are
+accumulated into process totals, and into every run active in the current context. An entry point wraps a whole report
+in run('name'), which writes the stages and counters recorded within it as one JSON line to the metrics log, and
+rewrites the Prometheus text file with the process totals if one is configured. Runs are tracked through contextvars,
+so runs that overlap in the same process (i.e. concurrent jobs in roga_service) each only see their own stages and
+counters. Work handed to a thread pool is wrapped in propagate() so that it is recorded against the run that handed it
+off.
+
+Counters:
+    files_listed      - report files found by globbing the archive
+    files_scanned     - report files opened, either to be searched or parsed
+    bytes_read        - bytes of report files searched or parsed
+    rows_parsed       - CSV rows parsed from report files
+    nas_bytes_copied  - bytes copied from the NAS into the nas_cache
+    db_round_trips    - statements sent to the ROGA database
+    latex_passes      - LaTeX compiler passes
+"""
+
+
+# JSON lines log of every run. Set the variable to an empty string to turn it off.
+METRICS_LOG_ENV = 'AUTOROGA_METRICS_LOG'
+METRICS_LOG = os.path.join(os.path.expanduser('~'), '.autoroga', 'metrics.jsonl')
+
+# Size the metrics log may reach before it is rotated to <log>.1, replacing the previous rotated log
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+# Prometheus text format file, i.e. in the node_exporter textfile collector directory. Not written unless set.
+PROMETHEUS_FILE_ENV = 'AUTOROGA_PROMETHEUS_FILE'
+
+LOG_FORMAT = '%(levelname)s: %(message)s'
+
+_lock = threading.Lock()
+# Serialises writes to the metrics log and Prometheus file
+_file_lock = threading.Lock()
+_counters = {}
+_stage_seconds = {}
+_stage_calls = {}
+_runs = {}
+# Accumulators of the runs active in the current context, outermost first
+_active_runs = contextvars.ContextVar('autoroga_active_runs', default=())
+
+
+def get_logger(name):
+    """
+    :param name: Name of the module logging, i.e. __name__
+    :return: Logger under the 'autoroga' hierarchy
+    """
+    return logging.getLogger('autoroga.' + name)
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Sends AutoROGA log messages to stderr as 'LEVEL: message'. Called by the command line entry points.
+    :param level: Minimum level logged
+    """
+    logger = logging.getLogger('autoroga')
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def count(name, amount=1):
+    """
+    :param name: Counter name
+    :param amount: Amount to add
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+        for accumulator in _active_runs.get():
+            accumulator['counters'][name] = accumulator['counters'].get(name, 0) + amount
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the wrapped block and adds it to the stage's total
+    :param name: Stage name, i.e. 'data' or 'render'
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.time() - start)
+
+
+def add_stage_time(name, seconds):
+    """
+    Adds time measured elsewhere to a stage's total
+    :param name: Stage name
+    :param seconds: Seconds spent in the stage
+    """
+    with _lock:
+        _stage_seconds[name] = _stage_seconds.get(name, 0.0) + seconds
+        _stage_calls[name] = _stage_calls.get(name, 0) + 1
+        for accumulator in _active_runs.get():
+            accumulator['stages'][name] = accumulator['stages'].get(name, 0.0) + seconds
+
+
+def snapshot():
+    """
+    :return: Tuple of (counters, stage seconds) dictionaries accumulated by the process so far
+    """
+    with _lock:
+        return dict(_counters), dict(_stage_seconds)
+
+
+def propagate(function):
+    """
+    Wraps a function handed to a thread pool, which doesn't carry contextvars over, so that the stages and counters it
+    records count towards the runs active where it was wrapped
+    :param function: Function to wrap
+    :return: Wrapped function
+    """
+    active_runs = _active_runs.get()
+
+    def call(*args, **kwargs):
+        token = _active_runs.set(active_runs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _active_runs.reset(token)
+    return call
+
+
+@contextmanager
+def run(name, **labels):
+    """
+    Records the stages and counters of one run, i.e. one ROGA, and writes them out once the run finishes
+    :param name: Run name, i.e. 'generate_roga'
+    :param labels: Extra values written with the run, i.e. genus and lab
+    :return: Dictionary that the run's results are written to; the caller may add labels to it while the run is going
+    """
+    accumulator = {'counters': {}, 'stages': {}}
+    token = _active_runs.set(_active_runs.get() + (accumulator,))
+    record = {'run': name, 'start': time.time(), 'status': 'ok'}
+    record.update(labels)
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = 'failed'
+        record['error'] = str(e)
+        raise
+    finally:
+        _active_runs.reset(token)
+        record['wall_time'] = time.time() - record['start']
+        with _lock:
+            record['stages'] = dict(accumulator['stages'])
+            record['counters'] = dict(accumulator['counters'])
+            runs, seconds = _runs.get((name, record['status']), (0, 0.0))
+            _runs[(name, record['status'])] = (runs + 1, seconds + record['wall_time'])
+        write_run(record)
+        write_prometheus()
+
+
+def write_run(record, path=None):
+    """
+    Appends a run record to the JSON lines metrics log, rotating the log to <path>.1 once it reaches
+    METRICS_LOG_MAX_BYTES
+    :param record: Run dictionary from run()
+    :param path: Path to the log. Defaults to the AUTOROGA_METRICS_LOG variable, then METRICS_LOG.
+    """
+    if path is None:
+        path = os.environ.get(METRICS_LOG_ENV, METRICS_LOG)
+    if not path:
+        return
+    try:
+        log_dir = os.path.dirname(path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        line = json.dumps(record, default=str) + '\n'
+        with _file_lock:
+            if os.path.isfile(path) and os.path.getsize(path) >= METRICS_LOG_MAX_BYTES:
+                os.replace(path, path + '.1')
+            with open(path, 'a') as f:
+                f.write(line)
+    except OSError as e:
+        get_logger(__name__).warning('Could not write metrics to {}: {}'.format(path, e))
+
+
+def format_prometheus():
+    """
+    :return: Process totals in the Prometheus text exposition format
+    """
+    with _lock:
+        counters = dict(_counters)
+        stage_seconds = dict(_stage_seconds)
+        stage_calls = dict(_stage_calls)
+        runs = dict(_runs)
+
+    lines = []
+    for counter in sorted(counters):
+        metric = 'autoroga_{}_total'.format(counter)
+        lines += ['# TYPE {} counter'.format(metric), '{} {}'.format(metric, counters[counter])]
+
+    if stage_seconds:
+        lines += ['# TYPE autoroga_stage_seconds_total counter']
+        lines += ['autoroga_stage_seconds_total{{stage="{}"}} {}'.format(name, stage_seconds[name])
+                  for name in sorted(stage_seconds)]
+        lines += ['# TYPE autoroga_stage_calls_total counter']
+        lines += ['autoroga_stage_calls_total{{stage="{}"}} {}'.format(name, stage_calls[name])
+                  for name in sorted(stage_calls)]
+
+    if runs:
+        lines += ['# TYPE autoroga_runs_total counter']
+        lines += ['autoroga_runs_total{{run="{}",status="{}"}} {}'.format(name, status, runs[(name, status)][0])
+                  for name, status in sorted(runs)]
+        lines += ['# TYPE autoroga_run_seconds_total counter']
+        lines += ['autoroga_run_seconds_total{{run="{}",status="{}"}} {}'.format(name, status, runs[(name, status)][1])
+                  for name, status in sorted(runs)]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path=None):
+    """
+    Rewrites the Prometheus text file with the process totals
+    :param path: Path to the file. Defaults to the AUTOROGA_PROMETHEUS_FILE variable; nothing is written if neither
+                 is set.
+    """
+    if path is None:
+        path = os.environ.get(PROMETHEUS_FILE_ENV)
+    if not path:
+        return
+    try:
+        # Write to a temporary name first so the collector never reads a partial file
+        text = format_prometheus()
+        with _file_lock:
+            with open(path + '.partial', 'w') as f:
+                f.write(text)
+            os.replace(path + '.partial', path)
+    except OSError as e:
+        get_logger(__name__).warning('Could not write metrics to {}: {}'.format(path, e))
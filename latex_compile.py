@@ -0,0 +1,84 @@
+import os
+import shutil
+import subprocess
+
+import instrumentation
+
+
+"""
+Compiles .tex files written by PyLaTeX's Document.generate_tex().
+
+PyLaTeX's own generate_pdf() changes the working directory of the whole process while it runs, so it can't be used
+from several threads at once. The functions here run the compiler in the report's directory instead, which lets a
+batch compile many reports concurrently.
+"""
+
+
+# Auxiliary files removed after a successful compile, matching PyLaTeX's generate_pdf(clean=True)
+AUX_EXTENSIONS = ('aux', 'log', 'out', 'fls', 'fdb_latexmk')
+
+# Maximum number of pdflatex passes when latexmk isn't available
+MAX_PDFLATEX_PASSES = 3
+
+
+def compile_tex(filepath, compiler_args=None, clean=True, compiler=None, env=None):
+    """
+    Compiles filepath + '.tex' to filepath + '.pdf', preferring latexmk and falling back to pdflatex
+    :param filepath: Path to the report without the file extension
+    :param compiler_args: Extra arguments passed to the compiler
+    :param clean: Remove auxiliary files once the PDF has been written
+    :param compiler: Force 'latexmk' or 'pdflatex' rather than picking whichever is installed
+    :param env: Environment variables for the compiler. Inherits the current environment if None.
+    :return: Number of LaTeX passes that were run
+    """
+    filepath = os.path.abspath(filepath)
+    dest_dir = os.path.dirname(filepath)
+    basename = os.path.basename(filepath)
+    compiler_args = list(compiler_args or [])
+
+    if compiler is None:
+        compiler = 'latexmk' if shutil.which('latexmk') else 'pdflatex'
+
+    if compiler == 'latexmk':
+        command = ['latexmk', '--pdf', '--interaction=nonstopmode'] + compiler_args + [basename + '.tex']
+        run_compiler(command, dest_dir, env=env)
+        passes = 1
+    else:
+        command = ['pdflatex', '--interaction=nonstopmode'] + compiler_args + [basename + '.tex']
+        passes = 0
+        while passes < MAX_PDFLATEX_PASSES:
+            output = run_compiler(command, dest_dir, env=env)
+            passes += 1
+            # Cross-references (i.e. hyperref forms) may need another pass
+            if 'Rerun to get' not in output:
+                break
+
+    instrumentation.count('latex_passes', passes)
+    if clean:
+        clean_aux_files(filepath)
+    return passes
+
+
+def run_compiler(command, cwd, env=None):
+    """
+    :param command: Compiler command as a list of arguments
+    :param cwd: Directory to run the compiler in
+    :param env: Environment variables for the compiler. Inherits the current environment if None.
+    :return: Compiler output
+    """
+    try:
+        output = subprocess.check_output(command, cwd=cwd, env=env, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError('{} failed:\n{}'.format(command[0], e.output.decode('utf-8', 'replace')))
+    return output.decode('utf-8', 'replace')
+
+
+def clean_aux_files(filepath):
+    """
+    :param filepath: Path to the report without the file extension
+    """
+    for extension in AUX_EXTENSIONS:
+        try:
+            os.remove(filepath + '.' + extension)
+        except FileNotFoundError:
+            pass
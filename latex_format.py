@@ -0,0 +1,155 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+
+import instrumentation
+import latex_compile
+
+
+"""
+Precompiled LaTeX formats for the shared ROGA preamble.
+
+Every report loads the same packages (geometry, booktabs, hyperref, fancyhdr...) and defines the same header and footer.
+The preamble is dumped once into a pdflatex format file with mylatexformat, named after a hash of the preamble text,
+and reports are then compiled against that format so pdflatex skips the package loading. The issue date is defined in
+the document body rather than the preamble, so the format only changes when the report template does. Only the
+MAX_FORMATS most recently used formats are kept.
+
+If the format can't be built or fails to load (i.e. it was dumped by a different pdflatex version), the report is
+compiled normally instead. Errors in the document itself are raised as they are.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Default location of cached format files
+FORMAT_DIR = os.path.join(os.path.expanduser('~'), '.autoroga', 'latex_formats')
+
+# Number of formats kept in FORMAT_DIR. The least recently used ones are removed once a new format is built.
+MAX_FORMATS = 4
+
+BEGIN_DOCUMENT = r'\begin{document}'
+
+# pdflatex output when a format file is missing or can't be loaded, i.e. when it was dumped by another pdflatex version
+FORMAT_ERRORS = ("I can't find the format file", 'Fatal format file error', 'was written by')
+
+# Serialises format builds within the process so concurrent compiles don't dump the same format twice
+_build_lock = threading.Lock()
+
+
+def split_preamble(tex):
+    """
+    :param tex: Full LaTeX source of a report
+    :return: Everything before \\begin{document}
+    """
+    return tex[:tex.index(BEGIN_DOCUMENT)]
+
+
+def get_format_name(preamble):
+    """
+    :param preamble: Preamble text retrieved from split_preamble()
+    :return: Name of the format file for that preamble, without the .fmt extension
+    """
+    return 'roga_' + hashlib.sha256(preamble.encode('utf-8')).hexdigest()[:16]
+
+
+def build_format(preamble, format_dir=FORMAT_DIR):
+    """
+    Dumps a preamble into a format file unless one already exists for it
+    :param preamble: Preamble text retrieved from split_preamble()
+    :param format_dir: Directory format files are cached in
+    :return: Name of the format
+    """
+    format_name = get_format_name(preamble)
+    format_path = os.path.join(format_dir, format_name + '.fmt')
+
+    with _build_lock:
+        if os.path.isfile(format_path):
+            # Mark the format as recently used, so evict_formats() keeps it
+            try:
+                os.utime(format_path)
+            except OSError:
+                pass
+            return format_name
+
+        os.makedirs(format_dir, exist_ok=True)
+        build_dir = tempfile.mkdtemp(dir=format_dir, prefix='.build-')
+        try:
+            with open(os.path.join(build_dir, format_name + '.tex'), 'w') as f:
+                f.write(preamble + BEGIN_DOCUMENT + '\n' + r'\end{document}' + '\n')
+            latex_compile.run_compiler(['pdflatex', '-ini', '-interaction=nonstopmode', '-jobname=' + format_name,
+                                        '&pdflatex', 'mylatexformat.ltx', format_name + '.tex'], cwd=build_dir)
+
+            # Move the finished format into place in one step so other processes never load a partial file
+            os.replace(os.path.join(build_dir, format_name + '.fmt'), format_path)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        evict_formats(format_dir)
+
+    return format_name
+
+
+def evict_formats(format_dir=FORMAT_DIR, max_formats=MAX_FORMATS):
+    """
+    Removes all but the max_formats most recently used format files, i.e. those dumped from older report templates
+    :param format_dir: Directory format files are cached in
+    :param max_formats: Number of formats to keep
+    """
+    formats = []
+    for name in os.listdir(format_dir):
+        if name.endswith('.fmt'):
+            try:
+                formats.append((os.path.getmtime(os.path.join(format_dir, name)), name))
+            except OSError:
+                pass
+    for mtime, name in sorted(formats, reverse=True)[max_formats:]:
+        logger.info('Removing unused LaTeX format {}'.format(name))
+        try:
+            os.remove(os.path.join(format_dir, name))
+        except OSError:
+            pass
+
+
+def is_format_error(message):
+    """
+    :param message: Error raised by latex_compile.run_compiler()
+    :return: True if the compile failed because the format couldn't be loaded, rather than because of the document
+    """
+    return any(error in message for error in FORMAT_ERRORS)
+
+
+def compile_with_format(filepath, format_dir=FORMAT_DIR, clean=True):
+    """
+    Compiles filepath + '.tex' against the precompiled format for its preamble, building the format first if needed.
+    Falls back to a normal compile if the format can't be built or loaded.
+    :param filepath: Path to the report without the file extension
+    :param format_dir: Directory format files are cached in
+    :param clean: Remove auxiliary files once the PDF has been written
+    :return: Number of LaTeX passes that were run
+    """
+    with open(filepath + '.tex') as f:
+        preamble = split_preamble(f.read())
+
+    try:
+        format_name = build_format(preamble, format_dir=format_dir)
+    except (OSError, RuntimeError) as e:
+        logger.warning('Could not build LaTeX format, compiling normally: {}'.format(e))
+        return latex_compile.compile_tex(filepath, clean=clean)
+
+    # The trailing separator keeps the default format search path after our cache directory
+    env = dict(os.environ, TEXFORMATS=format_dir + os.pathsep)
+    try:
+        return latex_compile.compile_tex(filepath, compiler='pdflatex', compiler_args=['-fmt=' + format_name],
+                                         clean=clean, env=env)
+    except RuntimeError as e:
+        if not is_format_error(str(e)):
+            raise
+        logger.warning('Could not load LaTeX format {}, compiling normally: {}'.format(format_name, e))
+        # Drop the stale format so it is rebuilt next time
+        try:
+            os.remove(os.path.join(format_dir, format_name + '.fmt'))
+        except OSError:
+            pass
+        return latex_compile.compile_tex(filepath, clean=clean)
@@ -0,0 +1,197 @@
+import os
+import re
+import csv
+import sqlite3
+import calendar
+from datetime import datetime
+
+import nas_cache
+
+
+"""
+On-disk index mapping OLC Seq IDs to the COWBAT report files that contain them.
+
+Each report file is recorded alongside its mtime and size so the index can be refreshed incrementally: only files
+that are new or have changed since the last refresh are re-read, and files that have disappeared from the archive are
+dropped.
+"""
+
+
+# Default location of the index database
+INDEX_PATH = os.path.join(os.path.expanduser('~'), '.autoroga', 'seqid_index.sqlite')
+
+# Run folders are named after the date the run started, i.e. 180101_M02466_0001_000000000-ABCDE
+RUN_DATE_PATTERN = re.compile(r'^(\d{6})_')
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_files (
+    path TEXT PRIMARY KEY,
+    run_folder TEXT,
+    id_column TEXT,
+    mtime REAL,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS seqid_index (
+    seqid TEXT,
+    path TEXT,
+    run_folder TEXT,
+    row INTEGER
+);
+CREATE INDEX IF NOT EXISTS seqid_index_seqid ON seqid_index (seqid);
+CREATE INDEX IF NOT EXISTS seqid_index_path ON seqid_index (path);
+"""
+
+
+def connect_index(index_path=INDEX_PATH):
+    """
+    Opens the index database, creating it if it does not exist yet
+    :param index_path: Path to the sqlite index file
+    :return: sqlite3 connection object
+    """
+    index_dir = os.path.dirname(index_path)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+    con = sqlite3.connect(index_path)
+    con.executescript(INDEX_SCHEMA)
+    return con
+
+
+def get_run_folder(report_path):
+    """
+    :param report_path: Path to a report file, i.e. /mnt/nas/WGSspades/<run>/reports/combinedMetadata.csv
+    :return: Name of the run folder the report belongs to
+    """
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(report_path))))
+
+
+def get_run_date(run_folder):
+    """
+    :param run_folder: Name of a run folder, i.e. 180101_M02466_0001_000000000-ABCDE
+    :return: ISO date string the run started, i.e. '2018-01-01', or None if the name doesn't start with a date
+    """
+    match = RUN_DATE_PATTERN.match(run_folder or '')
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), '%y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def get_run_time(report_path, mtime):
+    """
+    :param report_path: Path to a report file
+    :param mtime: mtime of the report file
+    :return: Time the report's run started in seconds since the epoch, taken from the run folder name. Falls back to
+             mtime for run folders that aren't named after a date.
+    """
+    run_date = get_run_date(get_run_folder(report_path))
+    if run_date is None:
+        return mtime
+    return calendar.timegm(datetime.strptime(run_date, '%Y-%m-%d').timetuple())
+
+
+def get_run_order_key(report_path, mtime):
+    """
+    Sort key putting reports from the most recent run first. Runs are ordered on the date in their folder name rather
+    than on mtime, so an old run that is restored, copied or touched doesn't take precedence over newer runs. Runs from
+    the same day are ordered on mtime, and remaining ties are broken on path so the order is deterministic.
+    :param report_path: Path to a report file
+    :param mtime: mtime of the report file, or 0 if it is missing
+    :return: Sort key tuple
+    """
+    return -get_run_time(report_path, mtime), -mtime, report_path
+
+
+def read_report_ids(report_path, id_column, use_cache=False):
+    """
+    Reads only the ID column of a report file without parsing the rest of the table
+    :param report_path: Path to report file
+    :param id_column: Column used to specify primary key
+    :param use_cache: Read the file from the local copy kept by nas_cache rather than directly from the NAS
+    :return: List of (row, Seq ID) tuples. Rows are numbered from 0, ignoring the header.
+    """
+    if use_cache:
+        report_path = nas_cache.cached_path(report_path)
+    with open(report_path, newline='') as report:
+        reader = csv.reader(report)
+        try:
+            header = next(reader)
+        except StopIteration:
+            return []
+        if id_column not in header:
+            return []
+        id_index = header.index(id_column)
+        return [(row, line[id_index]) for row, line in enumerate(reader) if len(line) > id_index]
+
+
+def update_index(report_list, id_column, con, prune=True, use_cache=False):
+    """
+    Brings the index up to date with the provided report files. Unchanged files (same mtime and size) are skipped.
+    :param report_list: List of paths to report files
+    :param id_column: Column used to specify primary key
+    :param con: Connection retrieved from connect_index()
+    :param prune: report_list is every report file in the archive, so indexed files missing from it are dropped. Pass
+                  False to refresh only a subset of the archive.
+    :param use_cache: Read changed files from the local copies kept by nas_cache rather than directly from the NAS
+    :return: Number of report files that were (re)indexed
+    """
+    indexed = {path: (mtime, size) for path, mtime, size in
+               con.execute('SELECT path, mtime, size FROM indexed_files WHERE id_column = ?', (id_column,))}
+
+    updated = 0
+    for report in report_list:
+        try:
+            stat = os.stat(report)
+        except OSError:
+            continue
+
+        # Skip anything that hasn't changed since it was last indexed
+        if indexed.get(report) == (stat.st_mtime, stat.st_size):
+            continue
+
+        run_folder = get_run_folder(report)
+        con.execute('DELETE FROM seqid_index WHERE path = ?', (report,))
+        report_ids = read_report_ids(report, id_column, use_cache=use_cache)
+        con.executemany('INSERT INTO seqid_index (seqid, path, run_folder, row) VALUES (?, ?, ?, ?)',
+                        [(seqid, report, run_folder, row) for row, seqid in report_ids])
+        con.execute('INSERT OR REPLACE INTO indexed_files (path, run_folder, id_column, mtime, size) '
+                    'VALUES (?, ?, ?, ?, ?)', (report, run_folder, id_column, stat.st_mtime, stat.st_size))
+        updated += 1
+
+    # Drop reports that are no longer in the archive
+    if prune:
+        for report in set(indexed) - set(report_list):
+            remove_report(report, con)
+
+    con.commit()
+    return updated
+
+
+def remove_report(report_path, con):
+    """
+    Drops a report file from the index
+    :param report_path: Path to report file
+    :param con: Connection retrieved from connect_index()
+    """
+    con.execute('DELETE FROM seqid_index WHERE path = ?', (report_path,))
+    con.execute('DELETE FROM indexed_files WHERE path = ?', (report_path,))
+
+
+def lookup_reports(seq_list, id_column, con):
+    """
+    :param seq_list: List of OLC Seq IDs
+    :param id_column: Column used to specify primary key
+    :param con: Connection retrieved from connect_index()
+    :return: Dictionary containing report paths as keys and a dictionary of {Seq ID: row} for each requested Seq ID
+             held in that report as values
+    """
+    report_rows = {}
+    for seqid in seq_list:
+        hits = con.execute('SELECT seqid_index.path, seqid_index.row FROM seqid_index '
+                           'JOIN indexed_files ON seqid_index.path = indexed_files.path '
+                           'WHERE seqid_index.seqid = ? AND indexed_files.id_column = ? '
+                           'ORDER BY seqid_index.path', (seqid, id_column))
+        for path, row in hits:
+            report_rows.setdefault(path, {})[seqid] = row
+    return report_rows
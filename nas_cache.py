@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+import instrumentation
+
+
+"""
+Local read-through cache for COWBAT report files on the NAS.
+
+The first read of a report copies it into the cache directory. Later reads are served from the local copy as long as
+its size and mtime still match the file on the NAS. Each cache hit stamps the local copy's access time, which is used
+to evict the least recently used files once the cache grows past its size limit. The size of the cache is kept as a
+running total, so the cache directory is only walked when it is first used and when files have to be evicted.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Default cache location and size limit
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.autoroga', 'nas_cache')
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Eviction trims the cache to this fraction of its size limit, so that a full cache isn't walked on every miss
+EVICT_TARGET = 0.9
+
+# Report files copied for each run folder by prewarm()
+CACHED_REPORTS = ('combinedMetadata.csv', 'GDCS.csv')
+
+
+# Running total of the bytes held in each cache directory by this process' reckoning
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+def cache_location(path, cache_dir=CACHE_DIR):
+    """
+    :param path: Path to a file on the NAS
+    :param cache_dir: Cache directory
+    :return: Path the file is cached at. The full source path is mirrored under the cache directory.
+    """
+    return os.path.join(cache_dir, os.path.abspath(path).lstrip(os.sep))
+
+
+def cached_path(path, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    Returns a local copy of a NAS file, copying it into the cache first if it is missing or out of date
+    :param path: Path to a file on the NAS
+    :param cache_dir: Cache directory
+    :param max_bytes: Size the cache is trimmed to after a new file is added
+    :return: Path to the local copy
+    """
+    source_stat = os.stat(path)
+    local_path = cache_location(path, cache_dir)
+
+    # Size of the out of date copy being replaced, if any
+    replaced_size = 0
+    try:
+        local_stat = os.stat(local_path)
+        if local_stat.st_size == source_stat.st_size and int(local_stat.st_mtime) == int(source_stat.st_mtime):
+            # Cache hit. Record the access for LRU eviction, keeping the mtime used for validation.
+            os.utime(local_path, (time.time(), local_stat.st_mtime))
+            return local_path
+        replaced_size = local_stat.st_size
+    except FileNotFoundError:
+        pass
+
+    # Copy to a temporary file first so concurrent readers never see a partial copy
+    local_dir = os.path.dirname(local_path)
+    os.makedirs(local_dir, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=local_dir, prefix='.partial-')
+    os.close(handle)
+    try:
+        shutil.copyfile(path, temp_path)
+        instrumentation.count('nas_bytes_copied', source_stat.st_size)
+        os.utime(temp_path, (time.time(), source_stat.st_mtime))
+        os.replace(temp_path, local_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if add_cache_size(cache_dir, source_stat.st_size - replaced_size) > max_bytes:
+        evict(cache_dir=cache_dir, max_bytes=int(max_bytes * EVICT_TARGET), keep=local_path)
+    return local_path
+
+
+def add_cache_size(cache_dir, amount):
+    """
+    :param cache_dir: Cache directory
+    :param amount: Number of bytes added to the cache (negative if removed)
+    :return: Running total of bytes in the cache. The cache directory is walked to find its size the first time.
+    """
+    with _cache_sizes_lock:
+        if cache_dir not in _cache_sizes:
+            _cache_sizes[cache_dir] = sum(size for atime, path, size in list_cached_files(cache_dir))
+        else:
+            _cache_sizes[cache_dir] += amount
+        return _cache_sizes[cache_dir]
+
+
+def list_cached_files(cache_dir=CACHE_DIR):
+    """
+    :param cache_dir: Cache directory
+    :return: List of (access time, path, size) tuples for every file in the cache
+    """
+    cached_files = []
+    for root, dirs, files in os.walk(cache_dir):
+        for name in files:
+            if name.startswith('.partial-'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            cached_files.append((stat.st_atime, path, stat.st_size))
+    return cached_files
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, keep=None):
+    """
+    Deletes the least recently used files until the cache fits within max_bytes
+    :param cache_dir: Cache directory
+    :param max_bytes: Maximum total size of the cache
+    :param keep: Path that must not be evicted, i.e. the file that was just cached
+    :return: Number of files removed
+    """
+    cached_files = list_cached_files(cache_dir)
+    total_size = sum(size for atime, path, size in cached_files)
+
+    removed = 0
+    for atime, path, size in sorted(cached_files):
+        if total_size <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed += 1
+
+    # Resynchronise the running total, which may have drifted if other processes share the cache
+    with _cache_sizes_lock:
+        _cache_sizes[cache_dir] = total_size
+    return removed
+
+
+def prewarm(run_folders, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """
+    Copies the report files of each run folder into the cache ahead of time
+    :param run_folders: List of paths to run folders, i.e. /mnt/nas/WGSspades/<run>
+    :param cache_dir: Cache directory
+    :param max_bytes: Maximum total size of the cache
+    :return: List of local paths that were cached
+    """
+    cached = []
+    for run_folder in run_folders:
+        for report_name in CACHED_REPORTS:
+            report = os.path.join(run_folder, 'reports', report_name)
+            if not os.path.isfile(report):
+                logger.warning('{} not found, skipping.'.format(report))
+                continue
+            cached.append(cached_path(report, cache_dir=cache_dir, max_bytes=max_bytes))
+    return cached
+
+
+if __name__ == '__main__':
+    # Usage: python nas_cache.py /mnt/nas/WGSspades/<run> [/mnt/nas/WGSspades/<run> ...]
+    instrumentation.configure_logging()
+    for cached_report in prewarm(sys.argv[1:]):
+        print(cached_report)
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+
+"""
+Content-addressed cache of generated ROGA PDFs.
+
+Reports are keyed by a hash of everything that determines their content apart from the report ID and issue date: the
+normalised sample records, genus, lab, source, the report template version and the rendering backend. Regenerating a
+report with the same inputs (i.e. an accidental double submission) returns the PDF that was already issued instead of
+allocating a new report ID and compiling it again.
+"""
+
+
+# Default cache location and retention policy
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.autoroga', 'pdf_cache')
+MAX_AGE_DAYS = 30
+MAX_ENTRIES = 500
+
+
+def get_report_key(metadata_reports, genus, lab, source, template_version, backend='latex'):
+    """
+    :param metadata_reports: Dictionary of SampleRecord objects for the Seq IDs in the report
+    :param genus: Expected Genus for samples
+    :param lab: ID for lab report is being generated for
+    :param source: string input for source that strains were derived from
+    :param template_version: Version of the report layout
+    :param backend: Rendering backend the PDF is produced with
+    :return: Hex digest identifying the report content
+    """
+    # Sort so the key doesn't depend on the order the Seq IDs were requested in
+    samples = [metadata_reports[seqid].to_dict() for seqid in sorted(metadata_reports)]
+    content = {'samples': samples,
+               'genus': genus,
+               'lab': lab,
+               'source': source.strip(),
+               'template_version': template_version,
+               'backend': backend}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def lookup(key, cache_dir=CACHE_DIR, max_age_days=MAX_AGE_DAYS):
+    """
+    :param key: Key retrieved from get_report_key()
+    :param cache_dir: Cache directory
+    :param max_age_days: Entries older than this are treated as missing
+    :return: Tuple of (path to cached PDF, metadata dictionary) or None if there is no usable entry
+    """
+    pdf_path = os.path.join(cache_dir, key + '.pdf')
+    metadata_path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not os.path.isfile(pdf_path) or time.time() - metadata.get('created', 0) > max_age_days * 86400:
+        return None
+    return pdf_path, metadata
+
+
+def store(key, pdf_path, report_id, date, cache_dir=CACHE_DIR, max_age_days=MAX_AGE_DAYS, max_entries=MAX_ENTRIES):
+    """
+    Adds a generated PDF to the cache
+    :param key: Key retrieved from get_report_key()
+    :param pdf_path: Path to the generated PDF
+    :param report_id: Report ID the PDF was issued under
+    :param date: Date the PDF was issued
+    :param cache_dir: Cache directory
+    :param max_age_days: Entries older than this are evicted
+    :param max_entries: Maximum number of entries kept
+    :return: Path to the cached PDF
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_pdf = os.path.join(cache_dir, key + '.pdf')
+
+    # Write to temporary files first so a reader never sees a half-written entry. Each writer gets its own temporary
+    # file, so identical reports being stored at the same time don't write over each other's.
+    replace_file(cached_pdf, lambda temp_path: shutil.copyfile(pdf_path, temp_path), cache_dir)
+    metadata = {'report_id': report_id,
+                'date': date,
+                'filename': os.path.basename(pdf_path),
+                'created': time.time()}
+
+    def write_metadata(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(metadata, f)
+    replace_file(os.path.join(cache_dir, key + '.json'), write_metadata, cache_dir)
+
+    evict(cache_dir=cache_dir, max_age_days=max_age_days, max_entries=max_entries)
+    return cached_pdf
+
+
+def replace_file(path, write, cache_dir=CACHE_DIR):
+    """
+    :param path: Path to the file to replace
+    :param write: Function taking a temporary path in cache_dir and writing the new file to it
+    :param cache_dir: Cache directory
+    """
+    handle, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.partial-')
+    os.close(handle)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def restore(key, output_dir='.', cache_dir=CACHE_DIR, max_age_days=MAX_AGE_DAYS):
+    """
+    Copies a cached PDF back out under the filename it was originally issued with
+    :param key: Key retrieved from get_report_key()
+    :param output_dir: Directory to copy the report to
+    :param cache_dir: Cache directory
+    :param max_age_days: Entries older than this are treated as missing
+    :return: Tuple of (path to the restored PDF, metadata dictionary) or None if there is no usable entry
+    """
+    entry = lookup(key, cache_dir=cache_dir, max_age_days=max_age_days)
+    if entry is None:
+        return None
+    cached_pdf, metadata = entry
+    pdf_path = os.path.join(output_dir, metadata['filename'])
+    if not os.path.isfile(pdf_path):
+        shutil.copyfile(cached_pdf, pdf_path)
+    return pdf_path, metadata
+
+
+def evict(cache_dir=CACHE_DIR, max_age_days=MAX_AGE_DAYS, max_entries=MAX_ENTRIES):
+    """
+    Removes expired entries, then the oldest entries until at most max_entries remain
+    :param cache_dir: Cache directory
+    :param max_age_days: Entries older than this are evicted
+    :param max_entries: Maximum number of entries kept
+    :return: Number of entries removed
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            try:
+                entries.append((os.path.getmtime(os.path.join(cache_dir, name)), name[:-len('.json')]))
+            except OSError:
+                continue
+    entries.sort(reverse=True)
+
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for position, (created, key) in enumerate(entries):
+        if position < max_entries and created >= cutoff:
+            continue
+        for extension in ('.json', '.pdf'):
+            try:
+                os.remove(os.path.join(cache_dir, key + extension))
+            except OSError:
+                pass
+        removed += 1
+    return removed
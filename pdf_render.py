@@ -0,0 +1,135 @@
+import os
+from xml.sax.saxutils import escape
+
+
+"""
+Direct PDF rendering backend built on ReportLab.
+
+Lays out the same report model as the LaTeX backend (header with logo and date, lab table, identification summary,
+GeneSeekr table, sequence quality metrics, pipeline metadata and the "Verified by" form field) straight to PDF in
+Python, without TeX. ReportLab is only imported when this backend is used, so LaTeX-only installs don't need it.
+"""
+
+
+# Page setup, matching the LaTeX backend's geometry options
+TOP_MARGIN_CM = 2.0
+SIDE_MARGIN_CM = 1.8
+HEADSEP_CM = 1.0
+
+# Width of the CFIA logo in the header, in points (PyLaTeX's width=110px at pdflatex's 1px = 1bp)
+LOGO_WIDTH = 110
+
+FOOTER_LINES = ('Data interpretation guidelines can be found in RDIMS document ID: 10401305',
+                'This report was generated with OLC AutoROGA v0.0.1')
+
+
+def render_pdf(model, pdf_path, image_filename=None):
+    """
+    Writes a report model straight to a PDF file
+    :param model: Dictionary retrieved from report_model.build_report_model()
+    :param pdf_path: Path to write the PDF to
+    :param image_filename: Path to the logo shown in the header. Defaults to the CFIA logo.
+    :return: pdf_path
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm, inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Flowable
+
+    if image_filename is None:
+        image_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CFIA_logo.png')
+
+    styles = getSampleStyleSheet()
+    body = styles['BodyText']
+    cell = styles['BodyText'].clone('RogaCell', alignment=1, fontSize=9, leading=11)
+    caption = styles['BodyText'].clone('RogaCaption', fontSize=8, leading=10)
+
+    class VerifiedByField(Flowable):
+        """Single line AcroForm text field, matching hyperref's TextField in the LaTeX backend"""
+
+        width = 2.5 * inch
+        height = 0.3 * inch
+
+        def draw(self):
+            self.canv.acroForm.textfield(name='multilinetextbox', x=0, y=0, width=self.width, height=self.height,
+                                         borderColor=colors.black, fillColor=colors.white, borderWidth=1,
+                                         relative=True)
+
+    def header_footer(canvas, document):
+        canvas.saveState()
+        page_width, page_height = letter
+        left = SIDE_MARGIN_CM * cm
+        right = page_width - SIDE_MARGIN_CM * cm
+        rule_y = page_height - TOP_MARGIN_CM * cm
+
+        # Logo on the left, issue date on the right, then a thin rule
+        canvas.drawImage(image_filename, left, rule_y + 3, width=LOGO_WIDTH, preserveAspectRatio=True,
+                         anchor='sw', mask='auto', height=LOGO_WIDTH)
+        canvas.setFont('Helvetica', 10)
+        canvas.drawRightString(right, rule_y + 3, 'Date Report Issued: ' + model['date'])
+        canvas.setLineWidth(0.1)
+        canvas.line(left, rule_y, right, rule_y)
+
+        # Centred footer legend
+        canvas.setFont('Helvetica-Bold', 9)
+        for line_number, text in enumerate(FOOTER_LINES):
+            canvas.drawCentredString(page_width / 2.0, 1.6 * cm - line_number * 11, text)
+        canvas.restoreState()
+
+    def segments_markup(segments):
+        return ''.join('<i>{}</i>'.format(escape(text)) if is_italic else escape(text) for text, is_italic in segments)
+
+    def table_flowables(table_model):
+        header = []
+        for name, superscript in table_model['columns']:
+            markup = '<b>{}</b>'.format(escape(name))
+            if superscript:
+                markup += '<super><font size="6">{}</font></super>'.format(escape(superscript))
+            header.append(Paragraph(markup, cell))
+        rows = [[Paragraph(escape(str(value)), cell) for value in row] for row in table_model['rows']]
+
+        table = Table([header] + rows, repeatRows=1)
+        table.setStyle(TableStyle([('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                                   ('VALIGN', (0, 0), (-1, -1), 'MIDDLE')]))
+        flowables = [Paragraph(escape(table_model['title']), styles['Heading3']), table]
+        if table_model['caption'] is not None:
+            superscript, text = table_model['caption']
+            flowables.append(Paragraph('<b><super>{}</super></b><i>{}</i>'.format(escape(superscript), escape(text)),
+                                       caption))
+        return flowables
+
+    story = [Paragraph('Report of Genomic Analysis: ' + escape(model['genus']), styles['Heading2']),
+             Paragraph('<b>Report ID: </b>' + escape(str(model['report_id'])), body),
+             Paragraph('<b>Reporting laboratory: </b>' + escape(model['lab']), body),
+             Spacer(1, 6)]
+
+    # Lab summary, ruled above and below like booktabs
+    lab_table = Table([[Paragraph('<b>Laboratory</b>', body), Paragraph('<b>Address</b>', body),
+                        Paragraph('<b>Tel #</b>', body)],
+                       [escape(model['lab']), escape(model['lab_address']), escape(model['lab_phone'])]],
+                      hAlign='LEFT')
+    lab_table.setStyle(TableStyle([('LINEABOVE', (0, 0), (-1, 0), 1, colors.black),
+                                   ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.black),
+                                   ('LINEBELOW', (0, -1), (-1, -1), 1, colors.black),
+                                   ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+                                   ('ALIGN', (2, 0), (2, -1), 'RIGHT')]))
+    story.append(lab_table)
+
+    story += [Paragraph('Identification Summary', styles['Heading3']),
+              Paragraph(segments_markup(model['summary']), body)]
+
+    for table_model in (model['genesippr_table'], model['quality_table'], model['pipeline_table']):
+        if table_model is not None:
+            story += table_flowables(table_model)
+
+    story += [Paragraph('Verified by:', styles['Heading4']), VerifiedByField()]
+
+    document = SimpleDocTemplate(pdf_path,
+                                 pagesize=letter,
+                                 topMargin=(TOP_MARGIN_CM + HEADSEP_CM) * cm,
+                                 leftMargin=SIDE_MARGIN_CM * cm,
+                                 rightMargin=SIDE_MARGIN_CM * cm,
+                                 title='Report of Genomic Analysis: {}'.format(model['genus']))
+    document.build(story, onFirstPage=header_footer, onLaterPages=header_footer)
+    return pdf_path
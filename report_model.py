@@ -0,0 +1,183 @@
+from datetime import datetime
+
+import extract_report_data
+import instrumentation
+from genus_specs import genus_specs, table_extractors, remove_bracketed_values
+
+
+"""
+Plain-data model of a ROGA.
+
+Everything a report shows (summary text, table rows and validation results) is computed here once from the sample
+records, so each rendering backend only has to lay the model out. Tables are dictionaries with a title, a list of
+(column name, footnote superscript or None) tuples, a list of rows of strings and an optional (superscript, text)
+caption. The summary is a list of (text, italic) segments.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# TODO: Finish populating this dictionary
+lab_info = {
+    'GTA-CFIA': ('2301 Midland Ave., Scarborough, ON, M1P 4R7', '(416) 973-0798'),
+    'BUR-CFIA': ('3155 Willington Green, Burnaby, BC, V5G 4P2', '(604) 292-6028'),
+    'DAR-CFIA': ('1992 Agency Dr., Dartmouth, NS, B2Y 3Z7', '(902) 536-1046'),
+    'OLC-CFIA': ('960 Carling Ave, Ottawa, ON, K1A 0Y9', '(613) 759-1220'),
+    'OLF-CFIA': ('3851 Fallowfield Rd., Ottawa, ON, K2H 8P9', '(343) 212-0416')
+}
+
+# Genera a ROGA can be generated for
+supported_genera = list(genus_specs)
+
+# Bump whenever the report layout changes so previously cached PDFs are not reused
+template_version = 2
+
+MARKER_CAPTION = ('a', "+ indicates marker presence : - indicates marker was not detected")
+
+
+def build_report_model(metadata_reports, genus, lab, source, report_id=None, date=None):
+    """
+    :param metadata_reports: Dictionary of SampleRecord objects for the Seq IDs in the report
+    :param genus: Expected Genus for samples (Salmonella, Listeria, or Escherichia)
+    :param lab: ID for lab report is being generated for
+    :param source: string input for source that strains were derived from, i.e. 'ground beef'
+    :param report_id: Report ID retrieved from update_db(), or None if one hasn't been allocated
+    :param date: Date string the report is issued. Defaults to today.
+    :return: Dictionary describing the report
+    """
+    if date is None:
+        date = datetime.today().strftime('%Y-%m-%d')
+
+    validation = validate_report_samples(seq_list=list(metadata_reports), genus=genus,
+                                         metadata_reports=metadata_reports)
+
+    return {'report_id': report_id,
+            'date': date,
+            'genus': genus,
+            'lab': lab,
+            'lab_address': lab_info[lab][0],
+            'lab_phone': lab_info[lab][1],
+            'source': source,
+            'seq_list': list(metadata_reports),
+            'validation': validation,
+            'summary': build_summary(genus=genus, source=source, sample_count=len(metadata_reports),
+                                     validation=validation),
+            'genesippr_table': build_genesippr_table(genus=genus, metadata_reports=metadata_reports),
+            'quality_table': build_quality_table(metadata_reports),
+            'pipeline_table': build_pipeline_table(metadata_reports)}
+
+
+def validate_report_samples(seq_list, genus, metadata_reports):
+    """
+    Second validation screen: the checks listed in the genus spec, i.e. uidA/vt markers for Escherichia and the MASH
+    reference genome for Listeria and Salmonella
+    :param seq_list: List of OLC Seq IDs
+    :param genus: Expected Genus for samples
+    :param metadata_reports: Dictionary of SampleRecord objects
+    :return: Dictionary of per-sample results and whether every sample passed
+    """
+    validation = {}
+    spec = genus_specs.get(genus)
+    if spec is None:
+        return validation
+
+    # Every flag for every sample is computed in one pass over the sample records
+    logger.info('Validating {} samples'.format(len(seq_list)))
+    flags = extract_report_data.validate_samples(seq_list=seq_list, genus=genus, metadata_reports=metadata_reports)
+    checked = list(flags['genus'])
+    if spec['checked_samples'] == 'observed_genus':
+        checked = [seqid for seqid in checked if flags['genus'][seqid]]
+
+    for check in spec['checks']:
+        validation[check] = {seqid: flags[check][seqid] for seqid in checked}
+    for key in checked:
+        for check in spec['checks']:
+            if check in spec['warnings'] and not validation[check][key]:
+                logger.warning(spec['warnings'][check].format(key))
+    for check in spec['checks']:
+        validation['all_' + check] = False not in validation[check].values()
+
+    return validation
+
+
+def build_summary(genus, source, sample_count, validation):
+    """
+    :param genus: Expected Genus for samples
+    :param source: string input for source that strains were derived from
+    :param sample_count: Number of samples in the report
+    :param validation: Dictionary retrieved from validate_report_samples()
+    :return: List of (text, italic) segments
+    """
+    summary = [('Whole-genome sequencing analysis was conducted on {} presumptive '.format(sample_count), False),
+               ('{} '.format(genus), True)]
+
+    if sample_count == 1:
+        summary.append(('strain isolated from {}. '.format(source), False))
+    else:
+        summary.append(('strains isolated from {}. '.format(source), False))
+
+    spec = genus_specs.get(genus)
+    if spec is not None:
+        for check, passed, failed in spec['summary']:
+            segments = passed if validation['all_' + check] else failed
+            summary += [(text.format(species=spec['species']), italic) for text, italic in segments]
+
+    return summary
+
+
+def build_genesippr_table(genus, metadata_reports):
+    """
+    :param genus: Expected Genus for samples
+    :param metadata_reports: Dictionary of SampleRecord objects
+    :return: Table dictionary, or None for an unsupported genus
+    """
+    spec = genus_specs.get(genus)
+    if spec is None:
+        return None
+
+    columns = [(name, superscript) for name, superscript, source, transforms in spec['table']]
+    rows = table_extractors[genus](list(metadata_reports.values()))
+    return {'title': 'GeneSeekr Analysis', 'columns': columns, 'rows': rows, 'caption': MARKER_CAPTION}
+
+
+def build_quality_table(metadata_reports):
+    """
+    :param metadata_reports: Dictionary of SampleRecord objects with GDCS results joined on
+    :return: Table dictionary
+    """
+    columns = [('LSTS ID', None), ('Total Length', None), ('Coverage', None), ('GDCS', None), ('Pass/Fail', None)]
+
+    # GDCS data was joined onto the combinedMetadata rows at load time
+    gdcs_dict = extract_report_data.generate_gdcs_dict(metadata_reports)
+
+    rows = []
+    for sample_id, record in metadata_reports.items():
+        total_length = str(record.total_length) if record.total_length is not None else ''
+        average_coverage_depth = ''
+        if record.average_coverage_depth is not None:
+            average_coverage_depth = format(record.average_coverage_depth, '.0f') + 'X'
+
+        matches, passfail = gdcs_dict[sample_id]
+        if passfail == '+':
+            passfail = 'Pass'
+        elif passfail == '-':
+            passfail = 'Fail'
+
+        rows.append([record.sample_name, total_length, average_coverage_depth, matches, passfail])
+
+    return {'title': 'Sequence Quality Metrics', 'columns': columns, 'rows': rows, 'caption': None}
+
+
+def build_pipeline_table(metadata_reports):
+    """
+    :param metadata_reports: Dictionary of SampleRecord objects
+    :return: Table dictionary
+    """
+    columns = [('LSTS ID', None), ('Seq ID', None), ('Pipeline Version', None), ('Database Version', None)]
+
+    rows = []
+    for sample_id, record in metadata_reports.items():
+        database_version = record.pipeline_version  # These have been harmonized
+        rows.append([record.sample_name, sample_id, record.pipeline_version, database_version])
+
+    return {'title': 'Pipeline Metadata', 'columns': columns, 'rows': rows, 'caption': None}
@@ -0,0 +1,167 @@
+import sys
+import json
+import click
+from html import escape
+
+import extract_report_data
+import instrumentation
+import report_model
+from genus_specs import genus_specs, describe_failed_check
+
+
+"""
+Fast previews of a ROGA.
+
+Builds the same report model as generate_roga, but never allocates a report ID from the database and never invokes
+LaTeX. The model is written out as JSON or as a lightweight HTML page so reviewers can check the sample list, the
+validation flags and the table contents before a report is issued.
+"""
+
+
+PREVIEW_FORMATS = ['html', 'json']
+
+
+def build_preview_model(seq_list, genus, lab, source, metadata_reports=None):
+    """
+    :param seq_list: List of OLC Seq IDs
+    :param genus: Expected Genus for samples (Salmonella, Listeria, or Escherichia)
+    :param lab: ID for lab report is being generated for
+    :param source: string input for source that strains were derived from, i.e. 'ground beef'
+    :param metadata_reports: Dictionary retrieved from extract_report_data.load_sample_data(). Loaded from the archive
+                             if not provided.
+    :return: Report model dictionary without a report ID. Seq IDs left out of the report are listed under 'excluded'
+             with the reason they were dropped.
+    """
+    if metadata_reports is None:
+        metadata_reports = extract_report_data.load_sample_data(seq_list)
+
+    excluded = {}
+    found_list = []
+    for seqid in seq_list:
+        if seqid in metadata_reports:
+            found_list.append(seqid)
+        else:
+            excluded[seqid] = 'Not found in the archive'
+
+    # Same genus screen redmine_roga applies before a report is generated
+    genus_status = extract_report_data.validate_genus(seq_list=found_list, genus=genus,
+                                                      metadata_reports=metadata_reports)
+    validated_list = []
+    for seqid in found_list:
+        if genus_status[seqid]:
+            validated_list.append(seqid)
+        else:
+            excluded[seqid] = 'Observed genus {} does not match the expected genus of {}'.format(
+                metadata_reports[seqid].genus, genus)
+
+    model = report_model.build_report_model(metadata_reports={seqid: metadata_reports[seqid]
+                                                              for seqid in validated_list},
+                                            genus=genus,
+                                            lab=lab,
+                                            source=source,
+                                            report_id=None)
+    model['excluded'] = excluded
+    return model
+
+
+def model_to_json(model):
+    """
+    :param model: Report model dictionary
+    :return: JSON string
+    """
+    return json.dumps(model, indent=2)
+
+
+def model_to_html(model):
+    """
+    :param model: Report model dictionary
+    :return: Self-contained HTML page
+    """
+    def table_html(table_model):
+        header = ''
+        for name, superscript in table_model['columns']:
+            header += '<th>{}{}</th>'.format(escape(name), '<sup>{}</sup>'.format(escape(superscript))
+                                             if superscript else '')
+        rows = ''.join('<tr>{}</tr>'.format(''.join('<td>{}</td>'.format(escape(str(value))) for value in row))
+                       for row in table_model['rows'])
+        html = '<h3>{}</h3><table><tr>{}</tr>{}</table>'.format(escape(table_model['title']), header, rows)
+        if table_model['caption'] is not None:
+            superscript, text = table_model['caption']
+            html += '<p class="caption"><sup>{}</sup><i>{}</i></p>'.format(escape(superscript), escape(text))
+        return html
+
+    summary = ''.join('<i>{}</i>'.format(escape(text)) if is_italic else escape(text)
+                      for text, is_italic in model['summary'])
+
+    # Flag every sample that failed a validation check
+    warnings = ['{}: {}'.format(seqid, reason) for seqid, reason in model.get('excluded', {}).items()]
+    spec = genus_specs.get(model['genus'])
+    for check in spec['checks'] if spec is not None else ():
+        for seqid, passed in model['validation'].get(check, {}).items():
+            if not passed:
+                warnings.append('{}: {}.'.format(seqid, describe_failed_check(check, spec)))
+
+    body = ['<p class="banner">PREVIEW: no report ID has been allocated</p>',
+            '<h2>Report of Genomic Analysis: {}</h2>'.format(escape(model['genus'])),
+            '<p><b>Report ID:</b> {}<br><b>Reporting laboratory:</b> {}<br><b>Date:</b> {}</p>'.format(
+                escape(str(model['report_id'] or 'not allocated')), escape(model['lab']), escape(model['date'])),
+            '<table class="lab"><tr><th>Laboratory</th><th>Address</th><th>Tel #</th></tr>'
+            '<tr><td>{}</td><td>{}</td><td>{}</td></tr></table>'.format(escape(model['lab']),
+                                                                       escape(model['lab_address']),
+                                                                       escape(model['lab_phone']))]
+    if warnings:
+        body.append('<ul class="warnings">{}</ul>'.format(''.join('<li>{}</li>'.format(escape(warning))
+                                                                  for warning in warnings)))
+    body.append('<h3>Identification Summary</h3><p>{}</p>'.format(summary))
+    for table_model in (model['genesippr_table'], model['quality_table'], model['pipeline_table']):
+        if table_model is not None:
+            body.append(table_html(table_model))
+
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>ROGA preview: {}</title><style>'
+            'body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse}}'
+            'td,th{{border:1px solid #000;padding:2px 8px;text-align:center}}.lab td,.lab th{{border:none}}'
+            '.banner{{background:#fd0;padding:4px}}.warnings{{color:#b00}}.caption{{font-size:small}}'
+            '</style></head><body>\n{}\n</body></html>\n').format(escape(model['genus']), '\n'.join(body))
+
+
+def preview_roga(seq_list, genus, lab, source, output_format='html', metadata_reports=None):
+    """
+    :param seq_list: List of OLC Seq IDs
+    :param genus: Expected Genus for samples (Salmonella, Listeria, or Escherichia)
+    :param lab: ID for lab report is being generated for
+    :param source: string input for source that strains were derived from, i.e. 'ground beef'
+    :param output_format: 'html' or 'json'
+    :param metadata_reports: Dictionary retrieved from extract_report_data.load_sample_data(). Loaded from the archive
+                             if not provided.
+    :return: Preview as a string
+    """
+    model = build_preview_model(seq_list=seq_list, genus=genus, lab=lab, source=source,
+                                metadata_reports=metadata_reports)
+    if output_format == 'json':
+        return model_to_json(model)
+    return model_to_html(model)
+
+
+@click.command()
+@click.argument('seq_ids', nargs=-1, required=True)
+@click.option('--genus', required=True, type=click.Choice(report_model.supported_genera))
+@click.option('--lab', required=True, type=click.Choice(sorted(report_model.lab_info)))
+@click.option('--source', required=True, help="Source the strains were isolated from, i.e. 'ground beef'")
+@click.option('--format', 'output_format', default='html', show_default=True, type=click.Choice(PREVIEW_FORMATS))
+@click.option('--output', default='-', show_default=True, help="File to write the preview to, or '-' for stdout")
+def preview(seq_ids, genus, lab, source, output_format, output):
+    """
+    Previews the ROGA for SEQ_IDS without allocating a report ID or compiling a PDF
+    """
+    # Validation messages are logged to stderr, so they never end up in a preview written to stdout
+    instrumentation.configure_logging()
+    text = preview_roga(seq_list=list(seq_ids), genus=genus, lab=lab, source=source, output_format=output_format)
+    if output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    preview()
@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import uuid
+import queue
+import click
+import shutil
+import asyncio
+import itertools
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import batch_roga
+import database
+import extract_report_data
+import instrumentation
+from generate_roga import render_backends
+
+
+"""
+Resident ROGA service.
+
+Keeps the imports, the SeqID index, the database connection pool and the precompiled LaTeX formats warm between
+reports, and accepts ROGA jobs over a local HTTP API (TCP or a Unix socket). Jobs are queued by priority and run on a
+bounded number of worker threads, each through batch_roga.run_batch().
+
+    POST /jobs                    {"seq_list": [...], "genus": ..., "lab": ..., "source": ..., "priority": 0,
+                                   "backend": "latex", "redmine_issue": null}
+    GET  /jobs                    Status of every job
+    GET  /jobs/<job_id>           Status of a job
+    GET  /jobs/<job_id>/pdf       The finished PDF
+    GET  /redmine/issues/<id>     Updates the Redmine stub recorded for an issue
+    GET  /metrics                 Stage timings and counters in the Prometheus text format
+
+Jobs with a higher priority run first; jobs with the same priority run in the order they were submitted. When a job
+names a redmine_issue, the finished report is posted to the Redmine stub, which stands in for the Redmine integration
+until it is ported. Finished jobs and their output folders are dropped after RETENTION_HOURS, or sooner once more than
+MAX_FINISHED_JOBS jobs have finished.
+"""
+
+
+logger = instrumentation.get_logger(__name__)
+
+# Default address the service listens on
+HOST = '127.0.0.1'
+PORT = 8765
+
+# Default number of jobs run at once
+SERVICE_WORKERS = 2
+
+# Default directory finished reports are written to, one folder per job
+OUTPUT_DIR = os.path.join(os.path.expanduser('~'), '.autoroga', 'service')
+
+# Finished jobs, and their output folders, are dropped once they are older than this
+RETENTION_HOURS = 72
+
+# Most finished jobs kept at once; the oldest are dropped beyond this
+MAX_FINISHED_JOBS = 1000
+
+
+class RedmineStub(object):
+    """
+    Stands in for Redmine by recording the notes and attachments that would be posted to each issue
+    """
+
+    def __init__(self):
+        self.issues = {}
+        self.lock = threading.Lock()
+
+    def post_update(self, issue_id, notes, attachment=None):
+        """
+        :param issue_id: Redmine issue number
+        :param notes: Text of the note added to the issue
+        :param attachment: Path to a file attached to the issue, or None
+        """
+        with self.lock:
+            self.issues.setdefault(str(issue_id), []).append({'notes': notes,
+                                                              'attachment': attachment,
+                                                              'time': time.time()})
+
+    def get_updates(self, issue_id):
+        """
+        :param issue_id: Redmine issue number
+        :return: List of updates posted to the issue
+        """
+        with self.lock:
+            return list(self.issues.get(str(issue_id), []))
+
+
+class RogaService(object):
+    """
+    Priority queue of ROGA jobs and the worker threads that run them
+    """
+
+    def __init__(self, workers=SERVICE_WORKERS, output_dir=OUTPUT_DIR, use_format=True, use_cache=True,
+                 use_async=False, retention_hours=RETENTION_HOURS, max_finished_jobs=MAX_FINISHED_JOBS):
+        """
+        :param workers: Number of jobs run at once
+        :param output_dir: Directory finished reports are written to
+        :param use_format: Compile against cached precompiled formats of the shared preamble
+        :param use_cache: Reuse previously issued PDFs for reports with identical content
+        :param use_async: Run each job through batch_roga.run_batch_async() rather than run_batch()
+        :param retention_hours: Hours finished jobs and their output folders are kept for
+        :param max_finished_jobs: Most finished jobs kept at once
+        """
+        self.output_dir = output_dir
+        self.retention_hours = retention_hours
+        self.max_finished_jobs = max_finished_jobs
+        self.use_format = use_format
+        self.use_cache = use_cache
+        self.use_async = use_async
+        self.redmine = RedmineStub()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.PriorityQueue()
+        # Breaks ties between jobs with the same priority in submission order
+        self.counter = itertools.count()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for worker in range(max(1, workers))]
+
+    def start(self):
+        """
+        Warms the database pool and SeqID index, then starts the worker threads
+        """
+        try:
+            database.get_engine()
+        except Exception as e:
+            logger.warning('Could not connect to the database: {}'.format(e))
+        extract_report_data.find_report_rows(report_name='combinedMetadata.csv', seq_list=[], id_column='SeqID')
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, request):
+        """
+        :param request: Dictionary with the same fields as generate_roga(), plus optional priority, backend and
+                        redmine_issue
+        :return: Job dictionary
+        """
+        spec = {'seq_list': batch_roga.parse_seq_list(request.get('seq_list')),
+                'genus': str(request.get('genus') or '').strip(),
+                'lab': str(request.get('lab') or '').strip(),
+                'source': str(request.get('source') or '').strip()}
+        error = batch_roga.check_spec(spec)
+        if error is None and request.get('backend', 'latex') not in render_backends:
+            error = 'Unknown rendering backend "{}"'.format(request.get('backend'))
+        if error is not None:
+            raise ValueError(error)
+        priority = request.get('priority', 0)
+        # JSON true/false arrive as bools, which are ints to Python
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError('Priority must be an integer, not {}'.format(json.dumps(priority)))
+
+        job = {'job_id': uuid.uuid4().hex[:12],
+               'status': 'queued',
+               'spec': spec,
+               'priority': priority,
+               'backend': request.get('backend', 'latex'),
+               'redmine_issue': request.get('redmine_issue'),
+               'submitted': time.time(),
+               'started': None,
+               'finished': None,
+               'report_id': None,
+               'cached': False,
+               'pdf': None,
+               'error': None}
+        self.expire_jobs()
+        with self.lock:
+            self.jobs[job['job_id']] = job
+        self.queue.put((-job['priority'], next(self.counter), job['job_id']))
+        return self.get_job(job['job_id'])
+
+    def get_job(self, job_id):
+        """
+        :param job_id: ID retrieved from submit()
+        :return: Copy of the job dictionary, or None if there is no such job
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self):
+        """
+        :return: List of every job dictionary, oldest first
+        """
+        with self.lock:
+            return sorted((dict(job) for job in self.jobs.values()), key=lambda job: job['submitted'])
+
+    def work(self):
+        """
+        Worker thread: runs queued jobs one at a time, highest priority first
+        """
+        while True:
+            priority, order, job_id = self.queue.get()
+            with self.lock:
+                job = self.jobs[job_id]
+                job.update(status='running', started=time.time())
+            try:
+                batch_options = {'workers': 1,
+                                 'output_dir': os.path.join(self.output_dir, job_id),
+                                 'use_format': self.use_format,
+                                 'use_cache': self.use_cache,
+                                 'backend': job['backend']}
+                if self.use_async:
+                    results, timings = asyncio.run(batch_roga.run_batch_async([job['spec']], **batch_options))
+                else:
+                    results, timings = batch_roga.run_batch([job['spec']], **batch_options)
+                result = results[0]
+                update = {'status': 'done' if result['status'] == 'ok' else 'failed',
+                          'report_id': result['report_id'],
+                          'cached': result['cached'],
+                          'pdf': result['pdf'],
+                          'error': result['error']}
+            except Exception as e:
+                update = {'status': 'failed', 'error': str(e)}
+
+            with self.lock:
+                job.update(update, finished=time.time())
+            if job['redmine_issue'] is not None:
+                self.post_to_redmine(job)
+            self.expire_jobs()
+            self.queue.task_done()
+
+    def expire_jobs(self):
+        """
+        Drops finished jobs older than retention_hours, and the oldest finished jobs beyond max_finished_jobs, along
+        with their output folders
+        :return: Number of jobs dropped
+        """
+        cutoff = time.time() - self.retention_hours * 3600
+        with self.lock:
+            finished = sorted((job for job in self.jobs.values() if job['finished'] is not None),
+                              key=lambda job: job['finished'], reverse=True)
+            expired = [job for position, job in enumerate(finished)
+                       if position >= self.max_finished_jobs or job['finished'] < cutoff]
+            for job in expired:
+                del self.jobs[job['job_id']]
+
+        for job in expired:
+            shutil.rmtree(os.path.join(self.output_dir, job['job_id']), ignore_errors=True)
+        if expired:
+            logger.info('Dropped {} finished jobs'.format(len(expired)))
+        return len(expired)
+
+    def post_to_redmine(self, job):
+        """
+        :param job: Finished job dictionary
+        """
+        if job['status'] == 'done':
+            self.redmine.post_update(job['redmine_issue'], 'Generated ROGA {}'.format(job['report_id']),
+                                     attachment=job['pdf'])
+        else:
+            self.redmine.post_update(job['redmine_issue'], 'Could not generate ROGA: {}'.format(job['error']))
+
+
+class RogaRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end for a RogaService, which is set as the server's service attribute
+    """
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return self.client_address[0]
+        return 'local'
+
+    def send_json(self, status, content):
+        body = json.dumps(content, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+
+        if parts == ['jobs']:
+            self.send_json(200, service.list_jobs())
+        elif parts == ['metrics']:
+            body = instrumentation.format_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = service.get_job(parts[1])
+            if job is None:
+                self.send_json(404, {'error': 'No such job'})
+            elif len(parts) == 2:
+                self.send_json(200, job)
+            elif parts[2] != 'pdf':
+                self.send_json(404, {'error': 'Not found'})
+            elif job['status'] != 'done' or not job['pdf'] or not os.path.isfile(job['pdf']):
+                self.send_json(409, {'error': 'Job is {}'.format(job['status'])})
+            else:
+                with open(job['pdf'], 'rb') as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/pdf')
+                self.send_header('Content-Disposition',
+                                 'attachment; filename="{}"'.format(os.path.basename(job['pdf'])))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        elif len(parts) == 3 and parts[:2] == ['redmine', 'issues']:
+            self.send_json(200, service.redmine.get_updates(parts[2]))
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path.split('?')[0].rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('Expected a JSON object')
+            job = service.submit(request)
+        except (TypeError, ValueError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(202, job)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service, host=HOST, port=PORT, socket_path=None):
+    """
+    Runs the HTTP API until interrupted
+    :param service: Started RogaService
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :param socket_path: Listen on this Unix socket instead of TCP
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, RogaRequestHandler)
+        logger.info('Listening on {}'.format(socket_path))
+    else:
+        server = ThreadingHTTPServer((host, port), RogaRequestHandler)
+        logger.info('Listening on http://{}:{}'.format(host, port))
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+@click.command()
+@click.option('--host', default=HOST, show_default=True)
+@click.option('--port', default=PORT, show_default=True)
+@click.option('--socket', 'socket_path', help='Listen on a Unix socket instead of TCP')
+@click.option('--workers', default=SERVICE_WORKERS, show_default=True, help='Number of jobs run at once')
+@click.option('--output-dir', default=OUTPUT_DIR, show_default=True, help='Directory finished reports are written to')
+@click.option('--no-precompiled-preamble', is_flag=True, help='Compile without the cached LaTeX preamble format')
+@click.option('--no-cache', is_flag=True, help='Always generate a new report, even if an identical one was issued')
+@click.option('--async-pipeline', is_flag=True,
+              help='Overlap the database connection with data loading in each job')
+@click.option('--retention-hours', default=RETENTION_HOURS, show_default=True,
+              help='Hours finished jobs and their reports are kept for')
+@click.option('--watched', is_flag=True,
+              help='archive_watcher is keeping the SeqID index up to date, so jobs look Seq IDs up without rescanning '
+                   'the archive')
+def service(host, port, socket_path, workers, output_dir, no_precompiled_preamble, no_cache, async_pipeline,
+            retention_hours, watched):
+    """
+    Runs the resident ROGA service
+    """
+    instrumentation.configure_logging()
+    if watched:
+        extract_report_data.REFRESH_INDEX = False
+    roga_service = RogaService(workers=workers, output_dir=output_dir, use_format=not no_precompiled_preamble,
+                               use_cache=not no_cache, use_async=async_pipeline, retention_hours=retention_hours)
+    roga_service.start()
+    serve(roga_service, host=host, port=port, socket_path=socket_path)
+
+
+if __name__ == '__main__':
+    service()
@@ -0,0 +1,153 @@
+import math
+
+
+# Attribute name and the combinedMetadata/GDCS column it is read from
+SAMPLE_FIELDS = (
+    ('seq_id', 'SeqID'),
+    ('sample_name', 'SampleName'),
+    ('genus', 'Genus'),
+    ('geneseekr_profile', 'GeneSeekr_Profile'),
+    ('vtyper_profile', 'Vtyper_Profile'),
+    ('e_coli_serotype', 'E_coli_Serotype'),
+    ('mash_reference_genome', 'MASH_ReferenceGenome'),
+    ('mlst_result', 'MLST_Result'),
+    ('rmlst_result', 'rMLST_Result'),
+    ('sistr_serovar', 'SISTR_serovar'),
+    ('sistr_serogroup', 'SISTR_serogroup'),
+    ('sistr_h1', 'SISTR_h1'),
+    ('sistr_h2', 'SISTR_h2'),
+    ('total_length', 'TotalLength'),
+    ('average_coverage_depth', 'AverageCoverageDepth'),
+    ('pipeline_version', 'PipelineVersion'),
+    ('gdcs_matches', 'Matches'),
+    ('gdcs_pass', 'Pass/Fail'),
+)
+
+# Fields that are parsed to numbers when the record is built
+NUMERIC_FIELDS = ('total_length', 'average_coverage_depth')
+
+# Marker registry. Each GeneSeekr marker has a fixed bit in SampleRecord.markers; new markers must be appended so
+# existing bit positions don't change.
+GENESEEKR_MARKERS = ('invA', 'stn', 'IGS', 'hlyA', 'inlJ', 'VT1', 'VT2', 'VT2f', 'uidA', 'eae')
+GENESEEKR_BITS = {marker: 1 << position for position, marker in enumerate(GENESEEKR_MARKERS)}
+
+# 'vt' is set when Vtyper detected any verotoxin gene (i.e. a Vtyper_Profile of 'vtx1a;vtx2c')
+MARKER_BITS = dict(GENESEEKR_BITS, vt=1 << len(GENESEEKR_MARKERS))
+
+
+class SampleRecord(object):
+    """
+    The subset of a sample's combinedMetadata and GDCS values that a ROGA actually uses. One record is built per Seq ID
+    at load time so the report never has to go back to the run's dataframe.
+
+    Text fields are stored as str ('' when missing), total_length as int and average_coverage_depth as float (None
+    when missing or unparseable). markers is an integer bitset of the markers detected in geneseekr_profile and
+    vtyper_profile, using the bit positions in MARKER_BITS.
+    """
+
+    __slots__ = tuple(attribute for attribute, column in SAMPLE_FIELDS) + ('run_folder', 'markers')
+
+    def __init__(self, run_folder=None, **values):
+        for attribute, column in SAMPLE_FIELDS:
+            setattr(self, attribute, values.get(attribute))
+        self.run_folder = run_folder
+        self.markers = parse_marker_bits(geneseekr_profile=self.geneseekr_profile,
+                                         vtyper_profile=self.vtyper_profile)
+
+    def has_marker(self, marker):
+        """
+        :param marker: Marker name from MARKER_BITS, i.e. 'uidA' or 'vt'
+        :return: True if the marker was detected for this sample
+        """
+        return bool(self.markers & MARKER_BITS[marker])
+
+    @classmethod
+    def from_row(cls, row, run_folder=None):
+        """
+        :param row: Mapping of column name to value, i.e. a combinedMetadata row joined with its GDCS row
+        :param run_folder: Name of the run folder the row was read from
+        :return: SampleRecord
+        """
+        values = {}
+        for attribute, column in SAMPLE_FIELDS:
+            values[attribute] = clean_text(row.get(column))
+        values['total_length'] = parse_length(values['total_length'])
+        values['average_coverage_depth'] = parse_coverage(values['average_coverage_depth'])
+        return cls(run_folder=run_folder, **values)
+
+    def to_dict(self):
+        """
+        :return: Dictionary of attribute name to value
+        """
+        record = {attribute: getattr(self, attribute) for attribute, column in SAMPLE_FIELDS}
+        record['run_folder'] = self.run_folder
+        return record
+
+    def __eq__(self, other):
+        return isinstance(other, SampleRecord) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return 'SampleRecord(seq_id={!r}, run_folder={!r})'.format(self.seq_id, self.run_folder)
+
+
+def clean_text(value):
+    """
+    :param value: Raw value read from a report
+    :return: Value as a string, or '' if the value is missing
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+def parse_marker_bits(geneseekr_profile, vtyper_profile):
+    """
+    :param geneseekr_profile: GeneSeekr_Profile value, i.e. 'uidA;eae;VT2'
+    :param vtyper_profile: Vtyper_Profile value, i.e. 'vtx2a'
+    :return: Integer bitset of the detected markers. Profile entries are matched as whole tokens, so 'VT2f' does not
+             also set 'VT2'.
+    """
+    bits = 0
+    for marker in (geneseekr_profile or '').split(';'):
+        bits |= GENESEEKR_BITS.get(marker.strip(), 0)
+
+    for gene in (vtyper_profile or '').split(';'):
+        if gene.strip().lower().startswith('vt'):
+            bits |= MARKER_BITS['vt']
+            break
+    return bits
+
+
+def marker_names(bits):
+    """
+    :param bits: Bitset retrieved from parse_marker_bits()
+    :return: List of the marker names set in bits, in registry order
+    """
+    return [marker for marker, bit in MARKER_BITS.items() if bits & bit]
+
+
+def parse_length(value):
+    """
+    :param value: TotalLength value, i.e. '4987654'
+    :return: Integer length, or None if it cannot be parsed
+    """
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_coverage(value):
+    """
+    :param value: AverageCoverageDepth value, i.e. '45.3X'
+    :return: Float coverage depth, or None if it cannot be parsed
+    """
+    try:
+        return float(str(value).replace('X', ''))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,218 @@
+import os
+import csv
+import click
+import random
+from datetime import datetime, timedelta
+
+
+"""
+Builds a synthetic COWBAT WGSspades archive for benchmarking and sizing.
+
+Creates N run folders, each with a reports/combinedMetadata.csv and reports/GDCS.csv holding M samples. The reports
+have the full set of COWBAT columns (not only those a ROGA reads) with plausible values for Escherichia, Salmonella
+and Listeria samples, and a fraction of samples are resequenced in a later run. Run folders are named and
+timestamped after consecutive run dates, so the archive is identical for a given seed.
+"""
+
+
+# Columns of a COWBAT combinedMetadata.csv, in the order the pipeline writes them
+METADATA_HEADER = ('SeqID', 'SampleName', 'Genus', 'N50', 'NumContigs', 'TotalLength', 'MeanInsertSize',
+                   'InsertSizeSTD', 'AverageCoverageDepth', 'CoverageDepthSTD', 'PercentGC', 'MASH_ReferenceGenome',
+                   'MASH_NumMatchingHashes', '16S_result', 'rMLST_Result', 'MLST_Result', 'MLST_gene_1_allele',
+                   'MLST_gene_2_allele', 'MLST_gene_3_allele', 'MLST_gene_4_allele', 'MLST_gene_5_allele',
+                   'MLST_gene_6_allele', 'MLST_gene_7_allele', 'E_coli_Serotype', 'SISTR_serovar_antigen',
+                   'SISTR_serovar_cgMLST', 'SISTR_serogroup', 'SISTR_h1', 'SISTR_h2', 'SISTR_serovar',
+                   'GeneSeekr_Profile', 'Vtyper_Profile', 'AMR_Profile', 'PlasmidExtractor', 'PipelineVersion',
+                   'AssemblyDate')
+
+# Columns of a COWBAT GDCS.csv, followed by one column per core gene
+GDCS_HEADER = ('Strain', 'Genus', 'Matches', 'MeanCoverage', 'Pass/Fail')
+GDCS_GENES = 48
+
+# Per-genus values samples are drawn from
+genus_profiles = {
+    'Escherichia': {'species': 'Escherichia coli',
+                    'length': 5300000,
+                    'gc': 50.6,
+                    'markers': ('uidA', 'eae', 'VT1', 'VT2', 'VT2f'),
+                    'always': ('uidA',),
+                    'mlst': ('11', '21', '17', '655', '1079'),
+                    'serotypes': ('O157(99.8):H7(100)', 'O26(100):H11(99.9)', 'O103(99.7):H2(100)',
+                                  'O111(100):H8(99.6)', 'O121(99.9):H19(100)')},
+    'Salmonella': {'species': 'Salmonella enterica',
+                   'length': 4800000,
+                   'gc': 52.1,
+                   'markers': ('invA', 'stn'),
+                   'always': ('invA',),
+                   'mlst': ('11', '19', '34', '32', '413'),
+                   'serovars': (('Enteritidis', 'D1', 'g,m', '-'), ('Typhimurium', 'B', 'i', '1,2'),
+                                ('Heidelberg', 'B', 'r', '1,2'), ('Infantis', 'C1', 'r', '1,5'),
+                                ('Kentucky', 'C2-C3', 'i', 'z6'))},
+    'Listeria': {'species': 'Listeria monocytogenes',
+                 'length': 3000000,
+                 'gc': 37.9,
+                 'markers': ('IGS', 'hlyA', 'inlJ'),
+                 'always': ('hlyA',),
+                 'mlst': ('1', '2', '5', '6', '9', '121')}
+}
+
+PIPELINE_VERSION = '0.1.5'
+
+# First run date of the archive
+START_DATE = datetime(2017, 1, 3)
+
+
+def get_run_folder_name(run_number, run_date):
+    """
+    :param run_number: Sequential number of the run
+    :param run_date: Date the run started
+    :return: MiSeq style run folder name, i.e. 170103_M02466_0001_000000000-A1B2C
+    """
+    return '{}_M02466_{:04d}_000000000-{}'.format(run_date.strftime('%y%m%d'), run_number,
+                                                  format(run_number * 7919 % 1048576, '05X'))
+
+
+def make_sample(rng, seqid, sample_name, genus):
+    """
+    :param rng: random.Random instance
+    :param seqid: OLC Seq ID
+    :param sample_name: LSTS ID
+    :param genus: Escherichia, Salmonella or Listeria
+    :return: Tuple of (combinedMetadata row, GDCS row) dictionaries
+    """
+    profile = genus_profiles[genus]
+    # The genus' defining marker is almost always detected; the rest are hit and miss
+    markers = [marker for marker in profile['markers']
+               if rng.random() < (0.97 if marker in profile['always'] else 0.4)]
+    coverage = rng.uniform(20, 150)
+    mlst = rng.choice(profile['mlst']) if rng.random() < 0.95 else 'new'
+
+    row = {column: 'ND' for column in METADATA_HEADER}
+    row.update({'SeqID': seqid,
+                'SampleName': sample_name,
+                'Genus': genus,
+                'N50': str(rng.randint(50000, 600000)),
+                'NumContigs': str(rng.randint(20, 400)),
+                'TotalLength': str(int(profile['length'] * rng.uniform(0.95, 1.05))),
+                'MeanInsertSize': '{:.2f}'.format(rng.uniform(250, 450)),
+                'InsertSizeSTD': '{:.2f}'.format(rng.uniform(60, 120)),
+                'AverageCoverageDepth': '{:.2f}X'.format(coverage),
+                'CoverageDepthSTD': '{:.2f}X'.format(coverage * rng.uniform(0.2, 0.5)),
+                'PercentGC': '{:.2f}'.format(profile['gc'] + rng.uniform(-0.3, 0.3)),
+                'MASH_ReferenceGenome': profile['species'] if rng.random() < 0.98 else 'Citrobacter freundii',
+                'MASH_NumMatchingHashes': '{}/1000'.format(rng.randint(900, 1000)),
+                '16S_result': genus,
+                'rMLST_Result': str(rng.randint(1, 60000)) if rng.random() < 0.8 else '-',
+                'MLST_Result': mlst,
+                'GeneSeekr_Profile': ';'.join(markers) if markers else '-',
+                'Vtyper_Profile': '-',
+                'AMR_Profile': rng.choice(('-', 'blaTEM-1B;tet(A)', 'aph(3\'\')-Ib;sul2', 'fosA7')),
+                'PlasmidExtractor': rng.choice(('-', 'IncFIB', 'IncI1;IncX1')),
+                'PipelineVersion': PIPELINE_VERSION,
+                'AssemblyDate': ''})
+    for gene in range(1, 8):
+        row['MLST_gene_{}_allele'.format(gene)] = str(rng.randint(1, 400))
+
+    if genus == 'Escherichia':
+        row['E_coli_Serotype'] = rng.choice(profile['serotypes'])
+        vt_genes = [gene for gene in ('vtx1a', 'vtx2a', 'vtx2c') if rng.random() < 0.4]
+        row['Vtyper_Profile'] = ';'.join(vt_genes) if vt_genes else 'ND'
+    elif genus == 'Salmonella':
+        serovar, serogroup, h1, h2 = rng.choice(profile['serovars'])
+        row.update({'SISTR_serovar_antigen': serovar, 'SISTR_serovar_cgMLST': serovar, 'SISTR_serogroup': serogroup,
+                    'SISTR_h1': h1 + ';', 'SISTR_h2': h2 + ';', 'SISTR_serovar': serovar})
+
+    matches = GDCS_GENES - (rng.randint(0, 3) if rng.random() < 0.1 else 0)
+    gdcs_row = {'Strain': seqid,
+                'Genus': genus,
+                'Matches': '{}/{}'.format(matches, GDCS_GENES),
+                'MeanCoverage': '{:.1f}'.format(coverage * rng.uniform(0.9, 1.1)),
+                'Pass/Fail': '+' if matches == GDCS_GENES else '-'}
+    for gene in range(GDCS_GENES):
+        gdcs_row['gene{:02d}'.format(gene)] = '{}_{}'.format(gene, rng.randint(1, 20))
+    return row, gdcs_row
+
+
+def generate_archive(root, runs, samples_per_run, seed=0, resequenced_fraction=0.02):
+    """
+    Writes a synthetic archive
+    :param root: Directory to create the run folders in (the equivalent of WGSspades)
+    :param runs: Number of run folders
+    :param samples_per_run: Number of samples in each run
+    :param seed: Random seed. The same seed always produces the same archive.
+    :param resequenced_fraction: Fraction of samples in each run that resequence a sample from an earlier run
+    :return: Dictionary containing each Seq ID as keys and its genus as values
+    """
+    rng = random.Random(seed)
+    genera = sorted(genus_profiles)
+    sample_genus = {}
+    sample_names = {}
+    # Seq IDs in the order they were first sequenced, to draw resequenced samples from
+    sequenced = []
+    sample_number = 0
+
+    for run_number in range(1, runs + 1):
+        run_date = START_DATE + timedelta(days=3 * (run_number - 1))
+        reports_dir = os.path.join(root, get_run_folder_name(run_number, run_date), 'reports')
+        os.makedirs(reports_dir, exist_ok=True)
+
+        metadata_rows = []
+        gdcs_rows = []
+        # Only samples from earlier runs are resequenced, each at most once per run, so a Seq ID appears once per run
+        resequenceable = list(sequenced)
+        for position in range(samples_per_run):
+            if resequenceable and rng.random() < resequenced_fraction:
+                # Resequence an earlier sample under the same Seq ID
+                seqid = resequenceable.pop(rng.randrange(len(resequenceable)))
+                genus = sample_genus[seqid]
+                sample_name = sample_names[seqid] + '-RESEQ'
+            else:
+                sample_number += 1
+                genus = genera[rng.randrange(len(genera))]
+                seqid = '{}-SEQ-{:04d}'.format(run_date.year, sample_number)
+                sample_name = 'LSTS-{}'.format(sample_number)
+                sample_genus[seqid] = genus
+                sample_names[seqid] = sample_name
+                sequenced.append(seqid)
+            row, gdcs_row = make_sample(rng, seqid, sample_name, genus)
+            row['AssemblyDate'] = run_date.strftime('%Y-%m-%d')
+            metadata_rows.append(row)
+            gdcs_rows.append(gdcs_row)
+
+        write_report(os.path.join(reports_dir, 'combinedMetadata.csv'), METADATA_HEADER, metadata_rows, run_date)
+        write_report(os.path.join(reports_dir, 'GDCS.csv'),
+                     GDCS_HEADER + tuple('gene{:02d}'.format(gene) for gene in range(GDCS_GENES)), gdcs_rows, run_date)
+
+    return sample_genus
+
+
+def write_report(path, header, rows, run_date):
+    """
+    :param path: Path to write the CSV to
+    :param header: Column names
+    :param rows: List of row dictionaries
+    :param run_date: Date of the run, used as the file's mtime so newest-first ordering is reproducible
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        writer.writerows(rows)
+    timestamp = (run_date - datetime(1970, 1, 1)).total_seconds()
+    os.utime(path, (timestamp, timestamp))
+
+
+@click.command()
+@click.argument('root', type=click.Path(file_okay=False))
+@click.option('--runs', default=100, show_default=True, help='Number of run folders')
+@click.option('--samples', default=48, show_default=True, help='Number of samples in each run')
+@click.option('--seed', default=0, show_default=True, help='Random seed')
+def generate(root, runs, samples, seed):
+    """
+    Writes a synthetic COWBAT archive to ROOT
+    """
+    sample_genus = generate_archive(root, runs=runs, samples_per_run=samples, seed=seed)
+    print('Wrote {} run folders holding {} samples to {}'.format(runs, len(sample_genus), root))
+
+
+if __name__ == '__main__':
+    generate()
@@ -0,0 +1,90 @@
+import pytest
+import sqlalchemy as sa
+
+import database
+import instrumentation
+
+
+"""
+Report ID allocation against the SQLite stand-in database selected with AUTOROGA_DATABASE_URL.
+"""
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """
+    Points database.get_engine() at a fresh SQLite database for the duration of a test
+    """
+    monkeypatch.setenv(database.DATABASE_URL_ENV, 'sqlite:///{}'.format(tmp_path / 'autoroga.sqlite'))
+    monkeypatch.setattr(database, '_engine', None)
+    yield database.get_engine()
+    database.get_engine().dispose()
+
+
+def count_reports(engine):
+    with engine.connect() as con:
+        return con.execute(sa.select(sa.func.count()).select_from(database.autoroga_project_table)).scalar()
+
+
+def test_update_db_allocates_consecutive_ids(engine):
+    first = database.update_db(date='2017-01-03', year='2017', genus='Listeria', lab='GTA-CFIA', source='flour')
+    second = database.update_db(date='2017-01-03', year='2017', genus='Salmonella', lab='OLC-CFIA', source='eggs')
+    assert (first, second) == ('2017-ROGA-0001', '2017-ROGA-0002')
+    assert count_reports(engine) == 2
+
+
+def test_insert_report_returns_id_in_one_round_trip(engine):
+    counters_before, stages_before = instrumentation.snapshot()
+    with engine.begin() as con:
+        roga_id = database.insert_report(con, date='2017-01-03', genus='Escherichia', lab='BUR-CFIA',
+                                         source='ground beef')
+        row = con.execute(sa.select(database.autoroga_project_table).where(
+            database.autoroga_project_table.c.roga_id == roga_id)).one()
+    counters_after, stages_after = instrumentation.snapshot()
+
+    # The ID comes back from the INSERT itself through RETURNING, not from a second query
+    assert counters_after['db_round_trips'] - counters_before.get('db_round_trips', 0) == 1
+    assert (row.genus, row.lab, row.source, str(row.date)) == ('Escherichia', 'BUR-CFIA', 'ground beef', '2017-01-03')
+
+
+def test_reserve_report_ids_allocates_consecutive_ids_in_order(engine):
+    database.update_db(date='2017-01-03', year='2017', genus='Listeria', lab='GTA-CFIA', source='flour')
+    reports = [('Salmonella', 'GTA-CFIA', 'eggs'),
+               ('Listeria', 'DAR-CFIA', 'cheese'),
+               ('Escherichia', 'OLF-CFIA', 'beef')]
+    report_ids = database.reserve_report_ids(reports, date='2017-01-04', year='2017')
+    assert report_ids == ['2017-ROGA-0002', '2017-ROGA-0003', '2017-ROGA-0004']
+
+    with engine.connect() as con:
+        columns = database.autoroga_project_table.c
+        rows = con.execute(sa.select(columns.roga_id, columns.genus, columns.source).order_by(columns.roga_id)).all()
+    assert [tuple(row) for row in rows[1:]] == [(2, 'Salmonella', 'eggs'), (3, 'Listeria', 'cheese'),
+                                                (4, 'Escherichia', 'beef')]
+
+
+def test_reserve_report_ids_on_a_connection_checked_out_ahead_of_time(engine):
+    con = engine.connect()
+    try:
+        report_ids = database.reserve_report_ids([('Listeria', 'GTA-CFIA', 'flour')], date='2017-01-03', year='2017',
+                                                 con=con)
+    finally:
+        con.close()
+    assert report_ids == ['2017-ROGA-0001']
+    assert count_reports(engine) == 1
+
+
+def test_reserve_report_ids_allocates_nothing_if_any_insert_fails(engine, monkeypatch):
+    insert_report = database.insert_report
+    calls = []
+
+    def failing_insert(con, **values):
+        calls.append(values)
+        if len(calls) == 2:
+            raise RuntimeError('insert failed')
+        return insert_report(con, **values)
+    monkeypatch.setattr(database, 'insert_report', failing_insert)
+
+    with pytest.raises(RuntimeError):
+        database.reserve_report_ids([('Listeria', 'GTA-CFIA', 'flour'), ('Salmonella', 'GTA-CFIA', 'eggs')],
+                                    date='2017-01-03', year='2017')
+    assert count_reports(engine) == 0